@@ -16,6 +16,7 @@ load_dotenv()
 
 # Setup PyMySQL as MySQLdb before any Django imports (only when using MySQL)
 import os
+import sys
 USE_SQLITE = os.getenv('USE_SQLITE', '1') == '1'
 
 if not USE_SQLITE:
@@ -24,6 +25,9 @@ if not USE_SQLITE:
 
 from pathlib import Path
 
+# `manage.py test`: background work runs inline so it never races the test database
+TESTING = sys.argv[1:2] == ['test']
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -112,6 +116,24 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Local memory by default. It is per process, so with several workers point
+# CACHE_BACKEND/CACHE_LOCATION at a shared cache (e.g. Redis or Memcached) so
+# version bumps reach every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'library-manager'),
+    }
+}
+
+# Anonymous browse responses, keyed on a version counter bumped by model signals
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', '300'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -151,6 +173,43 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# How MediaView (things/media.py) sends files: 'django', 'accel' (nginx
+# X-Accel-Redirect to MEDIA_ACCEL_PREFIX) or 'sendfile' (X-Sendfile)
+MEDIA_SERVE_MODE = os.getenv('MEDIA_SERVE_MODE', 'django')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Minimum lifetime, in seconds, of the signed URLs for non-public item images
+MEDIA_SIGNED_URL_LIFETIME = int(os.getenv('MEDIA_SIGNED_URL_LIFETIME', 6 * 60 * 60))
+
+# Where newly approved items are merged into the similar-items lists (things/similarity.py): 'thread' or 'sync'
+SIMILAR_ITEMS_EXECUTOR = os.getenv('SIMILAR_ITEMS_EXECUTOR', 'sync' if TESTING else 'thread')
+
+# Offline place list used to geocode User.location (things/geo.py); defaults to things/data/gazetteer.csv
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH') or None
+
+# Uploads over this size are rejected while the request is still being read
+# (things/uploads.py); item images are stored once per content hash (things/storage.py)
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', str(10 * 1024 * 1024)))
+FILE_UPLOAD_HANDLERS = [
+    'things.uploads.SizeLimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Item image variants (see things/images.py): 'thread', 'process' or 'sync'
+IMAGE_PIPELINE_EXECUTOR = os.getenv('IMAGE_PIPELINE_EXECUTOR', 'sync' if TESTING else 'thread')
+IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', '2'))
+
+# Badge counters (things/counters.py) older than this many seconds are rebuilt from COUNT queries
+COUNTER_MAX_AGE = int(os.getenv('COUNTER_MAX_AGE', '3600'))
+
+# Server push (things/realtime.py, served under ASGI): 'things.realtime.LocalBackend' for a single
+# worker, 'things.realtime.RedisBackend' to relay events between workers through REALTIME_REDIS_URL
+REALTIME_BACKEND = os.getenv('REALTIME_BACKEND', 'things.realtime.LocalBackend')
+REALTIME_REDIS_URL = os.getenv('REALTIME_REDIS_URL', 'redis://localhost:6379/0')
+REALTIME_HEARTBEAT = int(os.getenv('REALTIME_HEARTBEAT', '25'))
+# Seconds a stream ticket from /api/events/ticket/ stays redeemable (once)
+REALTIME_TICKET_TTL = int(os.getenv('REALTIME_TICKET_TTL', '30'))
+
 # CORS Settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ThingsConfig(AppConfig):
     name = 'things'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,57 @@
+"""
+Bulk item creation for partner imports.
+
+`create_items` inserts validated item data with `bulk_create`, which skips
+the model signals, so it does their work once per batch instead: facet
+counts, the SQLite search index, coordinates copied from the owner and the
+catalog version. Imported items always start out pending verification and
+without an image, so there are no image references or similar-item lists to
+update.
+
+Backends that don't return primary keys from bulk inserts (MySQL) get them
+read back in the same transaction, so callers always see saved items.
+"""
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .models import Item
+from . import facets, geo, search, versioning
+
+BATCH_SIZE = 500
+# Largest list accepted by the bulk_create endpoint; bigger imports use the import_items command
+MAX_REQUEST_ITEMS = 1000
+
+
+def _read_back_pks(owner, batch, after):
+    """Give `batch` the primary keys of its rows: the owner's items after pk `after`, in insertion order"""
+    rows = iter(Item.objects.filter(owner=owner, pk__gt=after).order_by('pk').values_list('pk', 'name'))
+    for item in batch:
+        # Rows someone else committed in between are skipped over
+        for pk, name in rows:
+            if name == item.name:
+                item.pk = pk
+                break
+
+
+def create_items(owner, rows, batch_size=BATCH_SIZE):
+    """Create one item per validated data dict in `rows`, all in one transaction"""
+    point = None if owner.latitude is None else (owner.latitude, owner.longitude)
+    location = geo.coordinates_fields(point)
+    items = []
+    for data in rows:
+        data = {name: value for name, value in data.items() if name not in ('status', 'image')}
+        items.append(Item(owner=owner, **data, **location))
+
+    with transaction.atomic():
+        read_back = not connection.features.can_return_rows_from_bulk_insert
+        if read_back:
+            last_pk = Item.objects.filter(owner=owner).aggregate(last=Max('pk'))['last'] or 0
+        for start in range(0, len(items), batch_size):
+            batch = Item.objects.bulk_create(items[start:start + batch_size])
+            if read_back:
+                _read_back_pks(owner, batch, last_pk)
+                last_pk = batch[-1].pk
+            search.index_items(batch)
+        facets.record_created(facets.facet_key(item) for item in items)
+        versioning.bump(versioning.CATALOG)
+    return items
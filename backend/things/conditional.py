@@ -0,0 +1,50 @@
+"""
+Conditional GET (ETag / Last-Modified) for API views.
+
+Validators come from the version counters of the scopes a view reads, so a
+304 is decided before the database is touched or anything is serialized.
+"""
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .media import signing_window
+from .versioning import get_versions
+
+
+def validators(request, scopes):
+    versions = get_versions(scopes)
+    user = request.user.pk if request.user.is_authenticated else 'anon'
+    renderer = getattr(request, 'accepted_renderer', None)
+    # The signing window changes when the signed media URLs in the body would
+    raw = f'{request.get_full_path()}|{user}|{getattr(renderer, "format", "")}|{versions}|{signing_window()}'
+    etag = '"%s"' % hashlib.sha1(raw.encode('utf-8')).hexdigest()[:32]
+    return etag, max(versions) // 1000
+
+
+def conditional_get(method):
+    """
+    Answer GET/HEAD with 304 Not Modified when the client's validators still
+    match. The view must define `get_version_scopes()`.
+    """
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return method(self, request, *args, **kwargs)
+
+        etag, last_modified = validators(request, self.get_version_scopes())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = method(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Let clients keep the body but revalidate on every use
+        response['Cache-Control'] = 'private, no-cache' if request.user.is_authenticated else 'no-cache'
+        response['Vary'] = 'Authorization'
+        return response
+    return wrapper
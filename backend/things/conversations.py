@@ -0,0 +1,182 @@
+"""
+Conversation threads over the flat Message table.
+
+Every message belongs to the Conversation of its two participants (and item,
+if any). The conversation row carries the last message, a preview and one
+unread count per participant, so the conversation list is a single indexed
+read of one row per thread.
+
+The counters only ever move with single UPDATE statements built from F()
+expressions, so concurrent senders can't lose each other's increments.
+`attach` runs before messages are inserted and `record` after; the Message
+signals call them for ordinary saves and bulk writers (see things.overdue)
+call them around bulk_create. The same helpers keep each user's unread badge
+count (things.counters) in step.
+"""
+from django.db.models import Case, F, Q, Value, When
+from django.utils.text import Truncator
+
+from .models import Conversation, Message
+from . import counters, versioning
+
+PREVIEW_LENGTH = 255
+
+
+def participants(user_id, other_id):
+    """(user_a, user_b): the lower id always comes first"""
+    return (user_id, other_id) if user_id <= other_id else (other_id, user_id)
+
+
+def thread_key(message):
+    return participants(message.sender_id, message.recipient_id) + (message.item_id,)
+
+
+def stored_key(key):
+    """The Conversation.thread_key value for a (user_a, user_b, item) key"""
+    a, b, item_id = key
+    return f"{a}:{b}:{'' if item_id is None else item_id}"
+
+
+def unread_field(message):
+    """The counter that tracks `message` for its recipient"""
+    return 'unread_a' if message.recipient_id == participants(message.sender_id, message.recipient_id)[0] else 'unread_b'
+
+
+def preview(subject, body):
+    return Truncator(' '.join((body or subject or '').split())).chars(PREVIEW_LENGTH)
+
+
+def _existing(keys):
+    rows = Conversation.objects.filter(
+        thread_key__in=[stored_key(key) for key in keys],
+    ).values_list('user_a_id', 'user_b_id', 'item_id', 'id')
+    return {(a, b, item_id): pk for a, b, item_id, pk in rows}
+
+
+def attach(messages):
+    """Point unsaved messages at their conversations, creating the missing ones in one INSERT"""
+    pending = [message for message in messages if message.conversation_id is None]
+    if not pending:
+        return
+    keys = {thread_key(message) for message in pending}
+    found = _existing(keys)
+    missing = keys - set(found)
+    if missing:
+        started = {}
+        for message in pending:
+            key = thread_key(message)
+            if key in missing:
+                started[key] = min(started.get(key, message.created_at), message.created_at)
+        # A concurrent sender may create the same thread; the unique thread_key keeps one
+        Conversation.objects.bulk_create([
+            Conversation(
+                user_a_id=a, user_b_id=b, item_id=item_id, thread_key=stored_key((a, b, item_id)),
+                last_message_at=started[(a, b, item_id)],
+            )
+            for a, b, item_id in missing
+        ], ignore_conflicts=True)
+        found.update(_existing(missing))
+    for message in pending:
+        message.conversation_id = found[thread_key(message)]
+
+
+def _if_newer(newer, field, value):
+    return Case(When(newer, then=Value(value)), default=F(field), output_field=Conversation._meta.get_field(field))
+
+
+def record(messages):
+    """Fold saved messages into their conversations with one UPDATE per conversation"""
+    threads, unread_by_user = {}, {}
+    for message in messages:
+        threads.setdefault(message.conversation_id, []).append(message)
+        if not message.is_read:
+            unread_by_user[message.recipient_id] = unread_by_user.get(message.recipient_id, 0) + 1
+    counters.add(counters.UNREAD_MESSAGES, unread_by_user)
+    for conversation_id, thread in threads.items():
+        latest = max(thread, key=lambda message: (message.created_at, message.pk))
+        unread = {'unread_a': 0, 'unread_b': 0}
+        for message in thread:
+            if not message.is_read:
+                unread[unread_field(message)] += 1
+        newer = Q(last_message_at__lte=latest.created_at)
+        Conversation.objects.filter(pk=conversation_id).update(
+            unread_a=F('unread_a') + unread['unread_a'],
+            unread_b=F('unread_b') + unread['unread_b'],
+            last_message=_if_newer(newer, 'last_message', latest.pk),
+            last_message_preview=_if_newer(newer, 'last_message_preview', preview(latest.subject, latest.body)),
+            last_sender=_if_newer(newer, 'last_sender', latest.sender_id),
+            # Last, because MySQL evaluates SET assignments left to right
+            last_message_at=_if_newer(newer, 'last_message_at', latest.created_at),
+        )
+
+
+def adjust_unread(message, delta):
+    """Move the recipient's unread count when a message changes read state or goes away"""
+    field = unread_field(message)
+    queryset = Conversation.objects.filter(pk=message.conversation_id)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+    counters.add(counters.UNREAD_MESSAGES, {message.recipient_id: delta})
+
+
+def refresh_last_message(conversation_id):
+    """Re-derive the last-message fields after that message was edited or deleted"""
+    latest = Message.objects.filter(conversation_id=conversation_id).order_by('-created_at', '-id').first()
+    if latest is None:
+        Conversation.objects.filter(pk=conversation_id).delete()
+        return
+    Conversation.objects.filter(pk=conversation_id).update(
+        last_message=latest, last_message_preview=preview(latest.subject, latest.body),
+        last_sender_id=latest.sender_id, last_message_at=latest.created_at,
+    )
+
+
+def mark_read(conversation, user):
+    """Mark everything `user` received in the conversation as read; returns how many messages changed"""
+    changed = Message.objects.filter(conversation=conversation, recipient=user, is_read=False).update(is_read=True)
+    if changed:
+        # Only what this call marked read: a message arriving meanwhile stays counted, here and in the badge
+        field = 'unread_a' if user.pk == conversation.user_a_id else 'unread_b'
+        Conversation.objects.filter(pk=conversation.pk, **{f'{field}__gte': changed}).update(**{field: F(field) - changed})
+        conversation.refresh_from_db(fields=[field])
+        counters.add(counters.UNREAD_MESSAGES, {user.pk: -changed})
+        # update() skips the signals that invalidate cached message lists
+        versioning.bump(
+            versioning.messages_scope(conversation.user_a_id), versioning.messages_scope(conversation.user_b_id),
+        )
+    return changed
+
+
+def backfill(conversation_model, message_model):
+    """
+    Build conversations for existing messages. Takes the model classes so
+    data migrations can pass historical models. Returns the number created.
+    """
+    threads = {}
+    columns = ('id', 'sender_id', 'recipient_id', 'item_id', 'subject', 'body', 'is_read', 'created_at')
+    for row in message_model.objects.order_by('created_at', 'id').values_list(*columns).iterator(chunk_size=2000):
+        pk, sender_id, recipient_id, item_id, subject, body, is_read, created_at = row
+        a, b = participants(sender_id, recipient_id)
+        thread = threads.setdefault((a, b, item_id), {'unread_a': 0, 'unread_b': 0, 'created_at': created_at})
+        thread.update(
+            last_message_id=pk, last_sender_id=sender_id, last_message_at=created_at,
+            last_message_preview=preview(subject, body),
+        )
+        if not is_read:
+            thread['unread_a' if recipient_id == a else 'unread_b'] += 1
+
+    # Models from before migration 0019 have no thread_key; that migration fills it in
+    keyed = any(field.name == 'thread_key' for field in conversation_model._meta.fields)
+    conversation_model.objects.bulk_create([
+        conversation_model(
+            user_a_id=a, user_b_id=b, item_id=item_id, **thread,
+            **({'thread_key': stored_key((a, b, item_id))} if keyed else {}),
+        )
+        for (a, b, item_id), thread in threads.items()
+    ], batch_size=1000)
+    for pk, a, b, item_id in conversation_model.objects.values_list('id', 'user_a_id', 'user_b_id', 'item_id'):
+        message_model.objects.filter(
+            Q(sender_id=a, recipient_id=b) | Q(sender_id=b, recipient_id=a), item_id=item_id,
+        ).update(conversation_id=pk)
+    return len(threads)
@@ -0,0 +1,71 @@
+"""
+Badge counts: unread messages and pending incoming borrow requests per user,
+plus items awaiting verification for staff.
+
+Per-user counts live in UserCounter and move with F() UPDATEs inside the
+transaction that changes what they count: the Message and BorrowRequest
+signals, the conversation helpers and the set-based writers all call `add`.
+Nothing is inserted on the write path. A user without a row is skipped, and
+their next read rebuilds the row from two indexed COUNT queries. Rows older
+than COUNTER_MAX_AGE are rebuilt the same way, so drift from a missed update
+heals on its own; a rebuild that changes the values moves the user's version
+scopes so clients holding the old counts don't get a 304. The staff count is summed from the maintained facet cells.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import BorrowRequest, Item, ItemFacetCount, Message, UserCounter
+from . import versioning
+
+UNREAD_MESSAGES = 'unread_messages'
+PENDING_REQUESTS = 'pending_requests'
+FIELDS = (UNREAD_MESSAGES, PENDING_REQUESTS)
+
+
+def add(field, deltas):
+    """Apply {user_id: delta} to `field`, with one UPDATE per distinct delta"""
+    by_delta = {}
+    for user_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(user_id)
+    for delta, user_ids in by_delta.items():
+        if delta < 0:
+            # A count that would go negative has drifted; drop the row so the next read rebuilds it
+            UserCounter.objects.filter(user_id__in=user_ids, **{f'{field}__lt': -delta}).delete()
+        UserCounter.objects.filter(user_id__in=user_ids).update(**{field: F(field) + delta})
+
+
+def counted(user_id):
+    """The user's counts straight from the tables"""
+    owned_items = Item.objects.filter(owner_id=user_id).values('id')
+    return {
+        UNREAD_MESSAGES: Message.objects.filter(recipient_id=user_id, is_read=False).count(),
+        PENDING_REQUESTS: BorrowRequest.objects.filter(item__in=owned_items, status='PENDING').count(),
+    }
+
+
+def reconcile(user_id):
+    values = counted(user_id)
+    previous = UserCounter.objects.filter(user_id=user_id).values(*FIELDS).first()
+    UserCounter.objects.update_or_create(user_id=user_id, defaults={**values, 'reconciled_at': timezone.now()})
+    if previous != values:
+        # Counts served from the missing or drifted row had the same validators; move them on
+        versioning.bump(versioning.messages_scope(user_id), versioning.borrows_scope(user_id))
+    return values
+
+
+def for_user(user):
+    """Badge counts for `user`: one primary-key read unless the row is missing or stale"""
+    max_age = datetime.timedelta(seconds=getattr(settings, 'COUNTER_MAX_AGE', 3600))
+    row = UserCounter.objects.filter(user_id=user.pk).values(*FIELDS, 'reconciled_at').first()
+    if row is None or row['reconciled_at'] < timezone.now() - max_age:
+        counts = reconcile(user.pk)
+    else:
+        counts = {field: row[field] for field in FIELDS}
+    if user.role == 'STAFF':
+        pending = ItemFacetCount.objects.filter(status='PENDING_VERIFICATION').aggregate(total=Sum('count'))
+        counts['pending_verifications'] = pending['total'] or 0
+    return counts
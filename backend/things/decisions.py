@@ -0,0 +1,159 @@
+"""
+Batch approve/deny for borrow requests.
+
+`decide` takes a list of (request id, 'approve' | 'deny') pairs and applies
+them in order with the same rules as the single-request actions, so the
+outcome is what the equivalent sequence of approve/deny calls would give,
+including approvals that deny overlapping pending requests. The work is a
+fixed number of statements whatever the batch size, all in one transaction:
+
+1. lock the items involved and read their owners (the ownership check);
+2. lock the requests themselves;
+3. read every pending or booked request on the items being approved;
+4. one UPDATE for approvals, one for denials and one marking items reserved.
+
+Set-based updates skip the model signals, so facet counts, badge counters,
+cached list versions and push events are handled here.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Q, Value, When
+from django.utils import timezone
+
+from .models import BorrowRequest, Item
+from . import counters, facets, realtime, reservations, versioning
+
+APPROVE, DENY = 'approve', 'deny'
+# Largest list accepted by the batch endpoint
+MAX_REQUEST_DECISIONS = 500
+
+NOT_FOUND = 'Not found.'
+NOT_OWNER = 'Only the item owner can {} this request'
+ALREADY_PROCESSED = 'Request already processed'
+BOOKED = 'The item is already booked for some of those dates'
+
+
+def _overlaps(start, end, ranges):
+    return any(start <= other_end and end >= other_start for other_start, other_end in ranges)
+
+
+def decide(user, decisions):
+    """
+    Apply `decisions` as `user` and return one outcome per entry, in order:
+    {'id': ..., 'status': <new status>} or {'id': ..., 'error': <message>}.
+    Staff may decide any request, customers only those for their own items.
+    """
+    ids = [pk for pk, _ in decisions]
+    today = timezone.localdate()
+    with transaction.atomic():
+        # Items before requests, in pk order: the lock order the single-request actions use
+        items = {
+            row[0]: row for row in Item.objects.select_for_update()
+            .filter(pk__in=BorrowRequest.objects.filter(pk__in=ids).values('item_id'))
+            .order_by('pk').values_list('id', 'owner_id', *facets.FACET_FIELDS)
+        }
+        requests = {
+            row[0]: row for row in BorrowRequest.objects.select_for_update()
+            .filter(pk__in=ids).order_by('pk')
+            .values_list('id', 'item_id', 'borrower_id', 'status', 'start_date', 'end_date')
+        }
+
+        approving_items = {
+            requests[pk][1] for pk, choice in decisions
+            if choice == APPROVE and pk in requests and requests[pk][3] == 'PENDING'
+        }
+        # Existing bookings to check against and pending requests an approval may deny
+        booked, pending = {}, {}
+        if approving_items:
+            rows = BorrowRequest.objects.select_for_update().filter(
+                Q(status='PENDING') | Q(status__in=reservations.BOOKED_STATUSES), item_id__in=approving_items,
+            ).values_list('id', 'item_id', 'borrower_id', 'status', 'start_date', 'end_date')
+            for pk, item_id, borrower_id, current, start, end in rows:
+                if current == 'PENDING':
+                    pending.setdefault(item_id, []).append((pk, borrower_id, start, end))
+                else:
+                    # An overdue loan runs on until the item comes back
+                    booked.setdefault(item_id, []).append((start, datetime.date.max if current == 'OVERDUE' else end))
+
+        statuses = {pk: row[3] for pk, row in requests.items()}
+        borrowers = {pk: row[2] for pk, row in requests.items()}
+        request_items = {pk: row[1] for pk, row in requests.items()}
+        approved, denied, outcomes = {}, set(), []
+        for pk, choice in decisions:
+            row = requests.get(pk)
+            if row is None:
+                outcomes.append({'id': pk, 'error': NOT_FOUND})
+                continue
+            _, item_id, borrower_id, _, start, end = row
+            if user.role != 'STAFF' and items[item_id][1] != user.pk:
+                # Matches the single actions: 403 for the borrower, 404 for everyone else
+                error = NOT_OWNER.format(choice) if borrower_id == user.pk else NOT_FOUND
+                outcomes.append({'id': pk, 'error': error})
+                continue
+            if statuses[pk] != 'PENDING':
+                outcomes.append({'id': pk, 'error': ALREADY_PROCESSED})
+                continue
+
+            if choice == DENY:
+                statuses[pk] = 'DENIED'
+                denied.add(pk)
+                outcomes.append({'id': pk, 'status': 'DENIED'})
+                continue
+
+            if _overlaps(start, end, booked.get(item_id, [])):
+                outcomes.append({'id': pk, 'error': BOOKED})
+                continue
+            statuses[pk] = 'APPROVED'
+            approved[pk] = (item_id, start, end)
+            booked.setdefault(item_id, []).append((start, end))
+            for other, other_borrower, other_start, other_end in pending.get(item_id, []):
+                if statuses.get(other, 'PENDING') == 'PENDING' and _overlaps(other_start, other_end, [(start, end)]):
+                    statuses[other] = 'DENIED'
+                    borrowers[other] = other_borrower
+                    request_items[other] = item_id
+                    denied.add(other)
+            outcomes.append({'id': pk, 'status': 'APPROVED'})
+
+        if approved:
+            BorrowRequest.objects.filter(pk__in=list(approved)).update(
+                status='APPROVED',
+                due_date=Case(
+                    *[When(pk=pk, then=Value(reservations.due_at(end))) for pk, (_, _, end) in approved.items()],
+                    output_field=DateTimeField(),
+                ),
+            )
+        if denied:
+            BorrowRequest.objects.filter(pk__in=list(denied)).update(status='DENIED')
+
+        # Bookings that start later leave the item browsable until then
+        reserving = {
+            item_id for item_id, start, _ in approved.values()
+            if start <= today and items[item_id][4] != 'RESERVED'
+        }
+        if reserving:
+            Item.objects.filter(pk__in=list(reserving)).update(status='RESERVED')
+            for item_id in reserving:
+                old_key = items[item_id][2:]
+                facets.record_change(old_key, old_key[:2] + ('RESERVED',))
+                realtime.item_changed(item_id, items[item_id][1], 'RESERVED')
+
+        changed = set(approved) | denied
+        if changed:
+            # Every changed request was pending until now
+            pending_by_owner = {}
+            for pk in changed:
+                owner_id = items[request_items[pk]][1]
+                pending_by_owner[owner_id] = pending_by_owner.get(owner_id, 0) - 1
+            counters.add(counters.PENDING_REQUESTS, pending_by_owner)
+            for pk in changed:
+                item_id = request_items[pk]
+                realtime.request_changed(pk, item_id, borrowers[pk], items[item_id][1], statuses[pk])
+            owners = {items[item_id][1] for item_id in items}
+            versioning.bump(
+                versioning.ALL_BORROWS,
+                *{versioning.borrows_scope(user_id) for user_id in owners | {borrowers[pk] for pk in changed}},
+            )
+        if reserving:
+            versioning.bump(versioning.CATALOG)
+    return outcomes
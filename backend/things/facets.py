@@ -0,0 +1,117 @@
+"""
+Facet counts for item browsing.
+
+Counts live in ItemFacetCount, one row per (category, ownership_type, status)
+cell. The Item signals move a row between cells as it is created, edited or
+deleted, so reading facets never scans the item table: the handful of cells
+is summed in Python for whatever filters the caller applied.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .models import Item, ItemFacetCount
+
+FACET_FIELDS = ('category', 'ownership_type', 'status')
+
+
+def facet_key(item, fallback=None):
+    """
+    The cell an item counts towards.
+
+    Deferred facet fields are taken from `fallback` (the stored key); without
+    one, None is returned rather than triggering a query per field.
+    """
+    values = item.__dict__
+    key = []
+    for index, field in enumerate(FACET_FIELDS):
+        if field in values:
+            key.append(values[field])
+        elif fallback is not None:
+            key.append(fallback[index])
+        else:
+            return None
+    return tuple(key)
+
+
+def stored_key(pk):
+    return Item.objects.filter(pk=pk).values_list(*FACET_FIELDS).first()
+
+
+def _bump(key, delta):
+    cell = dict(zip(FACET_FIELDS, key))
+    if ItemFacetCount.objects.filter(**cell).update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            ItemFacetCount.objects.create(count=delta, **cell)
+    except IntegrityError:
+        # Another writer created the cell first
+        ItemFacetCount.objects.filter(**cell).update(count=F('count') + delta)
+
+
+def record_change(old_key, new_key):
+    """Move one item from `old_key` to `new_key`; either may be None (create/delete)"""
+    if old_key == new_key:
+        return
+    if old_key is not None:
+        _bump(old_key, -1)
+    if new_key is not None:
+        _bump(new_key, 1)
+
+
+def record_created(keys):
+    """Count a batch of new items (bulk_create skips the signals) with one update per cell"""
+    for key, total in Counter(keys).items():
+        _bump(key, total)
+
+
+def rebuild():
+    """Recompute every cell from the item table"""
+    rows = Item.objects.values(*FACET_FIELDS).annotate(total=Count('id')).order_by()
+    with transaction.atomic():
+        ItemFacetCount.objects.all().delete()
+        ItemFacetCount.objects.bulk_create(
+            ItemFacetCount(count=row.pop('total'), **row) for row in rows
+        )
+
+
+def _summarize(cells, filters):
+    """Disjunctive facets: each field's counts honour the filters on the other fields"""
+    facets = {field: Counter() for field in FACET_FIELDS}
+    total = 0
+    for cell, count in cells:
+        matches = {field: filters.get(field) in (None, cell[field]) for field in FACET_FIELDS}
+        if all(matches.values()):
+            total += count
+        for field in FACET_FIELDS:
+            if all(ok for other, ok in matches.items() if other != field):
+                facets[field][cell[field]] += count
+    result = {'total': total}
+    for field in FACET_FIELDS:
+        result[field] = {value: count for value, count in sorted(facets[field].items()) if count}
+    return result
+
+
+def facet_counts(user=None, filters=None):
+    """
+    Facet counts over the items `user` may browse.
+
+    Approved items come from the maintained cells; an authenticated user's own
+    non-approved items (a short list, served by the owner index) are added on
+    top, mirroring the visibility rules of ItemViewSet.
+    """
+    filters = {field: value for field, value in (filters or {}).items() if field in FACET_FIELDS and value}
+    cells = [
+        ({'category': c, 'ownership_type': o, 'status': s}, n)
+        for c, o, s, n in ItemFacetCount.objects.filter(status='APPROVED', count__gt=0)
+        .values_list('category', 'ownership_type', 'status', 'count')
+    ]
+    if user is not None and user.is_authenticated:
+        own = (
+            Item.objects.filter(owner=user).exclude(status='APPROVED')
+            .values(*FACET_FIELDS).annotate(total=Count('id')).order_by()
+        )
+        cells += [({field: row[field] for field in FACET_FIELDS}, row['total']) for row in own]
+    return _summarize(cells, filters)
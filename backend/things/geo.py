@@ -0,0 +1,157 @@
+"""
+Offline geocoding and the geohash grid behind "items near me".
+
+Locations are free text, so they are resolved against a bundled gazetteer
+(GAZETTEER_PATH, `name,latitude,longitude,aliases` CSV) instead of a network
+service: the whole string first, then each comma-separated part, e.g.
+"Kothrud, Pune". Items take their owner's coordinates.
+
+Each item also stores a geohash. Points sharing a geohash prefix lie in the
+same grid cell, so a radius search becomes a handful of index range scans
+(`geohash >= prefix AND geohash < prefix + '~'`) over the cell containing the
+centre and its eight neighbours, followed by an exact distance check on the
+few candidates.
+"""
+import csv
+import math
+import os
+import re
+from functools import lru_cache
+
+from django.conf import settings
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+GEOHASH_PRECISION = 9
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Sorts after every geohash character, closing the prefix range
+_PREFIX_END = '~'
+
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(__file__), 'data', 'gazetteer.csv')
+
+
+def normalize(name):
+    return ' '.join(re.sub(r'[^\w]+', ' ', name.lower()).split())
+
+
+@lru_cache(maxsize=1)
+def gazetteer():
+    path = getattr(settings, 'GAZETTEER_PATH', None) or DEFAULT_GAZETTEER
+    places = {}
+    with open(path, newline='', encoding='utf-8') as handle:
+        for row in csv.DictReader(handle):
+            point = (float(row['latitude']), float(row['longitude']))
+            for name in [row['name'], *(row.get('aliases') or '').split('|')]:
+                if name.strip():
+                    places.setdefault(normalize(name), point)
+    return places
+
+
+def geocode(text):
+    """(latitude, longitude) for a free-text location, or None if it isn't in the gazetteer"""
+    if not text:
+        return None
+    places = gazetteer()
+    for candidate in [text, *text.split(',')]:
+        point = places.get(normalize(candidate))
+        if point is not None:
+            return point
+    return None
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) of a geohash cell in degrees"""
+    total = precision * 5
+    return 180.0 / 2 ** (total // 2), 360.0 / 2 ** ((total + 1) // 2)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def search_precision(latitude, radius_km):
+    """Longest prefix whose cells are at least `radius_km` across, so the 3x3 block covers the circle"""
+    # Cells narrow towards the poles; size them for the circle's poleward edge
+    edge = min(abs(latitude) + radius_km / KM_PER_DEGREE, 89.0)
+    shrink = math.cos(math.radians(edge))
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        if height * KM_PER_DEGREE >= radius_km and width * KM_PER_DEGREE * shrink >= radius_km:
+            return precision
+    return 0
+
+
+def covering_prefixes(latitude, longitude, radius_km):
+    """Geohash prefixes of the cell holding the point and its neighbours; [''] means everywhere"""
+    precision = search_precision(latitude, radius_km)
+    if precision == 0:
+        return ['']
+    height, width = cell_size(precision)
+    prefixes = set()
+    for d_lat in (-height, 0, height):
+        lat = latitude + d_lat
+        if not -90 <= lat <= 90:
+            continue
+        for d_lon in (-width, 0, width):
+            lon = (longitude + d_lon + 180) % 360 - 180
+            prefixes.add(encode(lat, lon, precision))
+    return sorted(prefixes)
+
+
+def prefix_range(prefix):
+    """Lookups matching every geohash that starts with `prefix`, as an index-friendly range"""
+    if not prefix:
+        return {'geohash__gt': ''}
+    return {'geohash__gte': prefix, 'geohash__lt': prefix + _PREFIX_END}
+
+
+def coordinates_fields(point):
+    """Item column values for `point`, which may be None"""
+    if point is None:
+        return {'latitude': None, 'longitude': None, 'geohash': ''}
+    return {'latitude': point[0], 'longitude': point[1], 'geohash': encode(*point)}
+
+
+def backfill(user_model, item_model):
+    """
+    Geocode every user's location and copy the result onto their items.
+
+    Takes the model classes so data migrations can pass historical models.
+    Returns (users located, items updated).
+    """
+    located = moved = 0
+    rows = user_model.objects.values_list('pk', 'location', 'latitude', 'longitude').order_by('pk')
+    for user_id, location, latitude, longitude in list(rows):
+        point = geocode(location)
+        if point is not None:
+            located += 1
+        if point != (latitude, longitude):
+            user_model.objects.filter(pk=user_id).update(
+                latitude=point[0] if point else None, longitude=point[1] if point else None,
+            )
+        moved += item_model.objects.filter(owner_id=user_id).update(**coordinates_fields(point))
+    return located, moved
@@ -0,0 +1,241 @@
+"""
+Item image pipeline.
+
+After an item's image is saved, downscaled `thumb` and `medium` variants (WebP
+when Pillow supports it, JPEG otherwise) and a BlurHash placeholder are
+produced off the request path and recorded in `Item.image_variants`.
+
+IMAGE_PIPELINE_EXECUTOR selects where the work runs:
+  'thread'  - a thread pool in the web process (Pillow releases the GIL while
+              resizing and encoding), the default
+  'process' - a process pool for the CPU-bound rendering; storage and database
+              writes stay in the web process
+  'sync'    - inline, for management commands and tests
+"""
+import io
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .models import Item
+from . import versioning
+from .storage import item_image_storage
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels
+VARIANT_SIZES = {
+    'thumb': 320,
+    'medium': 960,
+}
+VARIANT_DIR = 'item_images/variants'
+
+_executor = None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def output_format():
+    from PIL import features
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+# BlurHash (https://blurha.sh): a ~30 character string clients decode into a
+# blurred preview while the real image loads.
+
+_BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _encode83(value, length):
+    return ''.join(_BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _srgb_to_linear(value):
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value):
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def blurhash(image, x_components=4, y_components=3):
+    small = image.convert('RGB')
+    small.thumbnail((32, 32))
+    width, height = small.size
+    pixels = [tuple(_srgb_to_linear(channel) for channel in pixel) for pixel in small.getdata()]
+
+    factors = []
+    for j in range(y_components):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pr, pg, pb = pixels[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = normalisation / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_max = max(abs(value) for factor in ac for value in factor)
+        quantised = max(0, min(82, int(math.floor(actual_max * 166 - 0.5))))
+        max_value = (quantised + 1) / 166
+    else:
+        quantised, max_value = 0, 1
+    result += _encode83(quantised, 1)
+    result += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+
+    def quantise(value):
+        return max(0, min(18, int(math.floor(_sign_pow(value / max_value, 0.5) * 9 + 9.5))))
+
+    for r, g, b in ac:
+        result += _encode83(quantise(r) * 19 * 19 + quantise(g) * 19 + quantise(b), 2)
+    return result
+
+
+def render_variants(source):
+    """
+    Pure CPU work: decode `source` (a file path or binary file object), return
+    the encoded variants and placeholder.
+
+    Kept free of Django state so it can run in a separate process.
+    """
+    from PIL import Image, ImageOps
+
+    pil_format, extension = output_format()
+    with Image.open(source) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if pil_format == 'JPEG' and image.mode == 'RGBA':
+            image = image.convert('RGB')
+
+        variants = {}
+        for name, size in VARIANT_SIZES.items():
+            variant = image.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            if pil_format == 'WEBP':
+                variant.save(buffer, pil_format, quality=80, method=4)
+            else:
+                variant.save(buffer, pil_format, quality=80, optimize=True, progressive=True)
+            variants[name] = buffer.getvalue()
+        return {'extension': extension, 'variants': variants, 'placeholder': blurhash(image)}
+
+
+def store_variants(item_id, image_name, rendered):
+    """Write rendered variants to storage and record them on the item"""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    paths = {}
+    for name, content in rendered['variants'].items():
+        path = f"{VARIANT_DIR}/{item_id}_{stem}_{name}.{rendered['extension']}"
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        paths[name] = default_storage.save(path, ContentFile(content))
+
+    variants = dict(paths, placeholder=rendered['placeholder'])
+    previous = Item.objects.filter(pk=item_id).values_list('image_variants', flat=True).first() or {}
+    # Only record the variants if the image wasn't replaced in the meantime
+    updated = Item.objects.filter(pk=item_id, image=image_name).update(image_variants=variants)
+    if not updated:
+        for path in paths.values():
+            default_storage.delete(path)
+        return None
+    for name, path in previous.items():
+        if name in VARIANT_SIZES and path not in paths.values():
+            default_storage.delete(path)
+    # update() skips the model signals the response caches listen to
+    versioning.bump(versioning.CATALOG)
+    return variants
+
+
+def process_item_image(item_id, image_name):
+    """Synchronously build and store the variants for one item image"""
+    with item_image_storage.open(image_name, 'rb') as source:
+        rendered = render_variants(source)
+    return store_variants(item_id, image_name, rendered)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        workers = _setting('IMAGE_PIPELINE_WORKERS', 2)
+        if _setting('IMAGE_PIPELINE_EXECUTOR', 'thread') == 'process':
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='item-images')
+    return _executor
+
+
+def _run_in_thread(item_id, image_name):
+    try:
+        process_item_image(item_id, image_name)
+    except Exception:
+        logger.exception('Image processing failed for item %s', item_id)
+    finally:
+        connection.close()
+
+
+def _finish_from_process(item_id, image_name, future):
+    try:
+        store_variants(item_id, image_name, future.result())
+    except Exception:
+        logger.exception('Image processing failed for item %s', item_id)
+    finally:
+        connection.close()
+
+
+def _submit(item_id, image_name):
+    mode = _setting('IMAGE_PIPELINE_EXECUTOR', 'thread')
+    if mode == 'sync':
+        process_item_image(item_id, image_name)
+    elif mode == 'process':
+        # The worker reads the stored file itself; nothing is loaded on the request thread
+        future = _get_executor().submit(render_variants, item_image_storage.path(image_name))
+        future.add_done_callback(lambda done: _finish_from_process(item_id, image_name, done))
+    else:
+        _get_executor().submit(_run_in_thread, item_id, image_name)
+
+
+def clear_variants(item_id):
+    previous = Item.objects.filter(pk=item_id).values_list('image_variants', flat=True).first() or {}
+    for name, path in previous.items():
+        if name in VARIANT_SIZES:
+            default_storage.delete(path)
+    if previous:
+        Item.objects.filter(pk=item_id).update(image_variants={})
+        versioning.bump(versioning.CATALOG)
+
+
+def schedule_variants(item):
+    """Queue variant generation for `item`'s current image once the save commits"""
+    if not item.image:
+        item_id = item.pk
+        transaction.on_commit(lambda: clear_variants(item_id))
+        return
+    item_id, image_name = item.pk, item.image.name
+    transaction.on_commit(lambda: _submit(item_id, image_name))
@@ -0,0 +1,94 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from things.models import User, Item
+from things.pagination import union_all
+
+
+class RollbackBenchmark(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the OR + DISTINCT item visibility query with the UNION ALL of '
+        'indexed branches. Fixture rows are created inside a transaction that '
+        'is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1_000_000)
+        parser.add_argument('--own-items', type=int, default=50, help='Non-approved items owned by the benchmark user')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise RollbackBenchmark
+        except RollbackBenchmark:
+            pass
+
+    def run(self, options):
+        user = User.objects.create_user('visibility-bench', 'bench@example.com', None)
+        others = [
+            User.objects.create_user(f'visibility-bench-{i}', f'bench{i}@example.com', None)
+            for i in range(100)
+        ]
+
+        started = time.perf_counter()
+        self.populate(user, others, options)
+        self.stdout.write(f"Created {options['items']} items in {time.perf_counter() - started:.1f}s")
+
+        page_size = options['page_size']
+        approved = Item.objects.filter(status='APPROVED')
+        own = Item.objects.filter(owner=user)
+        old = (approved | own).distinct().order_by('-created_at', '-id')
+        new = union_all([approved, own.exclude(status='APPROVED')]).order_by('-created_at', '-id')
+
+        for label, queryset in (('OR + DISTINCT', old), ('UNION ALL', new)):
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(queryset[:page_size].explain())
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                list(queryset[:page_size])
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write(
+                f'first page: median {timings[len(timings) // 2] * 1000:.2f}ms, '
+                f'best {timings[0] * 1000:.2f}ms over {len(timings)} runs'
+            )
+
+    def populate(self, user, others, options):
+        statuses = ['APPROVED'] * 8 + ['PENDING_VERIFICATION', 'RESERVED']
+        now = timezone.now()
+        total = options['items']
+        batch_size = options['batch_size']
+        own_remaining = options['own_items']
+        created = 0
+        while created < total:
+            batch = []
+            for _ in range(min(batch_size, total - created)):
+                if own_remaining:
+                    owner, item_status = user, 'PENDING_VERIFICATION'
+                    own_remaining -= 1
+                else:
+                    owner, item_status = random.choice(others), random.choice(statuses)
+                batch.append(Item(
+                    owner=owner,
+                    name=f'Bench item {created}',
+                    category='Bench',
+                    description='Benchmark fixture',
+                    ownership_type='SHARE',
+                    status=item_status,
+                    created_at=now - timezone.timedelta(seconds=created),
+                ))
+                created += 1
+            Item.objects.bulk_create(batch)
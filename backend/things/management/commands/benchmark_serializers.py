@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework import serializers
+
+from things.fast_serialization import FastListSerializer
+from things.models import User, Item, BorrowRequest, Message
+from things.serializers import ItemSerializer, BorrowRequestSerializer, MessageSerializer
+
+
+class Command(BaseCommand):
+    help = 'Rows/sec of the regular DRF list serializers versus the compiled fast path (in-memory rows, no database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        owner = User(id=1, username='owner', email='owner@example.com', role='CUSTOMER', location='Pune')
+        borrower = User(id=2, username='borrower', email='borrower@example.com', role='CUSTOMER')
+        now = timezone.now()
+        items = [
+            Item(
+                id=i, owner=owner, name=f'Item {i}', category='Tools', description='A thing ' * 20,
+                ownership_type='SHARE', condition_score=4, status='APPROVED',
+                image=f'item_images/item{i}.jpg', created_at=now,
+            )
+            for i in range(1, rows + 1)
+        ]
+        fixtures = (
+            (ItemSerializer, items),
+            (BorrowRequestSerializer, [
+                BorrowRequest(id=i, item=item, borrower=borrower, status='APPROVED', due_date=now, created_at=now)
+                for i, item in enumerate(items, start=1)
+            ]),
+            (MessageSerializer, [
+                Message(id=i, sender=owner, recipient=borrower, item=item, subject='Hi', body='Hello', created_at=now)
+                for i, item in enumerate(items, start=1)
+            ]),
+        )
+
+        for serializer_class, instances in fixtures:
+            slow = self.rows_per_second(
+                lambda: serializers.ListSerializer(instances, child=serializer_class()).data, rows, options['repeat']
+            )
+            fast = self.rows_per_second(
+                lambda: FastListSerializer(instances, child=serializer_class()).data, rows, options['repeat']
+            )
+            self.stdout.write(
+                f'{serializer_class.__name__:<26} DRF {slow:>10,.0f} rows/s   '
+                f'fast {fast:>10,.0f} rows/s   x{fast / slow:.1f}'
+            )
+
+    def rows_per_second(self, render, rows, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return rows / best
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from things import similarity
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed similar-items lists for every approved item'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=similarity.TOP_K)
+        parser.add_argument('--block-size', type=int, default=1000, help='Rows per sparse similarity block')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = similarity.rebuild(k=options['top_k'], block_size=options['block_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Built neighbours for {count} items in {elapsed:.1f}s ({count / max(elapsed, 1e-9):,.0f} items/s)'
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from things import images
+from things.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Build thumbnail/medium variants and placeholders for item images (backfill or re-render)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-render items that already have variants')
+
+    def handle(self, *args, **options):
+        items = Item.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            items = items.filter(image_variants={})
+        started = time.perf_counter()
+        done = failed = 0
+        for item_id, image_name in items.values_list('id', 'image').iterator():
+            try:
+                images.process_item_image(item_id, image_name)
+                done += 1
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f'Item {item_id} ({image_name}): {exc}')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Processed {done} images ({failed} failed) in {elapsed:.1f}s'))
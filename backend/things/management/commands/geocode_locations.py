@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from things import geo, versioning
+from things.models import User, Item
+
+
+class Command(BaseCommand):
+    help = 'Re-geocode user locations against the gazetteer and refresh item coordinates (run after editing GAZETTEER_PATH)'
+
+    def handle(self, *args, **options):
+        geo.gazetteer.cache_clear()
+        located, moved = geo.backfill(User, Item)
+        # Set-based updates skip the signals that invalidate cached browse responses
+        versioning.bump(versioning.CATALOG)
+        self.stdout.write(self.style.SUCCESS(f'Located {located} users, updated {moved} items'))
@@ -0,0 +1,98 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from things import bulk
+from things.models import User
+from things.serializers import ItemSerializer
+
+
+def read_csv(handle):
+    # Line 1 is the header
+    for line_number, row in enumerate(csv.DictReader(handle), start=2):
+        yield line_number, row
+
+
+def read_ndjson(handle):
+    for line_number, line in enumerate(handle, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, exc
+            continue
+        yield line_number, row
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream items for one owner from a CSV or NDJSON file of any size. Rows are validated one at a '
+        'time and inserted in batches, so memory stays bounded; invalid rows are reported and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--owner', required=True, help='Username that will own the imported items')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=bulk.BATCH_SIZE)
+        parser.add_argument('--progress-every', type=int, default=10000, help='Rows between progress lines')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['owner']}")
+        file_format = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'ndjson')
+        if not os.path.exists(options['path']):
+            raise CommandError(f"{options['path']} does not exist")
+
+        reader = read_csv if file_format == 'csv' else read_ndjson
+        batch_size = options['batch_size']
+        imported = failed = seen = 0
+        pending = []
+        # One bound serializer validates every row, the way ListSerializer drives its child
+        self.validator = ItemSerializer()
+        started = time.perf_counter()
+
+        with open(options['path'], newline='' if file_format == 'csv' else None, encoding='utf-8') as handle:
+            for line_number, row in reader(handle):
+                seen += 1
+                data, error = self.validate(row)
+                if error:
+                    failed += 1
+                    self.stderr.write(f'line {line_number}: {error}')
+                else:
+                    pending.append(data)
+                if len(pending) >= batch_size:
+                    imported += len(bulk.create_items(owner, pending, batch_size))
+                    pending = []
+                if seen % options['progress_every'] == 0:
+                    self.report(seen, imported, failed, started)
+            if pending:
+                imported += len(bulk.create_items(owner, pending, batch_size))
+
+        self.report(seen, imported, failed, started, final=True)
+
+    def validate(self, row):
+        """(validated data, None) for a good row, (None, error) otherwise"""
+        if isinstance(row, Exception):
+            return None, f'invalid JSON: {row}'
+        if not isinstance(row, dict):
+            return None, 'expected a JSON object'
+        try:
+            return self.validator.run_validation(row), None
+        except ValidationError as exc:
+            return None, json.dumps(exc.detail)
+
+    def report(self, seen, imported, failed, started, final=False):
+        elapsed = time.perf_counter() - started
+        line = (
+            f'{seen} rows read, {imported} imported, {failed} failed in {elapsed:.1f}s '
+            f'({seen / max(elapsed, 1e-9):,.0f} rows/s)'
+        )
+        self.stdout.write(self.style.SUCCESS(line) if final else line)
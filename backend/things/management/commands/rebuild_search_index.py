@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from things import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the item full-text search index (SQLite only; MySQL maintains its own)'
+
+    def handle(self, *args, **options):
+        if not search.fts_enabled():
+            self.stdout.write(self.style.WARNING('No full-text index available on this database'))
+            return
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from things import storage
+
+
+class Command(BaseCommand):
+    help = 'Delete stored item images no item references any more (ones kept back while an upload was reusing them)'
+
+    def handle(self, *args, **options):
+        deleted = storage.sweep_unreferenced()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced files'))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from things import overdue, reservations
+
+
+class Command(BaseCommand):
+    help = (
+        'Mark approved loans past their due date as overdue and message the borrowers, and reserve items '
+        'whose bookings have started (once, or every --interval seconds)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=overdue.BATCH_SIZE)
+        parser.add_argument('--interval', type=int, default=0, help='Keep running, sweeping every N seconds')
+
+    def handle(self, *args, **options):
+        on_batch = self.report_batch if options['verbosity'] > 1 else None
+        while True:
+            started = time.perf_counter()
+            count = overdue.sweep(batch_size=options['batch_size'], on_batch=on_batch)
+            self.stdout.write(f'{count} loans marked overdue in {time.perf_counter() - started:.2f}s')
+            self.stdout.write(f'{reservations.reserve_started()} items reserved for bookings that started')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def report_batch(self, count, seconds):
+        self.stdout.write(f'  batch: {count} loans marked overdue in {seconds * 1000:.1f}ms')
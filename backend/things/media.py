@@ -0,0 +1,222 @@
+"""
+Authorization-aware media serving.
+
+MediaView decides whether the requester may see a file and then, depending on
+MEDIA_SERVE_MODE, either hands the transfer to the front-end server or sends
+the file itself:
+
+  'accel'    - nginx `X-Accel-Redirect` to MEDIA_ACCEL_PREFIX, e.g.
+                   location /protected-media/ { internal; alias /srv/app/media/; }
+  'sendfile' - `X-Sendfile` with the absolute path (Apache mod_xsendfile,
+               lighttpd)
+  'django'   - FileResponse (the server's sendfile via wsgi.file_wrapper when
+               the whole file is sent) with Range, ETag and Last-Modified
+               support, the default
+
+Images of rejected items are only served to their owner and staff. `<img>`
+requests carry no Authorization header, so the API hands those users signed
+URLs (`sign_url`) that grant access until they expire.
+
+Item images are stored under content-derived names (things/storage.py), so
+those responses are cacheable for a year; anything else is revalidated.
+"""
+import mimetypes
+import os
+import re
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import constant_time_compare
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, parse_etags
+from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView
+
+from .images import VARIANT_DIR
+from .models import Item
+from .storage import item_image_storage
+
+ITEM_IMAGE_DIR = 'item_images/'
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+# Only these statuses keep an item's image away from the public
+HIDDEN_STATUSES = ('REJECTED',)
+# Names written by ContentAddressedStorage and the variants rendered from them
+CONTENT_ADDRESSED_RE = re.compile(r'^item_images/(?:[0-9a-f]{2}/[0-9a-f]{64}|variants/\d+_[0-9a-f]{64}_\w+)\.\w+$')
+
+
+def is_public(status):
+    return status not in HIDDEN_STATUSES
+
+
+def url_lifetime():
+    """Seconds a signed URL is guaranteed to stay valid (MEDIA_SIGNED_URL_LIFETIME)"""
+    return getattr(settings, 'MEDIA_SIGNED_URL_LIFETIME', 6 * 60 * 60)
+
+
+def signing_window(now=None):
+    """
+    The current period of signed URLs. Expiry times are rounded to it, so the
+    same file gets the same URL (and browser cache entry) for a whole period.
+    """
+    return int(now if now is not None else time.time()) // url_lifetime()
+
+
+def _signature(name, expires):
+    return signing.Signer(salt='things.media').signature(f'{name}:{expires}')
+
+
+def sign_url(url, name):
+    """`url` for the file stored at `name`, with an expiring signature"""
+    expires = (signing_window() + 2) * url_lifetime()
+    query = urlencode({'expires': expires, 'signature': _signature(name, expires)})
+    return f'{url}{"&" if "?" in url else "?"}{query}'
+
+
+def valid_signature(name, params):
+    try:
+        expires = int(params.get('expires', ''))
+    except ValueError:
+        return False
+    return expires >= time.time() and constant_time_compare(params.get('signature', ''), _signature(name, expires))
+
+
+def owning_items(name):
+    """Items whose image (or one of its variants) is stored at `name`"""
+    if not name.startswith(ITEM_IMAGE_DIR):
+        return None
+    if name.startswith(VARIANT_DIR + '/'):
+        item_id = os.path.basename(name).split('_', 1)[0]
+        if not item_id.isdigit():
+            return None
+        return Item.objects.filter(pk=int(item_id))
+    # One stored file can back several items, any visible one grants access
+    return Item.objects.filter(image=name)
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        return etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and int(last_modified) <= since
+
+
+def requested_range(request, size, etag, last_modified):
+    """(start, end) of a satisfiable single byte range, None for the whole file"""
+    header = request.META.get('HTTP_RANGE', '')
+    match = RANGE_RE.match(header.strip())
+    if not match or size == 0:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag and if_range != http_date(last_modified):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if start >= size or start > end:
+        return 'unsatisfiable'
+    return start, min(end, size - 1)
+
+
+def read_range(handle, start, length):
+    try:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        handle.close()
+
+
+class MediaView(APIView):
+    """GET/HEAD a stored media file the requester is allowed to see"""
+    permission_classes = [AllowAny]
+
+    def get(self, request, path):
+        name = os.path.normpath(path).replace(os.sep, '/')
+        items = owning_items(name)
+        if items is None:
+            raise Http404
+        owners = list(items.values_list('status', 'owner_id'))
+        public = any(is_public(item_status) for item_status, _ in owners)
+        if not (public or valid_signature(name, request.GET) or self.may_see_hidden(request.user, owners)):
+            raise Http404
+        try:
+            full_path = safe_join(item_image_storage.location, name)
+            stat = os.stat(full_path)
+        except (OSError, ValueError):
+            raise Http404
+
+        response = self.serve(request, name, full_path, stat)
+        if CONTENT_ADDRESSED_RE.match(name):
+            freshness = {'max_age': CACHE_MAX_AGE, 'immutable': True}
+        else:
+            # Legacy names can be overwritten in place
+            freshness = {'no_cache': True}
+        patch_cache_control(response, **freshness, **({'public': True} if public else {'private': True}))
+        if not public:
+            response['Vary'] = 'Authorization'
+        return response
+
+    def may_see_hidden(self, user, owners):
+        if not user.is_authenticated:
+            return False
+        if user.role == 'STAFF':
+            return True
+        return any(owner_id == user.pk for _, owner_id in owners)
+
+    def serve(self, request, name, full_path, stat):
+        content_type, encoding = mimetypes.guess_type(full_path)
+        content_type = content_type or 'application/octet-stream'
+        mode = getattr(settings, 'MEDIA_SERVE_MODE', 'django')
+
+        if mode == 'accel':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/') + name
+            return response
+        if mode == 'sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = full_path
+            return response
+
+        etag = file_etag(stat)
+        if not_modified(request, etag, stat.st_mtime):
+            response = HttpResponseNotModified()
+        else:
+            byte_range = requested_range(request, stat.st_size, etag, stat.st_mtime)
+            if byte_range == 'unsatisfiable':
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+            elif byte_range:
+                start, end = byte_range
+                length = end - start + 1
+                response = StreamingHttpResponse(
+                    read_range(open(full_path, 'rb'), start, length), status=206, content_type=content_type,
+                )
+                response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+                response['Content-Length'] = str(length)
+            else:
+                response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Accept-Ranges'] = 'bytes'
+        return response
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:18
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_facet_counts(apps, schema_editor):
+    Item = apps.get_model('things', 'Item')
+    ItemFacetCount = apps.get_model('things', 'ItemFacetCount')
+    rows = Item.objects.values('category', 'ownership_type', 'status').annotate(total=Count('id')).order_by()
+    ItemFacetCount.objects.bulk_create(ItemFacetCount(count=row.pop('total'), **row) for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0007_item_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=100)),
+                ('ownership_type', models.CharField(choices=[('SELL', 'Sell'), ('EXCHANGE', 'Exchange'), ('SHARE', 'Share')], max_length=10)),
+                ('status', models.CharField(choices=[('PENDING_VERIFICATION', 'Pending Verification'), ('APPROVED', 'Approved'), ('AVAILABLE', 'Available'), ('RESERVED', 'Reserved'), ('CHECKED_OUT', 'Checked Out'), ('RETURNED', 'Returned'), ('REJECTED', 'Rejected')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'ownership_type', 'status'), name='unique_item_facet_cell')],
+            },
+        ),
+        migrations.RunPython(populate_facet_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0008_itemfacetcount'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='borrowrequest',
+            index=models.Index(fields=['borrower', 'status'], name='borrow_borrower_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrequest',
+            index=models.Index(fields=['item', 'status'], name='borrow_item_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['status', 'created_at'], name='item_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['owner', 'status'], name='item_owner_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['recipient', 'created_at'], name='message_recipient_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'created_at'], name='message_sender_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pointtransaction',
+            index=models.Index(fields=['user', 'created_at'], name='pointtx_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0009_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
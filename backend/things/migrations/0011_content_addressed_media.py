@@ -0,0 +1,49 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:31
+
+import django.utils.timezone
+import things.storage
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_images(apps, schema_editor):
+    # Files uploaded before this migration keep their names; count their
+    # references so replacing or deleting those items releases them too
+    Item = apps.get_model('things', 'Item')
+    MediaBlob = apps.get_model('things', 'MediaBlob')
+    storage = things.storage.get_item_image_storage()
+    rows = Item.objects.exclude(image='').exclude(image__isnull=True).values('image').annotate(total=Count('id')).order_by()
+    blobs = []
+    for row in rows:
+        try:
+            size = storage.size(row['image'])
+        except OSError:
+            size = 0
+        blobs.append(MediaBlob(name=row['image'], size=size, ref_count=row['total']))
+    MediaBlob.objects.bulk_create(blobs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0010_item_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=things.storage.get_item_image_storage, upload_to='item_images/'),
+        ),
+        migrations.RunPython(count_existing_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0011_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['image'], name='item_image_idx'),
+        ),
+    ]
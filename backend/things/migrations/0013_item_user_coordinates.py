@@ -0,0 +1,49 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:35
+
+from django.db import migrations, models
+
+from things import geo
+
+
+def geocode_existing(apps, schema_editor):
+    geo.backfill(apps.get_model('things', 'User'), apps.get_model('things', 'Item'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0012_item_image_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='geohash',
+            field=models.CharField(blank=True, default='', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['status', 'geohash'], name='item_status_geohash_idx'),
+        ),
+        migrations.RunPython(geocode_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0013_item_user_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_items', to='things.item')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='things.item')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('item', 'rank'), name='unique_similar_item_rank')],
+            },
+        ),
+    ]
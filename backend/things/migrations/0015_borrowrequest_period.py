@@ -0,0 +1,42 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:43
+
+import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_periods(apps, schema_editor):
+    # Existing requests become bookings from their creation day to their due date
+    # (or the old fixed 7-day loan when none was set)
+    BorrowRequest = apps.get_model('things', 'BorrowRequest')
+    rows = BorrowRequest.objects.filter(start_date__isnull=True).values_list('pk', 'created_at', 'due_date')
+    for pk, created_at, due_date in list(rows):
+        start = timezone.localdate(created_at)
+        end = timezone.localdate(due_date) if due_date else start + datetime.timedelta(days=6)
+        BorrowRequest.objects.filter(pk=pk).update(start_date=start, end_date=max(start, end))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0014_similaritem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrowrequest',
+            name='end_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='borrowrequest',
+            name='start_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrequest',
+            index=models.Index(fields=['item', 'status', 'start_date', 'end_date'], name='borrow_item_period_idx'),
+        ),
+        migrations.RunPython(backfill_periods, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0015_borrowrequest_period'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='borrowrequest',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('APPROVED', 'Approved'), ('OVERDUE', 'Overdue'), ('DENIED', 'Denied'), ('RETURNED', 'Returned')], default='PENDING', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrequest',
+            index=models.Index(fields=['status', 'due_date'], name='borrow_status_due_idx'),
+        ),
+    ]
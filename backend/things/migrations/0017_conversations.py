@@ -0,0 +1,64 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+from things import conversations
+
+
+def build_conversations(apps, schema_editor):
+    conversations.backfill(apps.get_model('things', 'Conversation'), apps.get_model('things', 'Message'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0016_borrow_overdue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_message_preview', models.CharField(blank=True, max_length=255)),
+                ('unread_a', models.PositiveIntegerField(default=0)),
+                ('unread_b', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='things.item')),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='things.message')),
+                ('last_sender', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='things.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at'], name='message_conversation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user_a', 'last_message_at'], name='conversation_a_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user_b', 'last_message_at'], name='conversation_b_active_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(condition=models.Q(('item__isnull', False)), fields=('user_a', 'user_b', 'item'), name='conversation_unique_item'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(condition=models.Q(('item__isnull', True)), fields=('user_a', 'user_b'), name='conversation_unique_direct'),
+        ),
+        migrations.RunPython(build_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 04:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0017_conversations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread_messages', models.PositiveIntegerField(default=0)),
+                ('pending_requests', models.PositiveIntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['recipient', 'is_read'], name='message_recipient_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+from things import conversations
+
+
+def fill_thread_keys(apps, schema_editor):
+    Conversation = apps.get_model('things', 'Conversation')
+    for pk, *key in list(Conversation.objects.values_list('id', 'user_a_id', 'user_b_id', 'item_id')):
+        Conversation.objects.filter(pk=pk).update(thread_key=conversations.stored_key(key))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('things', '0018_user_counters'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='conversation',
+            name='conversation_unique_item',
+        ),
+        migrations.RemoveConstraint(
+            model_name='conversation',
+            name='conversation_unique_direct',
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='thread_key',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_thread_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='conversation',
+            name='thread_key',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+    ]
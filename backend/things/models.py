@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils import timezone
 
+from .storage import get_item_image_storage
+
 class UserManager(BaseUserManager):
     def create_user(self, username, email=None, password=None, role='CUSTOMER', **extra_fields):
         if not username:
@@ -25,6 +27,8 @@ class User(AbstractUser):
     ]
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='CUSTOMER')
     location = models.CharField(max_length=255, blank=True, null=True)  # City/Area
+    latitude = models.FloatField(null=True, blank=True)  # Geocoded from location by things.geo
+    longitude = models.FloatField(null=True, blank=True)
     
     objects = UserManager()
 
@@ -50,15 +54,27 @@ class Item(models.Model):
     name = models.CharField(max_length=255)
     category = models.CharField(max_length=100)
     description = models.TextField()
-    image = models.ImageField(upload_to='item_images/', blank=True, null=True)
+    image = models.ImageField(upload_to='item_images/', storage=get_item_image_storage, blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True)  # Resized copies + placeholder, filled in by things.images
     ownership_type = models.CharField(max_length=10, choices=OWNERSHIP_CHOICES)
     condition_score = models.IntegerField(null=True, blank=True)  # 1-5, set after inspection
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING_VERIFICATION')
     created_at = models.DateTimeField(default=timezone.now)
+    latitude = models.FloatField(null=True, blank=True)  # Copied from the owner, see things.geo
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, default='')
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='item_status_created_idx'),
+            models.Index(fields=['owner', 'status'], name='item_owner_status_idx'),
+            models.Index(fields=['image'], name='item_image_idx'),
+            models.Index(fields=['status', 'geohash'], name='item_status_geohash_idx'),
+        ]
+
 class InspectionReport(models.Model):
     item = models.OneToOneField(Item, on_delete=models.CASCADE, related_name='inspection_report')
     staff = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inspection_reports')
@@ -73,12 +89,15 @@ class BorrowRequest(models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
         ('APPROVED', 'Approved'),
+        ('OVERDUE', 'Overdue'),
         ('DENIED', 'Denied'),
         ('RETURNED', 'Returned'),
     ]
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='borrow_requests')
     borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='borrow_requests')
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    start_date = models.DateField(null=True, blank=True)  # Requested booking, inclusive (see things.reservations)
+    end_date = models.DateField(null=True, blank=True)
     due_date = models.DateTimeField(null=True, blank=True)
     return_date = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
@@ -86,7 +105,46 @@ class BorrowRequest(models.Model):
     def __str__(self):
         return f"{self.borrower.username} - {self.item.name}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['borrower', 'status'], name='borrow_borrower_status_idx'),
+            models.Index(fields=['item', 'status'], name='borrow_item_status_idx'),
+            models.Index(fields=['item', 'status', 'start_date', 'end_date'], name='borrow_item_period_idx'),
+            models.Index(fields=['status', 'due_date'], name='borrow_status_due_idx'),
+        ]
+
+class Conversation(models.Model):
+    """
+    One thread per pair of users (and item, if any). The last message and the
+    unread counts are denormalized here so the conversation list never reads
+    the message table; see things.conversations.
+    """
+    # The participant with the lower id is always user_a
+    user_a = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_b = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='conversations', null=True, blank=True)
+    # "<user_a>:<user_b>:<item or empty>". A plain unique column, because MySQL enforces
+    # neither conditional unique constraints nor uniqueness over a NULL item
+    thread_key = models.CharField(max_length=64, unique=True)
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    last_message_at = models.DateTimeField(default=timezone.now)
+    last_message_preview = models.CharField(max_length=255, blank=True)
+    last_sender = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    unread_a = models.PositiveIntegerField(default=0)
+    unread_b = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Conversation between {self.user_a_id} and {self.user_b_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_a', 'last_message_at'], name='conversation_a_active_idx'),
+            models.Index(fields=['user_b', 'last_message_at'], name='conversation_b_active_idx'),
+        ]
+
 class Message(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages', null=True, blank=True)
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='messages', null=True, blank=True)
@@ -100,6 +158,12 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', 'created_at'], name='message_recipient_created_idx'),
+            models.Index(fields=['sender', 'created_at'], name='message_sender_created_idx'),
+            models.Index(fields=['conversation', 'created_at'], name='message_conversation_idx'),
+            models.Index(fields=['recipient', 'is_read'], name='message_recipient_unread_idx'),
+        ]
 
 class Rating(models.Model):
     """Store product ratings given by staff during inspection"""
@@ -144,3 +208,56 @@ class PointTransaction(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='pointtx_user_created_idx'),
+        ]
+
+class ItemFacetCount(models.Model):
+    """Maintained item counts per (category, ownership_type, status) cell, kept current by Item signals"""
+    category = models.CharField(max_length=100)
+    ownership_type = models.CharField(max_length=10, choices=Item.OWNERSHIP_CHOICES)
+    status = models.CharField(max_length=20, choices=Item.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.category}/{self.ownership_type}/{self.status}: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'ownership_type', 'status'], name='unique_item_facet_cell'),
+        ]
+
+class UserCounter(models.Model):
+    """Maintained badge counts for one user; a missing or stale row is rebuilt from COUNT queries (things.counters)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='counters')
+    unread_messages = models.PositiveIntegerField(default=0)
+    pending_requests = models.PositiveIntegerField(default=0)  # PENDING borrow requests for items the user owns
+    reconciled_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread_messages} unread, {self.pending_requests} pending"
+
+class MediaBlob(models.Model):
+    """One stored file in the content-addressed media store and how many items reference it"""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+class SimilarItem(models.Model):
+    """One of an item's precomputed nearest neighbours, written by things.similarity"""
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='similar_items')
+    similar = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='similar_to')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    def __str__(self):
+        return f"{self.item_id} ~ {self.similar_id} ({self.score:.3f})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'rank'], name='unique_similar_item_rank'),
+        ]
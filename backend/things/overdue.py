@@ -0,0 +1,83 @@
+"""
+Overdue loan sweeper.
+
+Approved loans past their due date are found through the (status, due_date)
+index, oldest first, in batches. Each batch is one transaction: lock and
+read the rows, flip them to OVERDUE with a single UPDATE, and bulk_create a
+reminder Message per loan (sent on the owner's behalf to the borrower), then
+fold the reminders into their conversations. Rows leave the APPROVED status
+as they are processed, so every batch starts again at the front of the index
+and a sweep touches only the overdue rows.
+"""
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import BorrowRequest, Message
+from . import conversations, realtime, versioning
+
+BATCH_SIZE = 500
+
+
+def reminder(row):
+    request_id, borrower_id, item_id, item_name, owner_id, due_date = row
+    return Message(
+        sender_id=owner_id,
+        recipient_id=borrower_id,
+        item_id=item_id,
+        subject=f'Overdue: {item_name}',
+        body=(
+            f'"{item_name}" was due back on {timezone.localtime(due_date):%Y-%m-%d %H:%M}. '
+            'Please return it as soon as possible.'
+        ),
+    )
+
+
+def sweep_batch(now, batch_size=BATCH_SIZE):
+    """Mark one batch of overdue loans and message their borrowers; returns the number processed"""
+    with transaction.atomic():
+        rows = list(
+            BorrowRequest.objects.select_for_update()
+            .filter(status='APPROVED', due_date__lt=now)
+            .order_by('due_date', 'id')
+            .values_list('id', 'borrower_id', 'item_id', 'item__name', 'item__owner_id', 'due_date')[:batch_size]
+        )
+        if not rows:
+            return 0
+        BorrowRequest.objects.filter(pk__in=[row[0] for row in rows]).update(status='OVERDUE')
+        reminders = [reminder(row) for row in rows]
+        # bulk_create skips the signals that keep conversations current
+        conversations.attach(reminders)
+        Message.objects.bulk_create(reminders)
+        conversations.record(reminders)
+        realtime.messages_created(reminders)
+        for request_id, borrower_id, item_id, _, owner_id, _ in rows:
+            realtime.request_changed(request_id, item_id, borrower_id, owner_id, 'OVERDUE')
+
+        # update() and bulk_create() skip the signals that invalidate cached lists
+        users = {row[1] for row in rows} | {row[4] for row in rows}
+        versioning.bump(
+            versioning.ALL_BORROWS,
+            *(versioning.borrows_scope(user_id) for user_id in users),
+            *(versioning.messages_scope(user_id) for user_id in users),
+        )
+    return len(rows)
+
+
+def sweep(now=None, batch_size=BATCH_SIZE, on_batch=None):
+    """
+    Process every loan overdue at `now`; returns the number of loans marked.
+    `on_batch(count, seconds)` is called after each batch, for progress output.
+    """
+    now = now or timezone.now()
+    total = 0
+    while True:
+        started = time.perf_counter()
+        count = sweep_batch(now, batch_size)
+        if not count:
+            break
+        total += count
+        if on_batch is not None:
+            on_batch(count, time.perf_counter() - started)
+    return total
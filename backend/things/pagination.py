@@ -0,0 +1,186 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def union_all(querysets, ordering=None, limit=None):
+    """
+    Combine disjoint querysets with UNION ALL (no dedup pass needed).
+
+    Given the outer `ordering` and `limit`, backends that accept them inside
+    compound statements (MySQL, PostgreSQL) also get them on every branch, so
+    each branch stops after `limit` entries of its index instead of being
+    materialized in full for the outer sort. SQLite rejects per-branch
+    ORDER BY/LIMIT but plans an ordered UNION ALL as a merge of the ordered
+    branches, which stops once the outer LIMIT is reached.
+    """
+    first, *rest = querysets
+    if not rest:
+        return first
+    if ordering and limit and connections[first.db].features.supports_slicing_ordering_in_compound:
+        branches = [queryset.order_by(*ordering)[:limit] for queryset in querysets]
+    else:
+        branches = [queryset.order_by() for queryset in querysets]
+    return branches[0].union(*branches[1:], all=True)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (created_at, id), newest first; subclasses can
+    key on another timestamp with `ordering_field`.
+
+    Each page is fetched with a range predicate on the last seen key instead of
+    an OFFSET, so deep pages cost the same as the first one. Pagination is
+    opt-in: it only kicks in when the client sends `cursor` or `page_size`, so
+    existing clients keep receiving plain lists.
+    """
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering_field = 'created_at'
+    # Paginate only when the client asks for it
+    opt_in = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        `queryset` may also be a list of disjoint querysets; each gets the
+        keyset predicate, and where the backend allows it the page's ORDER BY
+        and LIMIT, pushed down before they are combined with UNION ALL (see
+        `union_all`), so every branch reads only one page worth of its index.
+        """
+        params = request.query_params
+        if self.opt_in and self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            position, reverse = None, False
+        else:
+            position, reverse = cursor
+
+        branches = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+        if position is not None:
+            branches = [self.filter_after(branch, position, reverse) for branch in branches]
+        if reverse:
+            ordering = (self.ordering_field, 'id')
+        else:
+            ordering = ('-' + self.ordering_field, '-id')
+        queryset = union_all(branches, ordering, self.page_size + 1).order_by(*ordering)
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = rows
+        return rows
+
+    def filter_after(self, queryset, position, reverse):
+        """Restrict the queryset to rows strictly past `position` in walk order"""
+        timestamp, pk = position
+        field = self.ordering_field
+        if reverse:
+            keyset = Q(**{field + '__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk})
+        else:
+            keyset = Q(**{field + '__lt': timestamp}) | Q(**{field: timestamp, 'id__lt': pk})
+        return queryset.filter(keyset)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+            created_at = parse_datetime(data['t'])
+            pk = int(data['i'])
+            reverse = bool(data.get('r', False))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (created_at, pk), reverse
+
+    def encode_cursor(self, row, reverse):
+        data = {'t': getattr(row, self.ordering_field).isoformat(), 'i': row.pk}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        url = replace_query_param(self.base_url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, encoded.decode('ascii').rstrip('='))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ConversationPagination(KeysetPagination):
+    """Conversations, most recently active first, always a page at a time"""
+    ordering_field = 'last_message_at'
+    opt_in = False
+
+
+class ThreadPagination(KeysetPagination):
+    """A conversation's messages, newest first, always a page at a time"""
+    opt_in = False
+
+
+class SearchPagination(PageNumberPagination):
+    """Page-numbered results for relevance-ranked queries, which have no stable keyset"""
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
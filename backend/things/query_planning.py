@@ -0,0 +1,167 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+
+from .serializers import sparse_fields
+
+
+def _walk_relations(model, attrs):
+    """
+    Follow `attrs` across model relations.
+
+    Returns (path, is_many) for the longest prefix of `attrs` that is made of
+    relation fields, where `is_many` tells whether the path crosses a to-many
+    relation (and therefore needs prefetching rather than a join).
+    """
+    path = []
+    for attr in attrs:
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            break
+        if not field.is_relation or field.related_model is None:
+            break
+        path.append(attr)
+        if field.many_to_many or field.one_to_many:
+            return path, True
+        model = field.related_model
+    return path, False
+
+
+def _collect(serializer, model, prefix, select, prefetch):
+    # Hints are keyed by their first segment, which names the serializer
+    # field that reads them; they are dropped along with that field
+    meta = getattr(serializer, 'Meta', None)
+    for path in getattr(meta, 'extra_select_related', ()):
+        if path.split('__')[0] in serializer.fields:
+            select.add(prefix + path)
+    for path in getattr(meta, 'extra_prefetch_related', ()):
+        if path.split('__')[0] in serializer.fields:
+            prefetch.add(prefix + path)
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+
+        if field.source == '*':
+            if isinstance(field, serializers.BaseSerializer):
+                _collect(field, model, prefix, select, prefetch)
+            continue
+
+        attrs = field.source.split('.')
+        if isinstance(field, PrimaryKeyRelatedField):
+            # The pk comes straight from the `<name>_id` column
+            attrs = attrs[:-1]
+        elif not isinstance(field, (serializers.BaseSerializer, serializers.RelatedField, ManyRelatedField)):
+            # Plain value fields only need the relations leading up to them
+            attrs = attrs[:-1]
+        if not attrs:
+            continue
+
+        path, is_many = _walk_relations(model, attrs)
+        if not path:
+            continue
+        lookup = prefix + '__'.join(path)
+        if is_many or isinstance(field, (serializers.ListSerializer, ManyRelatedField)):
+            prefetch.add(lookup)
+            continue
+        select.add(lookup)
+
+        if isinstance(field, serializers.ModelSerializer) and len(path) == len(attrs):
+            _collect(field, field.Meta.model, lookup + '__', select, prefetch)
+
+
+def _trimmed(serializer_class, fields):
+    serializer = serializer_class()
+    if fields is not None:
+        for name in list(serializer.fields):
+            if name not in fields:
+                serializer.fields.pop(name)
+    return serializer
+
+
+@lru_cache(maxsize=None)
+def related_lookups(serializer_class, fields=None):
+    """
+    Derive the select_related/prefetch_related lookups a serializer needs.
+
+    Nested serializers, dotted sources (`owner.username`) and the optional
+    `Meta.extra_select_related`/`Meta.extra_prefetch_related` hints (for
+    relations only touched in `to_representation`) are all taken into account.
+    `fields` restricts the walk to a sparse fieldset.
+    """
+    serializer = _trimmed(serializer_class, fields)
+    select, prefetch = set(), set()
+    _collect(serializer, serializer.Meta.model, '', select, prefetch)
+    return tuple(sorted(select)), tuple(sorted(prefetch))
+
+
+@lru_cache(maxsize=None)
+def unused_columns(serializer_class, fields):
+    """
+    Concrete columns of the serializer's model that no field in `fields`
+    reads, i.e. what can be deferred. The primary key and `created_at` (the
+    pagination key) are always loaded. Returns () whenever a field's source
+    can't be traced to a column, since deferring blindly would turn into a
+    query per row. Fields that read more than their source list the columns
+    in a `columns` attribute.
+    """
+    serializer = _trimmed(serializer_class, fields)
+    model = serializer.Meta.model
+    needed = {model._meta.pk.name, 'created_at'}
+    sources = [
+        source for field in serializer.fields.values() if not field.write_only
+        for source in getattr(field, 'columns', (field.source,))
+    ]
+    meta = getattr(serializer, 'Meta', None)
+    sources += [path.replace('__', '.') for path in getattr(meta, 'extra_select_related', ())
+                if path.split('__')[0] in serializer.fields]
+    for source in sources:
+        if source == '*':
+            return ()
+        try:
+            field = model._meta.get_field(source.split('.')[0])
+        except FieldDoesNotExist:
+            return ()
+        if field.concrete:
+            needed.add(field.name)
+    return tuple(
+        field.name for field in model._meta.concrete_fields
+        if field.name not in needed
+    )
+
+
+def plan_queryset(queryset, serializer_class, fields=None):
+    """
+    Apply the joins and prefetches `serializer_class` will need to `queryset`,
+    and with a sparse fieldset also defer the columns it won't read.
+    """
+    select, prefetch = related_lookups(serializer_class, fields)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if fields is not None:
+        deferred = unused_columns(serializer_class, fields)
+        if deferred:
+            queryset = queryset.defer(*deferred)
+    return queryset
+
+
+class QueryPlanningMixin:
+    """
+    Viewset mixin that preloads every relation the serializer reads, and
+    only the columns it reads when the client asked for ?fields= / ?omit=.
+
+    Hooks into `filter_queryset`, so list/retrieve/update get it for free and
+    custom list actions only need to pass their queryset through
+    `self.filter_queryset()`.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        fields = sparse_fields(self.request, list(serializer_class().fields))
+        return plan_queryset(queryset, serializer_class, fields)
@@ -0,0 +1,266 @@
+"""
+Server push over Server-Sent Events.
+
+Clients keep one `GET /api/events/` stream open (served by an ASGI server,
+e.g. `uvicorn library_manager.asgi:application`) instead of polling the
+message and borrow-request lists. EventSource can't send an Authorization
+header, so a browser first POSTs to /api/events/ticket/ for a short-lived,
+single-use ticket and opens `/api/events/?ticket=...`; the JWT itself never
+appears in a URL. They receive:
+
+- `message`: a message they sent or received;
+- `borrow_request`: a status change on a request they made or one for their
+  item;
+- `item`: a status change on one of their items (approval, rejection,
+  reservation).
+
+Writers call `publish` (via the model signals, or directly from the
+set-based writers). The event goes out once the transaction commits, through
+the backend named by REALTIME_BACKEND. `LocalBackend` hands events straight
+to this process's broker, which is enough for one worker and is the stand-in
+for tests. `RedisBackend` relays them over Redis pub/sub so that every
+worker's broker sees every event. The broker routes each event to the
+queues of that user's open streams.
+"""
+import asyncio
+import json
+import logging
+import secrets
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import conversations
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per open stream before a slow client is told to resync
+QUEUE_SIZE = 100
+RESYNC = {'type': 'resync'}
+# Seconds a stream ticket stays redeemable
+TICKET_TTL = 30
+
+
+class Broker:
+    """Routes events to the open streams in this process, from any thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def subscribe(self, user_id):
+        """A queue that receives the user's events; call from the stream's event loop"""
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._streams.setdefault(user_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            streams = self._streams.get(user_id, set())
+            streams.difference_update({stream for stream in streams if stream[1] is queue})
+            if not streams:
+                self._streams.pop(user_id, None)
+
+    def deliver(self, user_ids, event):
+        with self._lock:
+            targets = [stream for user_id in user_ids for stream in self._streams.get(user_id, ())]
+        for loop, queue in targets:
+            loop.call_soon_threadsafe(_offer, queue, event)
+
+
+def _offer(queue, event):
+    if queue.full():
+        # The client fell behind; drop its backlog and have it refetch
+        while not queue.empty():
+            queue.get_nowait()
+        event = RESYNC
+    queue.put_nowait(event)
+
+
+class LocalBackend:
+    """Delivers in-process only: single-worker deployments and tests"""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, user_ids, event):
+        self.deliver(user_ids, event)
+
+
+class RedisBackend:
+    """
+    Relays events through a Redis pub/sub channel (REALTIME_REDIS_URL) so
+    every worker process delivers them to its own streams.
+    """
+    channel = 'things:events'
+
+    def __init__(self, deliver):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('things.realtime.RedisBackend requires the redis package')
+        self.deliver = deliver
+        self.client = redis.Redis.from_url(settings.REALTIME_REDIS_URL)
+        threading.Thread(target=self.listen, name='realtime-redis', daemon=True).start()
+
+    def publish(self, user_ids, event):
+        self.client.publish(self.channel, json.dumps({'users': user_ids, 'event': event}, cls=DjangoJSONEncoder))
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    data = json.loads(message['data'])
+                    self.deliver(data['users'], data['event'])
+            except Exception:
+                logger.exception('Realtime relay lost its Redis subscription; retrying')
+                time.sleep(1)
+
+
+broker = Broker()
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        backend_class = import_string(getattr(settings, 'REALTIME_BACKEND', 'things.realtime.LocalBackend'))
+        _backend = backend_class(broker.deliver)
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'REALTIME_BACKEND':
+        _backend = None
+
+
+def _send(user_ids, event):
+    try:
+        get_backend().publish(user_ids, event)
+    except Exception:
+        # Push is best effort; clients resync from the REST endpoints
+        logger.exception('Could not publish %s event', event.get('type'))
+
+
+def publish(user_ids, event):
+    """Send `event` to every open stream of `user_ids` once the current transaction commits"""
+    user_ids = sorted({user_id for user_id in user_ids if user_id is not None})
+    if user_ids:
+        event = json.loads(json.dumps(event, cls=DjangoJSONEncoder))
+        transaction.on_commit(lambda: _send(user_ids, event))
+
+
+def messages_created(messages):
+    for message in messages:
+        publish([message.sender_id, message.recipient_id], {
+            'type': 'message',
+            'id': message.pk,
+            'conversation': message.conversation_id,
+            'sender': message.sender_id,
+            'recipient': message.recipient_id,
+            'item': message.item_id,
+            'subject': message.subject,
+            'preview': conversations.preview(message.subject, message.body),
+            'created_at': message.created_at,
+        })
+
+
+def request_changed(request_id, item_id, borrower_id, owner_id, status):
+    publish([borrower_id, owner_id], {'type': 'borrow_request', 'id': request_id, 'item': item_id, 'status': status})
+
+
+def item_changed(item_id, owner_id, status):
+    publish([owner_id], {'type': 'item', 'id': item_id, 'status': status})
+
+
+def _ticket_cache():
+    # Shared by every worker, like the version counters
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _ticket_key(ticket):
+    return f'things:stream-ticket:{ticket}'
+
+
+def ticket_ttl():
+    return getattr(settings, 'REALTIME_TICKET_TTL', TICKET_TTL)
+
+
+def issue_ticket(user):
+    """A random ticket that opens one event stream as `user` within ticket_ttl() seconds"""
+    ticket = secrets.token_urlsafe(32)
+    _ticket_cache().set(_ticket_key(ticket), user.pk, ticket_ttl())
+    return ticket
+
+
+def redeem_ticket(ticket):
+    """The user a ticket was issued to, or None; a ticket works once"""
+    cache = _ticket_cache()
+    user_id = cache.get(_ticket_key(ticket))
+    # delete() reports whether the key was still there, so two redemptions can't both win
+    if user_id is None or not cache.delete(_ticket_key(ticket)):
+        return None
+    return get_user_model().objects.filter(pk=user_id).first()
+
+
+def _authenticate(request):
+    """The user behind the request's `ticket` query parameter or JWT Authorization header"""
+    ticket = request.GET.get('ticket')
+    if ticket:
+        return redeem_ticket(ticket)
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+async def _stream(user_id, heartbeat):
+    queue = broker.subscribe(user_id)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                # Comment lines keep proxies from closing an idle stream
+                yield ': keepalive\n\n'
+                continue
+            yield f'event: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+    finally:
+        broker.unsubscribe(user_id, queue)
+
+
+async def event_stream(request):
+    """GET /api/events/: the signed-in user's events as text/event-stream"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    user = await sync_to_async(_authenticate)(request)
+    if user is None or not user.is_active:
+        return JsonResponse({'error': 'Authentication credentials were not provided.'}, status=401)
+    # Starts the shared backend's relay in this worker
+    await sync_to_async(get_backend)()
+    response = StreamingHttpResponse(
+        _stream(user.pk, getattr(settings, 'REALTIME_HEARTBEAT', 25)), content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,125 @@
+"""
+Date-range bookings.
+
+Every borrow request covers an inclusive [start_date, end_date] range. Two
+ranges overlap when each starts on or before the other ends, so a conflict
+check is the range predicate `start_date <= end AND end_date >= start` on the
+(item, status, start_date, end_date) index: one indexed query whatever the
+number of bookings, and the calendar for a month is the same query over the
+month's window. Overdue loans have no end until they come back, so for those
+only the start bound applies; both statuses are read as one IN range on the
+index with `end_date` checked from the index entries.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BorrowRequest, Item
+from . import facets, realtime, versioning
+
+DEFAULT_LOAN_DAYS = 7
+MAX_LOAN_DAYS = 60
+MAX_CALENDAR_DAYS = 92
+
+
+def default_period(today=None):
+    start = today or timezone.localdate()
+    return start, start + datetime.timedelta(days=DEFAULT_LOAN_DAYS - 1)
+
+
+def overlapping(queryset, start, end):
+    return queryset.filter(start_date__lte=end, end_date__gte=start)
+
+
+# Statuses that hold the item; an overdue loan keeps it until it comes back
+BOOKED_STATUSES = ('APPROVED', 'OVERDUE')
+# Items in these statuses aren't in the catalog, so they have no calendar
+UNLISTED_STATUSES = ('PENDING_VERIFICATION', 'REJECTED')
+
+
+def conflicts(item_id, start, end, exclude=None):
+    """Bookings of the item that overlap [start, end]; an overdue one runs on until it is returned"""
+    queryset = BorrowRequest.objects.filter(
+        Q(end_date__gte=start) | Q(status='OVERDUE'),
+        item_id=item_id, status__in=BOOKED_STATUSES, start_date__lte=end,
+    )
+    if exclude is not None:
+        queryset = queryset.exclude(pk=exclude)
+    return queryset
+
+
+def status_after_return(item_id, returned_id, today=None):
+    """The item's status once booking `returned_id` is back: still RESERVED while another booking has started"""
+    today = today or timezone.localdate()
+    if conflicts(item_id, today, today, exclude=returned_id).exists():
+        return 'RESERVED'
+    return 'RETURNED'
+
+
+def due_at(end_date):
+    """The moment a booking ending on `end_date` is due back: the end of that day"""
+    return timezone.make_aware(datetime.datetime.combine(end_date, datetime.time.max))
+
+
+def month_window(value):
+    """First and last day of a YYYY-MM month"""
+    first = datetime.datetime.strptime(value, '%Y-%m').date()
+    following = (first.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return first, following - datetime.timedelta(days=1)
+
+
+def calendar(item_id, start, end):
+    """Booked ranges and per-day availability for [start, end], from a single query"""
+    bookings = [
+        # Overdue loans hold the item for the rest of the window
+        (booking_start, end if booking_status == 'OVERDUE' else booking_end)
+        for booking_start, booking_end, booking_status in
+        conflicts(item_id, start, end).order_by('start_date').values_list('start_date', 'end_date', 'status')
+    ]
+    booked_days = set()
+    for booking_start, booking_end in bookings:
+        day = max(booking_start, start)
+        while day <= min(booking_end, end):
+            booked_days.add(day)
+            day += datetime.timedelta(days=1)
+    days = []
+    day = start
+    while day <= end:
+        days.append({'date': day.isoformat(), 'available': day not in booked_days})
+        day += datetime.timedelta(days=1)
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'booked': [{'start': s.isoformat(), 'end': e.isoformat()} for s, e in bookings],
+        'days': days,
+    }
+
+
+def reserve_started(today=None):
+    """
+    Mark items RESERVED once the first day of an approved booking arrives.
+    Approval only reserves bookings that have already started, so this runs
+    on a schedule (the sweep_overdue command). Returns the number of items
+    changed.
+    """
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        # Current bookings end today or later: a range on the (status, due_date) index
+        started = BorrowRequest.objects.filter(status='APPROVED', due_date__gte=due_at(today), start_date__lte=today)
+        items = list(
+            Item.objects.select_for_update()
+            .filter(pk__in=started.values('item_id'))
+            .exclude(status__in=UNLISTED_STATUSES + ('RESERVED', 'CHECKED_OUT'))
+            .order_by('pk').values_list('id', 'owner_id', *facets.FACET_FIELDS)
+        )
+        if not items:
+            return 0
+        # update() skips the signals, so facet counts, pushes and cache versions are handled here
+        Item.objects.filter(pk__in=[row[0] for row in items]).update(status='RESERVED')
+        for item_id, owner_id, *old_key in items:
+            facets.record_change(tuple(old_key), tuple(old_key[:2]) + ('RESERVED',))
+            realtime.item_changed(item_id, owner_id, 'RESERVED')
+        versioning.bump(versioning.CATALOG)
+    return len(items)
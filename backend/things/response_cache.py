@@ -0,0 +1,49 @@
+"""
+Versioned response cache for anonymous browsing.
+
+Every cached response is keyed on the current version of its scope. Writes
+never delete entries; the model signals bump the version (after the
+transaction commits) so the next request misses and old entries simply
+age out. A response cached under an old version can therefore never be
+served once a change, such as an item approval, has been committed.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from .versioning import get_version
+
+
+def _cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def response_key(scope, request):
+    # The absolute URI covers host (image URLs are absolute), path and query
+    # string (filters, cursors, sparse fieldsets)
+    renderer = getattr(request, 'accepted_renderer', None)
+    raw = f'{request.build_absolute_uri()}|{getattr(renderer, "format", "")}'
+    digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    return f'things:response:{scope}:v{get_version(scope)}:{digest}'
+
+
+def cached_response(scope):
+    """Serve anonymous GETs of a view method from the cache for `scope`"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.user.is_authenticated or request.method != 'GET':
+                return method(self, request, *args, **kwargs)
+            key = response_key(scope, request)
+            data = _cache().get(key)
+            if data is not None:
+                return Response(data)
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                _cache().set(key, response.data, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+            return response
+        return wrapper
+    return decorator
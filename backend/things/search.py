@@ -0,0 +1,150 @@
+"""
+Full-text search over items.
+
+SQLite keeps a separate FTS5 table (`things_item_fts`) whose rowid is the item
+id; it is maintained from the Item save/delete signals. MySQL uses a FULLTEXT
+index on the item table itself, which InnoDB keeps in sync on its own. Both
+rank matches by relevance (BM25 on SQLite, InnoDB's TF-IDF on MySQL), higher
+`search_rank` meaning a better match.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+FTS_TABLE = 'things_item_fts'
+FULLTEXT_INDEX = 'things_item_fulltext'
+SEARCH_COLUMNS = ('name', 'category', 'description')
+
+# BM25 column weights: a hit in the name beats one in the category, which
+# beats one buried in the description
+SQLITE_WEIGHTS = (10.0, 4.0, 1.0)
+
+_fts_ready = {}
+
+
+def sqlite_fts5_available(conn):
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)')
+            cursor.execute('DROP TABLE temp.fts5_probe')
+        except Exception:
+            return False
+    return True
+
+
+def create_index(schema_editor):
+    """Create the search index for the current database vendor (used by migrations)"""
+    conn = schema_editor.connection
+    if conn.vendor == 'sqlite':
+        if not sqlite_fts5_available(conn):
+            return
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5({', '.join(SEARCH_COLUMNS)}, tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(SEARCH_COLUMNS)}) "
+            f"SELECT id, {', '.join(SEARCH_COLUMNS)} FROM things_item"
+        )
+    elif conn.vendor == 'mysql':
+        schema_editor.execute(
+            f"ALTER TABLE things_item ADD FULLTEXT INDEX {FULLTEXT_INDEX} ({', '.join(SEARCH_COLUMNS)})"
+        )
+    _fts_ready.clear()
+
+
+def drop_index(schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif conn.vendor == 'mysql':
+        schema_editor.execute(f'ALTER TABLE things_item DROP INDEX {FULLTEXT_INDEX}')
+    _fts_ready.clear()
+
+
+def fts_enabled():
+    """Whether a full-text index exists for the active connection"""
+    alias = connection.alias
+    if alias not in _fts_ready:
+        if connection.vendor == 'sqlite':
+            _fts_ready[alias] = FTS_TABLE in connection.introspection.table_names()
+        else:
+            _fts_ready[alias] = connection.vendor == 'mysql'
+    return _fts_ready[alias]
+
+
+def index_items(items):
+    """(Re)index items in the SQLite FTS table; a no-op on MySQL"""
+    if connection.vendor != 'sqlite' or not fts_enabled():
+        return
+    rows = [(item.pk, item.name, item.category, item.description) for item in items]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (%s, %s, %s, %s)",
+            rows,
+        )
+
+
+def unindex_items(item_ids):
+    if connection.vendor != 'sqlite' or not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in item_ids])
+
+
+def rebuild_index():
+    """Repopulate the SQLite FTS table from scratch"""
+    if connection.vendor != 'sqlite' or not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(SEARCH_COLUMNS)}) "
+            f"SELECT id, {', '.join(SEARCH_COLUMNS)} FROM things_item"
+        )
+
+
+def _fts5_query(query):
+    # Quote every term so user input can never be parsed as FTS5 syntax, and
+    # allow prefix matches so "ham" finds "hammer"
+    terms = re.findall(r'\w+', query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_items(queryset, query):
+    """
+    Restrict `queryset` to items matching `query`, ordered by relevance.
+
+    The visibility rules stay with the caller: pass in whatever queryset the
+    user is allowed to see. Without a full-text index this degrades to a
+    case-insensitive substring match ordered by recency.
+    """
+    if fts_enabled() and connection.vendor == 'sqlite':
+        match = _fts5_query(query)
+        if not match:
+            return queryset.none()
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = things_item.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'-bm25({FTS_TABLE}, {weights})'},
+        ).order_by('-search_rank', '-id')
+
+    if fts_enabled() and connection.vendor == 'mysql':
+        against = f"MATCH({', '.join(f'things_item.{column}' for column in SEARCH_COLUMNS)}) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+        return queryset.extra(
+            where=[against],
+            params=[query],
+            select={'search_rank': against},
+            select_params=[query],
+        ).order_by('-search_rank', '-id')
+
+    condition = Q()
+    for column in SEARCH_COLUMNS:
+        condition |= Q(**{f'{column}__icontains': query})
+    return queryset.filter(condition).order_by('-created_at', '-id')
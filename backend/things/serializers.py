@@ -1,22 +1,97 @@
+from django.db import models
+from django.utils import timezone
 from rest_framework import serializers
-from .models import User, Item, InspectionReport, BorrowRequest, Message, Rating, UserPoints, PointTransaction
+from .models import User, Item, InspectionReport, BorrowRequest, Conversation, Message, Rating, UserPoints, PointTransaction
+from .fast_serialization import FastListSerializer
+from . import media, reservations
 
-class UserSerializer(serializers.ModelSerializer):
+
+def _field_list(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def sparse_fields(request, available):
+    """
+    The names from `available` kept by the request's ?fields= / ?omit=, or
+    None when the client didn't ask for a sparse fieldset. Only reads are
+    trimmed so writes never lose a field.
+    """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return None
+    params = getattr(request, 'query_params', request.GET)
+    wanted = _field_list(params.get('fields'))
+    omitted = _field_list(params.get('omit'))
+    if not wanted and not omitted:
+        return None
+    return tuple(name for name in available if (not wanted or name in wanted) and name not in omitted)
+
+
+class MediaImageField(serializers.ImageField):
+    """Image URL, signed when the item's image isn't public (see things.media)"""
+    # Columns read, for query planning
+    columns = ('image', 'status')
+
+    def to_representation(self, value):
+        url = super().to_representation(value)
+        if url and not media.is_public(value.instance.status):
+            url = media.sign_url(url, value.name)
+        return url
+
+
+class ImageVariantsField(serializers.Field):
+    """Resized image URLs (absolute when a request is available) plus the BlurHash placeholder"""
+    columns = ('image_variants', 'status')
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, item):
+        from django.core.files.storage import default_storage
+        request = self.context.get('request')
+        public = media.is_public(item.status)
+        result = {}
+        for name, path in item.image_variants.items():
+            if name == 'placeholder':
+                result[name] = path
+                continue
+            url = default_storage.url(path)
+            url = request.build_absolute_uri(url) if request is not None else url
+            result[name] = url if public else media.sign_url(url, path)
+        return result
+
+
+class SparseFieldsetMixin:
+    """Drops the fields excluded by ?fields= / ?omit= on the top-level serializer"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        kept = sparse_fields(self.context.get('request'), list(self.fields))
+        if kept is not None:
+            for name in list(self.fields):
+                if name not in kept:
+                    self.fields.pop(name)
+
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'role', 'location']
 
-class ItemSerializer(serializers.ModelSerializer):
+class ItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    serializer_field_mapping = {**serializers.ModelSerializer.serializer_field_mapping, models.ImageField: MediaImageField}
     owner = UserSerializer(read_only=True)
     owner_id = serializers.IntegerField(read_only=True)
     owner_username = serializers.CharField(source='owner.username', read_only=True)
     owner_email = serializers.CharField(source='owner.email', read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Item
-        fields = ['id', 'owner', 'owner_id', 'owner_username', 'owner_email', 'name', 'category', 'description', 'image', 'ownership_type', 'condition_score', 'status', 'created_at']
+        fields = ['id', 'owner', 'owner_id', 'owner_username', 'owner_email', 'name', 'category', 'description', 'image', 'image_variants', 'ownership_type', 'condition_score', 'status', 'created_at']
+        list_serializer_class = FastListSerializer
 
-class InspectionReportSerializer(serializers.ModelSerializer):
+class InspectionReportSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     item = ItemSerializer(read_only=True)
     staff = UserSerializer(read_only=True)
 
@@ -24,23 +99,41 @@ class InspectionReportSerializer(serializers.ModelSerializer):
         model = InspectionReport
         fields = ['id', 'item', 'staff', 'condition_rating', 'notes', 'inspected_at']
 
-class BorrowRequestSerializer(serializers.ModelSerializer):
+class BorrowRequestSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     item = serializers.PrimaryKeyRelatedField(queryset=Item.objects.all())
     item_name = serializers.CharField(source='item.name', read_only=True)
     item_status = serializers.CharField(source='item.status', read_only=True)
-    item_owner = serializers.IntegerField(source='item.owner.id', read_only=True)
+    # owner_id is on the item row, so listing needs no join to the owner
+    item_owner = serializers.IntegerField(source='item.owner_id', read_only=True)
     borrower_username = serializers.CharField(source='borrower.username', read_only=True)
     request_date = serializers.DateTimeField(source='created_at', read_only=True)
 
     class Meta:
         model = BorrowRequest
-        fields = ['id', 'item', 'borrower', 'item_name', 'item_status', 'item_owner', 'borrower_username', 'status', 'due_date', 'return_date', 'request_date', 'created_at']
+        fields = ['id', 'item', 'borrower', 'item_name', 'item_status', 'item_owner', 'borrower_username', 'status', 'start_date', 'end_date', 'due_date', 'return_date', 'request_date', 'created_at']
         extra_kwargs = {
             'borrower': {'read_only': True},
             'created_at': {'read_only': True}
         }
+        list_serializer_class = FastListSerializer
 
-class MessageSerializer(serializers.ModelSerializer):
+    def validate(self, attrs):
+        start, end = attrs.get('start_date'), attrs.get('end_date')
+        if (start is None) != (end is None):
+            raise serializers.ValidationError({'end_date': 'Give both start_date and end_date, or neither'})
+        if start is None:
+            if self.instance is None:
+                attrs['start_date'], attrs['end_date'] = reservations.default_period()
+            return attrs
+        if end < start:
+            raise serializers.ValidationError({'end_date': 'end_date must not be before start_date'})
+        if start < timezone.localdate():
+            raise serializers.ValidationError({'start_date': 'start_date must not be in the past'})
+        if (end - start).days + 1 > reservations.MAX_LOAN_DAYS:
+            raise serializers.ValidationError({'end_date': f'Bookings are limited to {reservations.MAX_LOAN_DAYS} days'})
+        return attrs
+
+class MessageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     recipient = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
     item = serializers.PrimaryKeyRelatedField(
@@ -52,28 +145,54 @@ class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = ['id', 'sender', 'recipient', 'item', 'subject', 'body', 'is_read', 'created_at']
+        # Relations only read in to_representation
+        extra_select_related = ('recipient', 'item__owner')
+        nested_on_read = {'sender': UserSerializer, 'recipient': UserSerializer, 'item': ItemSerializer}
+        list_serializer_class = FastListSerializer
     
     def to_representation(self, instance):
         """Return nested representations for reads"""
         representation = super().to_representation(instance)
-        representation['sender'] = UserSerializer(instance.sender).data if instance.sender else None
-        representation['recipient'] = UserSerializer(instance.recipient).data if instance.recipient else None
-        representation['item'] = ItemSerializer(instance.item).data if instance.item else None
+        for name, nested_class in self.Meta.nested_on_read.items():
+            if name in representation:
+                related = getattr(instance, name)
+                representation[name] = nested_class(related).data if related else None
         return representation
 
-class RatingSerializer(serializers.ModelSerializer):
+class ConversationSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """A thread as seen by the requesting user: the other participant and their own unread count"""
+    other_user = serializers.SerializerMethodField()
+    item_name = serializers.CharField(source='item.name', read_only=True, default=None)
+    unread_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Conversation
+        fields = ['id', 'other_user', 'item', 'item_name', 'last_message', 'last_message_at', 'last_message_preview', 'last_sender', 'unread_count', 'created_at']
+        read_only_fields = fields
+
+    def _is_user_a(self, conversation):
+        return self.context['request'].user.pk == conversation.user_a_id
+
+    def get_other_user(self, conversation):
+        other = conversation.user_b if self._is_user_a(conversation) else conversation.user_a
+        return {'id': other.pk, 'username': other.username}
+
+    def get_unread_count(self, conversation):
+        return conversation.unread_a if self._is_user_a(conversation) else conversation.unread_b
+
+class RatingSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     staff = UserSerializer(read_only=True)
 
     class Meta:
         model = Rating
         fields = ['id', 'item', 'staff', 'stars', 'comment', 'created_at']
 
-class PointTransactionSerializer(serializers.ModelSerializer):
+class PointTransactionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = PointTransaction
         fields = ['id', 'user', 'points', 'action', 'item', 'description', 'created_at']
 
-class UserPointsSerializer(serializers.ModelSerializer):
+class UserPointsSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = UserPoints
         fields = ['id', 'user', 'total_points', 'updated_at']
@@ -0,0 +1,232 @@
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import User, Item, BorrowRequest, Conversation, Message, Rating, UserPoints, PointTransaction
+from . import conversations, counters, facets, geo, realtime, search, similarity, storage, versioning
+
+
+@receiver(post_init, sender=Item)
+def remember_facet_key(sender, instance, **kwargs):
+    instance._facet_key = facets.facet_key(instance)
+
+
+@receiver(pre_save, sender=Item)
+@receiver(pre_delete, sender=Item)
+def load_facet_key(sender, instance, **kwargs):
+    # Instances loaded with .only()/.defer() don't know their cell yet
+    if instance._facet_key is None and not instance._state.adding:
+        instance._facet_key = facets.stored_key(instance.pk)
+
+
+def _image_name(instance):
+    value = instance.__dict__.get('image', storage.UNKNOWN)
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=Item)
+def remember_image_name(sender, instance, **kwargs):
+    instance._image_name = _image_name(instance)
+
+
+@receiver(pre_save, sender=Item)
+@receiver(pre_delete, sender=Item)
+def load_image_name(sender, instance, **kwargs):
+    if instance._image_name is storage.UNKNOWN and not instance._state.adding:
+        instance._image_name = Item.objects.filter(pk=instance.pk).values_list('image', flat=True).first() or ''
+
+
+@receiver(post_save, sender=Item)
+def count_image_reference(sender, instance, created, **kwargs):
+    old_name = '' if created else instance._image_name
+    new_name = _image_name(instance)
+    if new_name is storage.UNKNOWN:
+        return
+    if new_name != old_name:
+        storage.retain(new_name)
+        storage.release(old_name)
+    instance._image_name = new_name
+
+
+@receiver(post_delete, sender=Item)
+def release_image(sender, instance, **kwargs):
+    storage.release(instance._image_name)
+
+
+@receiver(post_save, sender=Item)
+def index_item(sender, instance, update_fields=None, **kwargs):
+    # Status-only saves (approvals, reservations) don't touch the indexed text
+    if update_fields is not None and not set(update_fields) & set(search.SEARCH_COLUMNS):
+        return
+    search.index_items([instance])
+
+
+@receiver(post_save, sender=Item)
+def refresh_similar_items(sender, instance, created, **kwargs):
+    # Runs before update_facet_counts replaces the key holding the old status
+    was_approved = not created and instance._facet_key is not None and instance._facet_key[2] == 'APPROVED'
+    if instance.__dict__.get('status') == 'APPROVED' and not was_approved:
+        similarity.schedule_add(instance.pk)
+
+
+@receiver(post_save, sender=Item)
+def push_item_status(sender, instance, created, **kwargs):
+    # Also reads the old status from the facet key before it is replaced
+    old_status = None if created or instance._facet_key is None else instance._facet_key[2]
+    status = instance.__dict__.get('status')
+    if not created and old_status is not None and status is not None and status != old_status:
+        realtime.item_changed(instance.pk, instance.owner_id, status)
+
+
+@receiver(post_save, sender=Item)
+def update_facet_counts(sender, instance, created, **kwargs):
+    old_key = None if created else instance._facet_key
+    new_key = facets.facet_key(instance, fallback=old_key)
+    facets.record_change(old_key, new_key)
+    instance._facet_key = new_key
+
+
+@receiver(post_delete, sender=Item)
+def unindex_item(sender, instance, **kwargs):
+    search.unindex_items([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def drop_facet_count(sender, instance, **kwargs):
+    facets.record_change(instance._facet_key, None)
+
+
+@receiver(pre_save, sender=User)
+def geocode_user(sender, instance, update_fields=None, **kwargs):
+    # Partial saves (last_login etc.) leave the location alone
+    if update_fields is not None or 'location' not in instance.__dict__:
+        return
+    point = geo.geocode(instance.location)
+    current = (instance.latitude, instance.longitude)
+    instance._coordinates_changed = point != current and not (point is None and current == (None, None))
+    if instance._coordinates_changed:
+        instance.latitude, instance.longitude = point or (None, None)
+
+
+@receiver(post_save, sender=User)
+def move_user_items(sender, instance, created, **kwargs):
+    if getattr(instance, '_coordinates_changed', False) and not created:
+        # invalidate_catalog bumps the catalog for this save
+        point = None if instance.latitude is None else (instance.latitude, instance.longitude)
+        Item.objects.filter(owner=instance).update(**geo.coordinates_fields(point))
+    instance._coordinates_changed = False
+
+
+@receiver(pre_save, sender=Item)
+def locate_item(sender, instance, **kwargs):
+    if not instance._state.adding or instance.latitude is not None:
+        return
+    if Item.owner.is_cached(instance):
+        point = (instance.owner.latitude, instance.owner.longitude)
+    else:
+        point = User.objects.filter(pk=instance.owner_id).values_list('latitude', 'longitude').first()
+    if point and point[0] is not None:
+        for field, value in geo.coordinates_fields(point).items():
+            setattr(instance, field, value)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_catalog(sender, **kwargs):
+    versioning.bump(versioning.CATALOG)
+
+
+@receiver(post_init, sender=BorrowRequest)
+def remember_request_status(sender, instance, **kwargs):
+    instance._counted_status = instance.__dict__.get('status')
+
+
+def _item_owner_id(instance):
+    if BorrowRequest.item.is_cached(instance):
+        return instance.item.owner_id
+    return Item.objects.filter(pk=instance.item_id).values_list('owner_id', flat=True).first()
+
+
+@receiver(post_save, sender=BorrowRequest)
+def track_request_status(sender, instance, created, **kwargs):
+    """Keep the owner's pending count current and push status changes to both sides"""
+    was = None if created else instance._counted_status
+    # Without the old status (deferred at load) the next reconcile catches up
+    if (created or was is not None) and instance.status != was:
+        owner_id = _item_owner_id(instance)
+        delta = (instance.status == 'PENDING') - (was == 'PENDING')
+        if delta:
+            counters.add(counters.PENDING_REQUESTS, {owner_id: delta})
+        realtime.request_changed(instance.pk, instance.item_id, instance.borrower_id, owner_id, instance.status)
+    instance._counted_status = instance.status
+
+
+@receiver(post_delete, sender=BorrowRequest)
+def uncount_pending_request(sender, instance, **kwargs):
+    if instance.status == 'PENDING':
+        counters.add(counters.PENDING_REQUESTS, {_item_owner_id(instance): -1})
+
+
+@receiver(post_save, sender=BorrowRequest)
+@receiver(post_delete, sender=BorrowRequest)
+def invalidate_borrow_requests(sender, instance, **kwargs):
+    owner_id = Item.objects.filter(pk=instance.item_id).values_list('owner_id', flat=True).first()
+    scopes = [versioning.ALL_BORROWS, versioning.borrows_scope(instance.borrower_id)]
+    if owner_id is not None:
+        scopes.append(versioning.borrows_scope(owner_id))
+    versioning.bump(*scopes)
+
+
+@receiver(post_init, sender=Message)
+def remember_read_state(sender, instance, **kwargs):
+    instance._was_read = instance.__dict__.get('is_read')
+
+
+@receiver(pre_save, sender=Message)
+def attach_conversation(sender, instance, **kwargs):
+    if instance._state.adding:
+        conversations.attach([instance])
+
+
+@receiver(post_save, sender=Message)
+def update_conversation(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        conversations.record([instance])
+        realtime.messages_created([instance])
+    elif instance.conversation_id is not None:
+        if instance._was_read is not None and instance.is_read != instance._was_read:
+            conversations.adjust_unread(instance, -1 if instance.is_read else 1)
+        if update_fields is None or {'subject', 'body'} & set(update_fields):
+            # Only matters when this is the conversation's last message
+            Conversation.objects.filter(pk=instance.conversation_id, last_message_id=instance.pk).update(
+                last_message_preview=conversations.preview(instance.subject, instance.body),
+            )
+    instance._was_read = instance.is_read
+
+
+@receiver(post_delete, sender=Message)
+def drop_from_conversation(sender, instance, **kwargs):
+    if instance.conversation_id is None:
+        return
+    if not instance.is_read:
+        conversations.adjust_unread(instance, -1)
+    # Deleting the last message nulled the conversation's pointer to it
+    if Conversation.objects.filter(pk=instance.conversation_id, last_message__isnull=True).exists():
+        conversations.refresh_last_message(instance.conversation_id)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_messages(sender, instance, **kwargs):
+    versioning.bump(versioning.messages_scope(instance.sender_id), versioning.messages_scope(instance.recipient_id))
+
+
+@receiver(post_save, sender=UserPoints)
+@receiver(post_delete, sender=UserPoints)
+@receiver(post_save, sender=PointTransaction)
+@receiver(post_delete, sender=PointTransaction)
+def invalidate_points(sender, instance, **kwargs):
+    versioning.bump(versioning.points_scope(instance.user_id))
@@ -0,0 +1,290 @@
+"""
+Precomputed "similar items".
+
+Approved items are turned into TF-IDF vectors (name weighted 3x, category 2x,
+description 1x; sublinear term frequency, L2-normalised rows) in a SciPy
+sparse matrix, and cosine similarity is a sparse matrix product. The top-k
+neighbours of every item are stored in SimilarItem, so the endpoint reads one
+indexed list instead of comparing vectors per request.
+
+`rebuild` recomputes every list in row blocks (the build_similar_items
+command). `add_item` runs when an item is created approved or gets approved:
+it computes that item's neighbours and slots it into the lists of the items
+it is closest to, leaving every other list untouched. It works from a
+`CatalogIndex` kept in the process, so only the new item is vectorized and it
+is scored against just the items that share one of its terms.
+"""
+import atexit
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from scipy import sparse
+
+from .models import Item, SimilarItem
+from . import versioning
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 10
+# Items whose lists a newly approved item may enter
+CANDIDATES = TOP_K * 5
+# Version scope moved on by add_item and rebuild, so each process notices when its CatalogIndex is behind
+INDEX_SCOPE = 'similar-items:index'
+FIELD_WEIGHTS = (('name', 3), ('category', 2), ('description', 1))
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from in is it of on or the this to with very good new used'.split()
+)
+
+_executor = None
+
+
+def tokens(text):
+    return [word for word in re.findall(r'[a-z0-9]+', (text or '').lower()) if len(word) > 1 and word not in STOP_WORDS]
+
+
+def term_counts(row):
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for word in tokens(row[field]):
+            counts[word] += weight
+    if row['category']:
+        # Same category counts even when the wording differs
+        counts['category:' + row['category'].strip().lower()] += FIELD_WEIGHTS[1][1]
+    return counts
+
+
+def term_matrix(rows, vocabulary):
+    """Sublinear term frequencies, one row per entry of `rows`; new terms are added to `vocabulary`"""
+    indptr, indices, data = [0], [], []
+    for row in rows:
+        for term, count in term_counts(row).items():
+            indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            data.append(count)
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix(
+        (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+        shape=(len(rows), len(vocabulary)),
+    )
+    matrix.data = 1 + np.log(matrix.data)
+    return matrix
+
+
+def idf(document_frequency, documents):
+    return np.log((1 + documents) / (1 + np.asarray(document_frequency, dtype=np.float64))) + 1
+
+
+def vectorize(rows):
+    """L2-normalised TF-IDF matrix, one row per entry of `rows`"""
+    matrix = term_matrix(rows, {})
+    return weigh(matrix, np.bincount(matrix.indices, minlength=matrix.shape[1]), len(rows))
+
+
+def weigh(matrix, document_frequency, documents):
+    matrix = (matrix @ sparse.diags(idf(document_frequency, documents).astype(np.float32))).tocsr()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ matrix).tocsr()
+
+
+class CatalogIndex:
+    """
+    The TF-IDF statistics of the approved catalog and an inverted index of
+    its vectors (term -> item positions and weights). Adding an item
+    vectorizes only that item, with the document frequencies updated, and
+    scores it through the postings of its own terms. Existing vectors keep
+    the IDF they were built with until the index is next loaded.
+    """
+    _no_positions = np.zeros(0, dtype=np.int64)
+    _no_weights = np.zeros(0, dtype=np.float32)
+
+    def __init__(self, rows):
+        self.version = None
+        self.ids = [row['id'] for row in rows]
+        self.position = {pk: index for index, pk in enumerate(self.ids)}
+        self.vocabulary = {}
+        counts = term_matrix(rows, self.vocabulary)
+        self.document_frequency = np.bincount(counts.indices, minlength=len(self.vocabulary)).tolist()
+        matrix = weigh(counts, self.document_frequency, len(rows))
+        self.vectors = [
+            (matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]], matrix.data[matrix.indptr[row]:matrix.indptr[row + 1]])
+            for row in range(len(rows))
+        ]
+        by_term = matrix.tocsc()
+        self.postings = {
+            term: (by_term.indices[by_term.indptr[term]:by_term.indptr[term + 1]].astype(np.int64),
+                   by_term.data[by_term.indptr[term]:by_term.indptr[term + 1]])
+            for term in range(len(self.vocabulary)) if by_term.indptr[term + 1] > by_term.indptr[term]
+        }
+
+    def add(self, row):
+        """Index a newly approved item; returns its position"""
+        counts = term_counts(row)
+        terms = np.asarray([self.vocabulary.setdefault(term, len(self.vocabulary)) for term in counts], dtype=np.int64)
+        self.document_frequency.extend([0] * (len(self.vocabulary) - len(self.document_frequency)))
+        for term in terms:
+            self.document_frequency[term] += 1
+        weights = np.asarray([1 + math.log(count) for count in counts.values()], dtype=np.float64)
+        weights *= idf([self.document_frequency[term] for term in terms], len(self.ids) + 1)
+        norm = np.sqrt((weights ** 2).sum()) or 1
+        weights = (weights / norm).astype(np.float32)
+
+        position = len(self.ids)
+        self.ids.append(row['id'])
+        self.position[row['id']] = position
+        self.vectors.append((terms, weights))
+        for term, weight in zip(terms, weights):
+            positions, values = self.postings.get(term, (self._no_positions, self._no_weights))
+            self.postings[term] = (np.append(positions, position), np.append(values, weight))
+        return position
+
+    def scores(self, position):
+        """Cosine similarity of the item at `position` to every indexed item"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term, weight in zip(*self.vectors[position]):
+            positions, values = self.postings[term]
+            scores[positions] += weight * values
+        return scores
+
+
+_index = None
+# add_item may run on the executor thread and in request threads ('sync')
+_index_lock = threading.Lock()
+
+
+def corpus():
+    rows = list(
+        Item.objects.filter(status='APPROVED').order_by('id').values('id', 'name', 'category', 'description')
+    )
+    return [row['id'] for row in rows], rows
+
+
+def best(scores, columns, k, exclude):
+    """(score, column) pairs of the `k` highest positive scores, highest first"""
+    keep = (scores > 0) & (columns != exclude)
+    scores, columns = scores[keep], columns[keep]
+    if len(scores) > k:
+        top = np.argpartition(-scores, k)[:k]
+        scores, columns = scores[top], columns[top]
+    order = np.lexsort((columns, -scores))
+    return [(float(scores[i]), int(columns[i])) for i in order]
+
+
+def neighbour_rows(item_id, neighbours):
+    return [
+        SimilarItem(item_id=item_id, similar_id=similar_id, score=score, rank=rank)
+        for rank, (score, similar_id) in enumerate(neighbours)
+    ]
+
+
+def rebuild(k=TOP_K, block_size=1000):
+    """Recompute every item's neighbours; returns the number of items processed"""
+    ids, rows = corpus()
+    matrix = vectorize(rows) if rows else None
+    new_rows = []
+    for start in range(0, len(ids), block_size):
+        # Sparse block x corpus product keeps memory bounded by the block
+        block = (matrix[start:start + block_size] @ matrix.T).tocsr()
+        for offset in range(block.shape[0]):
+            row = start + offset
+            cells = slice(block.indptr[offset], block.indptr[offset + 1])
+            neighbours = best(block.data[cells], block.indices[cells], k, exclude=row)
+            new_rows.extend(neighbour_rows(ids[row], [(score, ids[column]) for score, column in neighbours]))
+
+    with transaction.atomic():
+        SimilarItem.objects.all().delete()
+        SimilarItem.objects.bulk_create(new_rows, batch_size=5000)
+    # Bulk writes skip the signals that invalidate cached responses
+    versioning.bump(versioning.CATALOG, INDEX_SCOPE)
+    return len(ids)
+
+
+def catalog_index():
+    """
+    The process's CatalogIndex, loaded from the approved catalog when missing
+    or when another process has added items since (INDEX_SCOPE moved on).
+    Items that later leave the catalog stay indexed and are filtered out of
+    the results.
+    """
+    global _index
+    version = versioning.get_version(INDEX_SCOPE)
+    if _index is None or _index.version != version:
+        _index = CatalogIndex(corpus()[1])
+        _index.version = version
+    return _index
+
+
+def add_item(item_id, k=TOP_K):
+    """Store `item_id`'s neighbours and add it to the lists of the items it is most similar to"""
+    row = Item.objects.filter(pk=item_id, status='APPROVED').values('id', 'name', 'category', 'description').first()
+    if row is None:
+        return
+    with _index_lock:
+        index = catalog_index()
+        position = index.position.get(item_id)
+        if position is None:
+            position = index.add(row)
+            # Other processes reload their index; this one is already current
+            versioning.bump(INDEX_SCOPE)
+            index.version = versioning.get_version(INDEX_SCOPE)
+        scores = index.scores(position)
+        ids = index.ids
+    columns = np.arange(len(ids))
+    nearest = [(score, ids[column]) for score, column in best(scores, columns, CANDIDATES, exclude=position)]
+    # Items rejected or deleted since the index was loaded drop out here
+    approved = set(Item.objects.filter(pk__in=[pk for _, pk in nearest], status='APPROVED').values_list('id', flat=True))
+    nearest = [(score, pk) for score, pk in nearest if pk in approved]
+    lists = {item_id: nearest[:k]}
+
+    current = {}
+    for entry in SimilarItem.objects.filter(item_id__in=[pk for _, pk in nearest]).exclude(similar_id=item_id).order_by('rank'):
+        current.setdefault(entry.item_id, []).append((entry.score, entry.similar_id))
+    for score, other in nearest:
+        entries = current.get(other, [])
+        if len(entries) < k or score > entries[-1][0]:
+            lists[other] = sorted(entries + [(score, item_id)], key=lambda pair: (-pair[0], pair[1]))[:k]
+
+    with transaction.atomic():
+        SimilarItem.objects.filter(item_id__in=list(lists)).delete()
+        SimilarItem.objects.bulk_create(
+            [entry for owner, neighbours in lists.items() for entry in neighbour_rows(owner, neighbours)]
+        )
+    versioning.bump(versioning.CATALOG)
+
+
+def _run(item_id):
+    try:
+        add_item(item_id)
+    except Exception:
+        logger.exception('Similar items update failed for item %s', item_id)
+    finally:
+        connection.close()
+
+
+def schedule_add(item_id):
+    """Refresh neighbours for a newly approved item once the save commits"""
+    global _executor
+    if getattr(settings, 'SIMILAR_ITEMS_EXECUTOR', 'thread') == 'sync':
+        transaction.on_commit(lambda: add_item(item_id))
+        return
+    if _executor is None:
+        # One worker, so two approvals never rewrite the same lists concurrently
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similar-items')
+        atexit.register(shutdown)
+    executor = _executor
+    transaction.on_commit(lambda: executor.submit(_run, item_id))
+
+
+def shutdown(wait=True):
+    """Stop the worker thread, by default after it finishes the queued updates"""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+        atexit.unregister(shutdown)
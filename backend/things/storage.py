@@ -0,0 +1,147 @@
+"""
+Content-addressed storage for item images.
+
+Uploads are hashed (SHA-256) chunk by chunk while they are streamed to a
+temporary file, then moved to `<upload dir>/<aa>/<digest><ext>`. A second
+upload of the same bytes finds the file already there and reuses it, so each
+distinct image is written and backed up once. MediaBlob counts how many items
+reference each file; the file is deleted when the last reference goes.
+
+An upload can reuse a file in the moment between its last reference going and
+the deletion, before the new item retains it. Deletion therefore re-checks
+the count under a row lock and leaves files an upload touched within
+REUSE_GRACE seconds alone; `sweep_unreferenced` (the sweep_media command)
+deletes what was left behind.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+from .uploads import UploadTooLarge
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # Names are derived from content, so an existing file is a duplicate
+        # to reuse rather than a clash to avoid
+        return name
+
+    def _save(self, name, content):
+        limit = getattr(settings, 'MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+        size = getattr(content, 'size', None)
+        if size is not None and size > limit:
+            raise UploadTooLarge(limit)
+
+        directory, basename = os.path.split(name)
+        extension = os.path.splitext(basename)[1].lower()
+        target_dir = self.path(directory)
+        os.makedirs(target_dir, exist_ok=True)
+
+        digest = hashlib.sha256()
+        written = 0
+        fd, temp_path = tempfile.mkstemp(dir=target_dir, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    written += len(chunk)
+                    if written > limit:
+                        raise UploadTooLarge(limit)
+                    digest.update(chunk)
+                    temp.write(chunk)
+
+            hexdigest = digest.hexdigest()
+            final_name = '/'.join(part for part in (directory, hexdigest[:2], hexdigest + extension) if part)
+            final_path = self.path(final_name)
+            try:
+                # Marks the file as just reused, so a concurrent release keeps it
+                os.utime(final_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                os.replace(temp_path, final_path)
+            else:
+                os.unlink(temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return final_name
+
+
+item_image_storage = ContentAddressedStorage()
+
+# Marks an Item whose image column was deferred when it was loaded
+UNKNOWN = object()
+# Seconds after an upload reuses a file during which it isn't deleted, even unreferenced
+REUSE_GRACE = 60
+
+
+def get_item_image_storage():
+    return item_image_storage
+
+
+def retain(name):
+    """Count one more item referencing `name`"""
+    from .models import MediaBlob
+    if not name or name is UNKNOWN:
+        return
+    if MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+        return
+    try:
+        size = item_image_storage.size(name)
+    except OSError:
+        size = 0
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, size=size, ref_count=1)
+    except IntegrityError:
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+
+def release(name):
+    """Drop one reference to `name`, deleting the file after the last one is gone"""
+    from .models import MediaBlob
+    if not name or name is UNKNOWN:
+        return
+    MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') - 1)
+    if MediaBlob.objects.filter(name=name, ref_count__lte=0).exists():
+        transaction.on_commit(lambda: delete_if_unreferenced(name))
+
+
+def _recently_reused(name):
+    try:
+        return time.time() - os.path.getmtime(item_image_storage.path(name)) < REUSE_GRACE
+    except OSError:
+        return False
+
+
+def delete_if_unreferenced(name):
+    """Delete `name` and its MediaBlob if nothing references it any more; True when deleted"""
+    from .models import MediaBlob
+    with transaction.atomic():
+        # retain() increments this row, so it has either made the count positive or waits for this lock
+        blob = MediaBlob.objects.select_for_update().filter(name=name, ref_count__lte=0).first()
+        if blob is None or _recently_reused(name):
+            return False
+        blob.delete()
+        item_image_storage.delete(name)
+    return True
+
+
+def sweep_unreferenced():
+    """Delete every file left without references; returns how many were deleted"""
+    from .models import MediaBlob
+    names = MediaBlob.objects.filter(ref_count__lte=0).values_list('name', flat=True)
+    return sum(delete_if_unreferenced(name) for name in list(names))
@@ -1,3 +1,1720 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import datetime
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Q, QuerySet
+from asgiref.sync import sync_to_async
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User, Item, ItemFacetCount, InspectionReport, BorrowRequest, Conversation, MediaBlob, Message, PointTransaction, SimilarItem, UserCounter
+from .fast_serialization import FastListSerializer
+from . import bulk, conversations, counters, decisions, export, geo, images, media, overdue, realtime, reservations, search, similarity, storage
+from .serializers import ItemSerializer, BorrowRequestSerializer, MessageSerializer, InspectionReportSerializer
+from .views import ItemViewSet, BorrowRequestViewSet, MessageViewSet, PointTransactionViewSet, InspectionReportViewSet
+
+
+def full_scans(queryset):
+    """Tables the database would read in full to answer `queryset`"""
+    return statement_scans(*queryset.query.sql_with_params())
+
+
+def statement_scans(sql, params=None):
+    """Tables the database would read in full to run `sql`"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return re.findall(r'\bSCAN (\w+)', '\n'.join(row[-1] for row in cursor.fetchall()))
+        if connection.vendor != 'mysql':
+            return []
+        cursor.execute('EXPLAIN FORMAT=JSON ' + sql, params)
+        plan = json.loads(cursor.fetchone()[0])
+    scans = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get('access_type') == 'ALL':
+                scans.append(node.get('table_name'))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(plan)
+    return scans
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN every hot viewset queryset and fail if it falls back to a table
+    scan. Endpoints that build their queries inline are requested for real
+    and every SELECT they run is explained.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', role='STAFF')
+        for i in range(20):
+            item = Item.objects.create(
+                owner=cls.alice if i % 2 else cls.bob,
+                name=f'Item {i}',
+                category='Tools',
+                description='A thing',
+                ownership_type='SHARE',
+                status='APPROVED' if i % 3 else 'PENDING_VERIFICATION',
+                **geo.coordinates_fields((18.52 + i / 1000, 73.85) if i % 4 else None),
+            )
+            BorrowRequest.objects.create(item=item, borrower=cls.bob if i % 2 else cls.alice)
+            Message.objects.create(sender=cls.alice, recipient=cls.bob, item=item, subject='Hi', body='Hello')
+            PointTransaction.objects.create(user=cls.alice, points=10, action='ITEM_APPROVED', item=item)
+
+    def viewset_queryset(self, viewset_class, action, user):
+        request = APIRequestFactory().get('/')
+        request.user = user
+        view = viewset_class(action=action, request=request, format_kwarg=None, kwargs={})
+        return view.filter_queryset(view.get_queryset())
+
+    def assertNoFullScan(self, queryset, allowed=()):
+        scans = [table for table in full_scans(queryset) if table not in allowed]
+        self.assertEqual(scans, [], f'Full table scan on {scans}:\n{queryset.query}')
+
+    def assertNoFullScanIn(self, captured, allowed=()):
+        statements = [query['sql'] for query in captured if query['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertTrue(statements, 'No SELECT was captured')
+        for sql in statements:
+            scans = [table for table in statement_scans(sql) if table not in allowed]
+            self.assertEqual(scans, [], f'Full table scan on {scans}:\n{sql}')
+
+    def request(self, user, url, method='get', data=None, expected=200):
+        """The queries the endpoint at `url` runs for `user`"""
+        caches['default'].clear()
+        api = APIClient()
+        if user is not None:
+            api.force_authenticate(user)
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(api, method)(url, data, format='json')
+        self.assertEqual(response.status_code, expected, response.content)
+        return captured
+
+    def test_item_list_anonymous(self):
+        self.assertNoFullScan(self.viewset_queryset(ItemViewSet, 'list', AnonymousUser()))
+
+    def test_item_list_authenticated(self):
+        self.assertNoFullScanIn(self.request(self.alice, '/api/items/'))
+        self.assertNoFullScanIn(self.request(self.alice, '/api/items/?page_size=5'))
+
+    def test_item_retrieve_authenticated(self):
+        self.assertNoFullScan(self.viewset_queryset(ItemViewSet, 'retrieve', self.alice))
+
+    def test_item_management(self):
+        self.assertNoFullScan(self.viewset_queryset(ItemViewSet, 'update', self.alice))
+
+    def test_public_list(self):
+        self.assertNoFullScanIn(self.request(None, '/api/items/public_list/'))
+        self.assertNoFullScanIn(self.request(None, '/api/items/public_list/?page_size=5'))
+
+    def test_pending_items(self):
+        self.assertNoFullScanIn(self.request(self.staff, '/api/item-approval/pending_items/'))
+
+    def test_nearby_candidates(self):
+        captured = self.request(None, '/api/items/nearby/?lat=18.52&lon=73.85&radius=10')
+        self.assertTrue(any('geohash' in query['sql'] for query in captured))
+        self.assertNoFullScanIn(captured)
+
+    def test_borrow_requests_for_customer(self):
+        self.assertNoFullScan(self.viewset_queryset(BorrowRequestViewSet, 'list', self.alice))
+
+    def test_borrow_requests_sent_and_received(self):
+        self.assertNoFullScanIn(self.request(self.alice, '/api/borrow-requests/'))
+        self.assertNoFullScanIn(self.request(self.alice, '/api/borrow-requests/sent/'))
+        self.assertNoFullScanIn(self.request(self.alice, '/api/borrow-requests/received/'))
+
+    def test_duplicate_borrow_request_check(self):
+        item = Item.objects.filter(owner=self.bob, status='APPROVED').first()
+        captured = self.request(self.alice, '/api/borrow-requests/', 'post', {'item': item.pk}, expected=201)
+        self.assertTrue(any("'PENDING'" in query['sql'] for query in captured))
+        self.assertNoFullScanIn(captured)
+
+    def test_booking_conflicts(self):
+        today = timezone.localdate()
+        self.assertNoFullScan(reservations.conflicts(1, today, today))
+        BorrowRequest.objects.filter(borrower=self.alice).update(
+            status='APPROVED', start_date=today, end_date=today, due_date=timezone.now() - datetime.timedelta(days=1),
+        )
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(overdue.sweep(batch_size=5), 10)
+        self.assertNoFullScanIn(captured)
+
+    def test_messages(self):
+        self.assertNoFullScan(self.viewset_queryset(MessageViewSet, 'list', self.alice))
+
+    def test_inbox_and_sent(self):
+        self.assertNoFullScanIn(self.request(self.bob, '/api/messages/inbox/'))
+        self.assertNoFullScanIn(self.request(self.alice, '/api/messages/sent/'))
+
+    def test_conversations(self):
+        self.assertNoFullScanIn(self.request(self.bob, '/api/conversations/'))
+        conversation = Conversation.objects.first()
+        self.assertNoFullScanIn(self.request(self.bob, f'/api/conversations/{conversation.pk}/messages/'))
+
+    def test_point_transactions(self):
+        self.assertNoFullScan(self.viewset_queryset(PointTransactionViewSet, 'list', self.alice))
+
+    def test_inspection_reports_join_by_key(self):
+        # Staff list every report, but the joined item/owner/staff rows must
+        # be fetched by primary key rather than scanned
+        self.assertNoFullScan(
+            self.viewset_queryset(InspectionReportViewSet, 'list', self.staff),
+            allowed=('things_inspectionreport',),
+        )
+
+
+class QueryCountTests(TestCase):
+    """List and detail endpoints issue the same number of queries however many related rows they render"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', role='STAFF')
+        self.added = 0
+        self.item = self.add_rows()
+
+    def add_rows(self, count=2):
+        """Items, requests and reports each tied to users of their own, so nothing is shared between rows"""
+        for number in range(self.added, self.added + count):
+            owner = User.objects.create_user(f'owner{number}', f'owner{number}@example.com')
+            item = Item.objects.create(
+                owner=owner, name=f'Item {number}', category='Tools', description='Spare', ownership_type='SHARE', status='APPROVED',
+            )
+            BorrowRequest.objects.create(item=item, borrower=self.alice)
+            mine = Item.objects.create(
+                owner=self.alice, name=f'Mine {number}', category='Tools', description='Spare', ownership_type='SHARE',
+            )
+            borrower = User.objects.create_user(f'borrower{number}', f'borrower{number}@example.com')
+            BorrowRequest.objects.create(item=mine, borrower=borrower)
+            inspector = User.objects.create_user(f'inspector{number}', f'inspector{number}@example.com', role='STAFF')
+            InspectionReport.objects.create(item=item, staff=inspector, condition_rating=4)
+        self.added += count
+        return item
+
+    def count(self, user, url):
+        caches['default'].clear()
+        api = APIClient()
+        api.force_authenticate(user)
+        with CaptureQueriesContext(connection) as captured:
+            response = api.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(captured)
+
+    def assertConstant(self, user, url):
+        few = self.count(user, url)
+        self.add_rows(count=8)
+        self.assertEqual(self.count(user, url), few, url)
+
+    def test_item_list(self):
+        self.assertConstant(self.alice, '/api/items/')
+
+    def test_item_list_page(self):
+        self.assertConstant(self.alice, '/api/items/?page_size=50')
+
+    def test_item_retrieve(self):
+        url = f'/api/items/{self.item.pk}/'
+        self.assertEqual(self.count(self.alice, url), self.count(self.alice, f'/api/items/{self.add_rows().pk}/'))
+
+    def test_borrow_request_list(self):
+        self.assertConstant(self.alice, '/api/borrow-requests/')
+        self.assertConstant(self.staff, '/api/borrow-requests/')
+
+    def test_borrow_request_retrieve(self):
+        borrow_request = BorrowRequest.objects.filter(item=self.item).get()
+        self.assertConstant(self.alice, f'/api/borrow-requests/{borrow_request.pk}/')
+
+    def test_inspection_report_list(self):
+        self.assertConstant(self.staff, '/api/inspection-reports/')
+
+
+class SerializerParityTests(TestCase):
+    """The compiled list serializers must render byte-identical JSON to DRF's"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'pw', location='Pune')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', role='STAFF')
+        for i in range(6):
+            item = Item.objects.create(
+                owner=cls.alice if i % 2 else cls.bob,
+                name=f'Item {i}',
+                category='Tools',
+                description='A thing',
+                ownership_type=['SELL', 'EXCHANGE', 'SHARE'][i % 3],
+                condition_score=i % 5 + 1 if i % 2 else None,
+                status='APPROVED',
+                image=f'item_images/item{i}.jpg' if i % 3 else None,
+            )
+            BorrowRequest.objects.create(
+                item=item,
+                borrower=cls.bob,
+                status='APPROVED' if i % 2 else 'PENDING',
+                due_date=timezone.now() if i % 2 else None,
+            )
+            Message.objects.create(
+                sender=cls.alice, recipient=cls.bob, item=item if i % 2 else None, subject=f'Re: {i}', body='Hello'
+            )
+            if i % 2:
+                InspectionReport.objects.create(item=item, staff=cls.staff, condition_rating=4, notes='ok')
+
+    def render_both(self, serializer_class, queryset, url='/'):
+        request = Request(APIRequestFactory().get(url))
+        context = {'request': request}
+        slow = serializers.ListSerializer(queryset, child=serializer_class(context=context), context=context)
+        fast = FastListSerializer(queryset, child=serializer_class(context=context), context=context)
+        return JSONRenderer().render(slow.data), JSONRenderer().render(fast.data)
+
+    def assertParity(self, serializer_class, queryset, url='/'):
+        slow, fast = self.render_both(serializer_class, queryset, url)
+        self.assertEqual(slow, fast)
+        return slow
+
+    def test_list_serializer_class(self):
+        for serializer_class in (ItemSerializer, BorrowRequestSerializer, MessageSerializer):
+            self.assertIsInstance(serializer_class(many=True), FastListSerializer)
+
+    def test_item_serializer(self):
+        self.assertParity(ItemSerializer, Item.objects.order_by('id'))
+
+    def test_borrow_request_serializer(self):
+        self.assertParity(BorrowRequestSerializer, BorrowRequest.objects.order_by('id'))
+
+    def test_message_serializer(self):
+        self.assertParity(MessageSerializer, Message.objects.order_by('id'))
+
+    def test_nested_item_serializer(self):
+        self.assertParity(InspectionReportSerializer, InspectionReport.objects.order_by('id'))
+
+    def test_sparse_fieldsets(self):
+        rendered = self.assertParity(ItemSerializer, Item.objects.order_by('id'), '/?fields=id,name,image,status')
+        self.assertEqual(set(json.loads(rendered)[0]), {'id', 'name', 'image', 'status'})
+        self.assertParity(MessageSerializer, Message.objects.order_by('id'), '/?omit=sender,body')
+
+
+class MediaTests(TestCase):
+    image = 'item_images/ab/' + 'ab' * 32 + '.png'
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(MEDIA_ROOT=root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name in (self.image, 'item_images/chair.webp'):
+            os.makedirs(os.path.dirname(os.path.join(root.name, name)), exist_ok=True)
+            with open(os.path.join(root.name, name), 'wb') as handle:
+                handle.write(b'image')
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.item = Item.objects.create(
+            owner=self.alice, name='Drill', category='Tools', description='Cordless',
+            ownership_type='SHARE', status='PENDING_VERIFICATION', image=self.image,
+        )
+
+    def test_only_rejected_images_are_hidden(self):
+        for status in ('PENDING_VERIFICATION', 'RESERVED', 'RETURNED'):
+            Item.objects.filter(pk=self.item.pk).update(status=status)
+            self.assertEqual(self.client.get('/media/' + self.image).status_code, 200, status)
+        Item.objects.filter(pk=self.item.pk).update(status='REJECTED')
+        self.assertEqual(self.client.get('/media/' + self.image).status_code, 404)
+
+    def test_signed_url(self):
+        Item.objects.filter(pk=self.item.pk).update(status='REJECTED')
+        owner = APIClient()
+        owner.force_authenticate(self.alice)
+        url = owner.get(f'/api/items/{self.item.pk}/').json()['image']
+        # What an <img> tag sends: the URL alone, no credentials
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.client.get(url.replace('signature=', 'signature=x')).status_code, 404)
+        self.assertEqual(self.client.get(media.sign_url('/media/' + self.image, 'item_images/other.png')).status_code, 404)
+
+    def test_only_content_addressed_names_are_immutable(self):
+        Item.objects.create(
+            owner=self.alice, name='Chair', category='Furniture', description='Oak',
+            ownership_type='SHARE', status='APPROVED', image='item_images/chair.webp',
+        )
+        self.assertIn('immutable', self.client.get('/media/' + self.image)['Cache-Control'])
+        legacy = self.client.get('/media/item_images/chair.webp')
+        self.assertEqual(legacy.status_code, 200)
+        self.assertNotIn('immutable', legacy['Cache-Control'])
+        self.assertIn('no-cache', legacy['Cache-Control'])
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.api = APIClient()
+        self.api.force_authenticate(self.alice)
+        moments = [timezone.now() - timezone.timedelta(minutes=minutes) for minutes in (1, 2, 2, 2, 3, 4, 4)]
+        for number, created_at in enumerate(moments):
+            Item.objects.create(
+                owner=self.alice, name=f'Item {number}', category='Tools', description='Spare',
+                ownership_type='SHARE', status='APPROVED' if number % 2 else 'PENDING_VERIFICATION', created_at=created_at,
+            )
+        self.expected = list(Item.objects.order_by('-created_at', '-id').values_list('name', flat=True))
+
+    def walk(self, url):
+        names, pages = [], []
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json())
+            names += [row['name'] for row in pages[-1]['results']]
+            url = pages[-1]['next']
+        return names, pages
+
+    def test_pages_cover_ties_once_in_order(self):
+        names, pages = self.walk('/api/items/?page_size=2')
+        self.assertEqual(names, self.expected)
+        self.assertEqual(len(pages), 4)
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_cursor_is_stable_under_inserts(self):
+        first = self.api.get('/api/items/?page_size=3').json()
+        Item.objects.create(
+            owner=self.alice, name='Newest', category='Tools', description='Spare', ownership_type='SHARE', status='APPROVED',
+        )
+        rest, _ = self.walk(first['next'])
+        self.assertEqual([row['name'] for row in first['results']] + rest, self.expected)
+        # Walking back from the second page gives the first page again, ties included
+        second = self.api.get(first['next']).json()
+        previous = self.api.get(second['previous']).json()
+        self.assertEqual(previous['results'], first['results'])
+
+    def test_plain_list_without_opting_in(self):
+        response = self.api.get('/api/items/')
+        self.assertIsInstance(response.json(), list)
+        self.assertEqual(sorted(row['name'] for row in response.json()), sorted(self.expected))
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'eyJ0IjoxfQ', base64.urlsafe_b64encode(b'{"t":"soon","i":1}').decode()):
+            response = self.api.get(f'/api/items/?cursor={cursor}')
+            self.assertEqual((response.status_code, response.json()), (404, {'detail': 'Invalid cursor'}), cursor)
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.drill = Item.objects.create(
+            owner=self.alice, name='Drill', category='Tools', description='Cordless', ownership_type='SHARE', status='APPROVED',
+        )
+        Item.objects.create(
+            owner=self.alice, name='Saw', category='Tools', description='Hand saw', ownership_type='SHARE',
+        )
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['name'] for row in response.json())
+
+    def test_second_anonymous_get_is_a_cache_hit(self):
+        for url in ('/api/items/', f'/api/items/{self.drill.pk}/'):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second.json(), first.json())
+
+    def test_committed_write_invalidates_list_and_retrieve(self):
+        url = f'/api/items/{self.drill.pk}/'
+        self.assertEqual(self.names(self.client.get('/api/items/')), ['Drill'])
+        self.assertEqual(self.client.get(url).json()['name'], 'Drill')
+        self.drill.name = 'Hammer drill'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.drill.save()
+        # The version moves on commit, so until then the cached copies are served
+        self.assertEqual(self.client.get(url).json()['name'], 'Drill')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.names(self.client.get('/api/items/')), ['Hammer drill'])
+        self.assertEqual(self.client.get(url).json()['name'], 'Hammer drill')
+
+    def test_signed_in_users_never_share_cached_responses(self):
+        self.assertEqual(self.names(self.client.get('/api/items/')), ['Drill'])
+        alice, bob = APIClient(), APIClient()
+        alice.force_authenticate(self.alice)
+        bob.force_authenticate(self.bob)
+        # Alice sees her own pending item, not the anonymous copy
+        self.assertEqual(self.names(alice.get('/api/items/')), ['Drill', 'Saw'])
+        # and her response isn't stored for anyone else
+        self.assertEqual(self.names(bob.get('/api/items/')), ['Drill'])
+        self.assertEqual(self.names(self.client.get('/api/items/')), ['Drill'])
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        self.api = APIClient()
+        self.api.force_authenticate(self.alice)
+
+    def send(self, sender, recipient):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(sender=sender, recipient=recipient, subject='Hello', body='Is it free?')
+
+    def test_messages(self):
+        self.send(self.bob, self.alice)
+        etag = self.api.get('/api/messages/inbox/')['ETag']
+        self.assertEqual(self.api.get('/api/messages/inbox/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Someone else's conversation leaves alice's validators alone
+        self.send(self.carol, self.bob)
+        self.assertEqual(self.api.get('/api/messages/inbox/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # and her ETag means nothing to bob
+        bob = APIClient()
+        bob.force_authenticate(self.bob)
+        self.assertEqual(bob.get('/api/messages/inbox/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.send(self.carol, self.alice)
+        response = self.api.get('/api/messages/inbox/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, len(response.json())), (200, 2))
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_catalog(self):
+        item = Item.objects.create(
+            owner=self.alice, name='Drill', category='Tools', description='Cordless', ownership_type='SHARE',
+        )
+        response = self.client.get('/api/items/')
+        etag = response['ETag']
+        self.assertEqual(response.json(), [])
+        self.assertEqual(self.client.get('/api/items/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        item.status = 'APPROVED'
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        response = self.client.get('/api/items/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, [row['name'] for row in response.json()]), (200, ['Drill']))
+
+
+class ImagePipelineTests(TestCase):
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(MEDIA_ROOT=root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.owner = APIClient()
+        self.owner.force_authenticate(self.alice)
+
+    def upload(self):
+        from PIL import Image
+        data = io.BytesIO()
+        Image.new('RGB', (1600, 800), 'red').save(data, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.owner.post('/api/items/', {
+                'name': 'Drill', 'category': 'Tools', 'description': 'Cordless', 'ownership_type': 'SHARE',
+                'image': SimpleUploadedFile('drill.png', data.getvalue(), content_type='image/png'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return Item.objects.get(pk=response.json()['id'])
+
+    def test_variants_and_placeholder(self):
+        from PIL import Image
+        from django.core.files.storage import default_storage
+        item = self.upload()
+        self.assertEqual(set(item.image_variants), {'thumb', 'medium', 'placeholder'})
+        for name, longest in images.VARIANT_SIZES.items():
+            with Image.open(default_storage.path(item.image_variants[name])) as variant:
+                self.assertEqual(variant.size, (longest, longest // 2))
+        # What the reference encoder (github.com/woltapp/blurhash) gives for the same 32x16 thumbnail
+        self.assertEqual(item.image_variants['placeholder'], 'LKTI:j,YfQ,Y|co1fQo1fQfQfQfQ')
+
+    def test_serialized_variant_urls(self):
+        item = self.upload()
+        variants = self.owner.get(f'/api/items/{item.pk}/').json()['image_variants']
+        self.assertEqual(variants['thumb'], 'http://testserver/media/' + item.image_variants['thumb'])
+        self.assertEqual(variants['placeholder'], item.image_variants['placeholder'])
+        Item.objects.filter(pk=item.pk).update(status='REJECTED')
+        variants = self.owner.get(f'/api/items/{item.pk}/').json()['image_variants']
+        self.assertIn('signature=', variants['medium'])
+        self.assertEqual(self.client.get(variants['medium']).status_code, 200)
+
+    @override_settings(IMAGE_PIPELINE_EXECUTOR='process')
+    def test_process_workers_read_the_stored_file(self):
+        submitted = []
+
+        class InlineExecutor:
+            def submit(self, function, *args):
+                submitted.append(args)
+                future = Future()
+                future.set_result(function(*args))
+                return future
+
+        with mock.patch.object(images, '_get_executor', InlineExecutor):
+            item = self.upload()
+        self.assertEqual(submitted, [(images.item_image_storage.path(item.image.name),)])
+        self.assertEqual(set(item.image_variants), {'thumb', 'medium', 'placeholder'})
+
+
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(MEDIA_ROOT=root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.owner = APIClient()
+        self.owner.force_authenticate(self.alice)
+
+    def png(self, color):
+        from PIL import Image
+        data = io.BytesIO()
+        Image.new('RGB', (8, 8), color).save(data, 'PNG')
+        return SimpleUploadedFile('photo.png', data.getvalue(), content_type='image/png')
+
+    def upload(self, name, color):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.owner.post('/api/items/', {
+                'name': name, 'category': 'Tools', 'description': 'Cordless', 'ownership_type': 'SHARE',
+                'image': self.png(color),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Item.objects.get(pk=response.json()['id'])
+
+    def stored(self, name):
+        return os.path.exists(storage.item_image_storage.path(name))
+
+    def refs(self):
+        return dict(MediaBlob.objects.values_list('name', 'ref_count'))
+
+    def age(self, name):
+        old = time.time() - storage.REUSE_GRACE - 1
+        os.utime(storage.item_image_storage.path(name), (old, old))
+
+    def test_identical_uploads_share_one_file(self):
+        drill = self.upload('Drill', 'red')
+        saw = self.upload('Saw', 'red')
+        self.assertEqual(drill.image.name, saw.image.name)
+        self.assertRegex(drill.image.name, r'^item_images/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(self.refs(), {drill.image.name: 2})
+        directory = os.path.dirname(storage.item_image_storage.path(drill.image.name))
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+    def test_replacing_and_deleting_release_references(self):
+        drill = self.upload('Drill', 'red')
+        saw = self.upload('Saw', 'red')
+        red = drill.image.name
+        self.age(red)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.owner.patch(f'/api/items/{drill.pk}/', {'image': self.png('blue')}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        blue = Item.objects.get(pk=drill.pk).image.name
+        self.assertEqual(self.refs(), {red: 1, blue: 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            saw.delete()
+        self.assertEqual(self.refs(), {blue: 1})
+        self.assertFalse(self.stored(red))
+        self.assertTrue(self.stored(blue))
+
+    def test_upload_racing_the_last_release_keeps_the_file(self):
+        saw = self.upload('Saw', 'red')
+        red = saw.image.name
+        self.age(red)
+        with self.captureOnCommitCallbacks() as callbacks:
+            saw.delete()
+        # The same bytes are uploaded again before the deletion runs
+        self.assertEqual(storage.item_image_storage.save('item_images/photo.png', self.png('red')), red)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(self.stored(red))
+        drill = self.upload('Drill', 'red')
+        self.assertEqual(self.refs(), {drill.image.name: 1})
+        self.assertEqual(storage.sweep_unreferenced(), 0)
+        self.assertTrue(self.stored(red))
+
+    def test_sweep_deletes_files_left_unreferenced(self):
+        saw = self.upload('Saw', 'red')
+        red = saw.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            saw.delete()
+        # Uploaded moments ago, so the deletion held back
+        self.assertTrue(self.stored(red))
+        self.age(red)
+        stdout = io.StringIO()
+        call_command('sweep_media', stdout=stdout)
+        self.assertIn('Deleted 1 unreferenced files', stdout.getvalue())
+        self.assertEqual((self.stored(red), self.refs()), (False, {}))
+
+    @override_settings(MAX_UPLOAD_SIZE=1024)
+    def test_oversized_upload(self):
+        response = self.owner.post('/api/items/', {
+            'name': 'Drill', 'category': 'Tools', 'description': 'Cordless', 'ownership_type': 'SHARE',
+            'image': SimpleUploadedFile('photo.png', os.urandom(4096), content_type='image/png'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Item.objects.exists())
+
+
+class OverdueSweepTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.item = Item.objects.create(
+            owner=self.alice, name='Drill', category='Tools', description='Cordless',
+            ownership_type='SHARE', status='RESERVED',
+        )
+        today = timezone.localdate()
+        self.late = BorrowRequest.objects.create(
+            item=self.item, borrower=self.bob, status='APPROVED', start_date=today - timezone.timedelta(days=5),
+            end_date=today - timezone.timedelta(days=2), due_date=reservations.due_at(today - timezone.timedelta(days=2)),
+        )
+        self.current = BorrowRequest.objects.create(
+            item=self.item, borrower=self.bob, status='APPROVED', start_date=today,
+            end_date=today + timezone.timedelta(days=2), due_date=reservations.due_at(today + timezone.timedelta(days=2)),
+        )
+
+    def test_marks_late_loans_and_reminds_borrowers(self):
+        self.assertEqual(overdue.sweep(), 1)
+        self.late.refresh_from_db()
+        self.current.refresh_from_db()
+        self.assertEqual((self.late.status, self.current.status), ('OVERDUE', 'APPROVED'))
+        [reminder] = Message.objects.all()
+        self.assertEqual((reminder.sender, reminder.recipient, reminder.item), (self.alice, self.bob, self.item))
+        self.assertEqual(reminder.subject, 'Overdue: Drill')
+        conversation = Conversation.objects.get()
+        unread = conversation.unread_a if conversation.user_a_id == self.bob.pk else conversation.unread_b
+        self.assertEqual((conversation.last_message_id, unread), (reminder.pk, 1))
+
+    def test_rerun_is_a_no_op(self):
+        overdue.sweep()
+        self.assertEqual(overdue.sweep(), 0)
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(BorrowRequest.objects.filter(status='OVERDUE').count(), 1)
+
+    def test_batches(self):
+        today = timezone.localdate()
+        for days in range(3, 6):
+            BorrowRequest.objects.create(
+                item=self.item, borrower=self.alice, status='APPROVED', start_date=today - timezone.timedelta(days=days + 1),
+                end_date=today - timezone.timedelta(days=days), due_date=reservations.due_at(today - timezone.timedelta(days=days)),
+            )
+        self.assertEqual(overdue.sweep(batch_size=2), 4)
+        self.assertEqual(Message.objects.count(), 4)
+
+    def test_command_reports_batches(self):
+        BorrowRequest.objects.filter(pk=self.current.pk).update(due_date=self.late.due_date)
+        stdout = io.StringIO()
+        call_command('sweep_overdue', batch_size=1, verbosity=2, stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual([line.split(' in ')[0] for line in lines[:2]], ['  batch: 1 loans marked overdue'] * 2)
+        self.assertTrue(lines[2].startswith('2 loans marked overdue'))
+        stdout = io.StringIO()
+        call_command('sweep_overdue', stdout=stdout)
+        self.assertNotIn('batch:', stdout.getvalue())
+
+    def test_overdue_loan_blocks_later_dates(self):
+        overdue.sweep()
+        later = timezone.localdate() + timezone.timedelta(days=30)
+        self.assertEqual(list(reservations.conflicts(self.item.pk, later, later)), [self.late])
+
+
+class ReservationTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.item = Item.objects.create(
+            owner=self.alice, name='Drill', category='Tools', description='Cordless',
+            ownership_type='SHARE', status='APPROVED',
+        )
+        self.owner = APIClient()
+        self.owner.force_authenticate(self.alice)
+
+    def book(self, start, end):
+        borrow_request = BorrowRequest.objects.create(item=self.item, borrower=self.bob, start_date=start, end_date=end)
+        response = self.owner.post(f'/api/borrow-requests/{borrow_request.pk}/approve/')
+        self.assertEqual(response.status_code, 200)
+        self.item.refresh_from_db()
+
+    def test_future_booking_reserves_when_it_starts(self):
+        start = timezone.localdate() + timezone.timedelta(days=3)
+        self.book(start, start + timezone.timedelta(days=2))
+        self.assertEqual(self.item.status, 'APPROVED')
+        self.assertEqual(reservations.reserve_started(), 0)
+        self.assertEqual(reservations.reserve_started(today=start), 1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, 'RESERVED')
+        self.assertEqual(reservations.reserve_started(today=start), 0)
+        counts = dict(ItemFacetCount.objects.filter(category='Tools').values_list('status', 'count'))
+        self.assertEqual((counts.get('APPROVED', 0), counts.get('RESERVED')), (0, 1))
+
+    def test_reserved_item_keeps_its_calendar(self):
+        today = timezone.localdate()
+        self.book(today, today + timezone.timedelta(days=1))
+        self.assertEqual(self.item.status, 'RESERVED')
+        response = self.client.get(f'/api/items/{self.item.pk}/availability/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['booked'], [{'start': today.isoformat(), 'end': (today + timezone.timedelta(days=1)).isoformat()}])
+        Item.objects.filter(pk=self.item.pk).update(status='REJECTED')
+        self.assertEqual(self.client.get(f'/api/items/{self.item.pk}/availability/').status_code, 404)
+
+    def test_return_keeps_the_item_for_a_started_booking(self):
+        carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        today = timezone.localdate()
+        late = BorrowRequest.objects.create(
+            item=self.item, borrower=self.bob, status='OVERDUE', start_date=today - timezone.timedelta(days=3),
+            end_date=today - timezone.timedelta(days=1), due_date=reservations.due_at(today - timezone.timedelta(days=1)),
+        )
+        current = BorrowRequest.objects.create(
+            item=self.item, borrower=carol, status='APPROVED', start_date=today,
+            end_date=today + timezone.timedelta(days=2), due_date=reservations.due_at(today + timezone.timedelta(days=2)),
+        )
+        Item.objects.filter(pk=self.item.pk).update(status='RESERVED')
+        for borrower, borrow_request, item_status in ((self.bob, late, 'RESERVED'), (carol, current, 'RETURNED')):
+            api = APIClient()
+            api.force_authenticate(borrower)
+            response = api.post(f'/api/borrow-requests/{borrow_request.pk}/return_item/')
+            self.assertEqual((response.status_code, response.json()['status']), (200, 'RETURNED'))
+            self.item.refresh_from_db()
+            self.assertEqual(self.item.status, item_status)
+
+    def test_future_booking_cannot_be_returned(self):
+        start = timezone.localdate() + timezone.timedelta(days=3)
+        self.book(start, start + timezone.timedelta(days=1))
+        borrower = APIClient()
+        borrower.force_authenticate(self.bob)
+        booking = BorrowRequest.objects.get()
+        response = borrower.post(f'/api/borrow-requests/{booking.pk}/return_item/')
+        self.assertEqual(response.status_code, 400)
+        booking.refresh_from_db()
+        self.item.refresh_from_db()
+        self.assertEqual((booking.status, self.item.status), ('APPROVED', 'APPROVED'))
+
+
+class ConversationTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.item = Item.objects.create(
+            owner=self.alice, name='Drill', category='Tools', description='Cordless',
+            ownership_type='SHARE', status='APPROVED',
+        )
+        counters.reconcile(self.alice.pk)
+        counters.reconcile(self.bob.pk)
+
+    def send(self, sender, recipient, body, item=None):
+        return Message.objects.create(sender=sender, recipient=recipient, item=item, subject='Re: Drill', body=body)
+
+    def unread(self, conversation, user):
+        conversation.refresh_from_db()
+        return conversation.unread_a if conversation.user_a_id == user.pk else conversation.unread_b
+
+    def badge(self, user):
+        return UserCounter.objects.get(user=user).unread_messages
+
+    def test_threads_per_participants_and_item(self):
+        first = self.send(self.bob, self.alice, 'Is it free?', self.item)
+        reply = self.send(self.alice, self.bob, 'Yes', self.item)
+        other = self.send(self.bob, self.alice, 'Unrelated')
+        self.assertEqual(first.conversation_id, reply.conversation_id)
+        self.assertNotEqual(first.conversation_id, other.conversation_id)
+        conversation = Conversation.objects.get(pk=first.conversation_id)
+        self.assertEqual(
+            (conversation.last_message_id, conversation.last_sender_id, conversation.last_message_preview),
+            (reply.pk, self.alice.pk, 'Yes'),
+        )
+        self.assertEqual((self.unread(conversation, self.alice), self.unread(conversation, self.bob)), (1, 1))
+
+    def test_racing_first_messages_share_one_thread(self):
+        for item in (None, self.item):
+            first = self.send(self.bob, self.alice, 'Hello', item)
+            # The other sender's lookup ran before this thread existed
+            real, stale = conversations._existing, [{}]
+            with mock.patch.object(conversations, '_existing', side_effect=lambda keys: stale.pop() if stale else real(keys)):
+                second = self.send(self.alice, self.bob, 'Hi', item)
+            self.assertEqual(second.conversation_id, first.conversation_id)
+        self.assertEqual(Conversation.objects.count(), 2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Conversation.objects.create(
+                user_a=self.alice, user_b=self.bob, thread_key=conversations.stored_key((self.alice.pk, self.bob.pk, None)),
+            )
+
+    def test_unread_counts_follow_send_read_and_delete(self):
+        first = self.send(self.bob, self.alice, 'One', self.item)
+        self.send(self.bob, self.alice, 'Two', self.item)
+        third = self.send(self.bob, self.alice, 'Three', self.item)
+        conversation = first.conversation
+        self.assertEqual((self.unread(conversation, self.alice), self.badge(self.alice)), (3, 3))
+
+        first.is_read = True
+        first.save()
+        self.assertEqual((self.unread(conversation, self.alice), self.badge(self.alice)), (2, 2))
+        third.delete()
+        self.assertEqual((self.unread(conversation, self.alice), self.badge(self.alice)), (1, 1))
+
+        self.assertEqual(conversations.mark_read(conversation, self.alice), 1)
+        self.assertEqual((self.unread(conversation, self.alice), self.badge(self.alice)), (0, 0))
+        self.assertEqual(self.badge(self.alice), counters.counted(self.alice.pk)[counters.UNREAD_MESSAGES])
+
+    def test_mark_read_keeps_messages_that_arrive_meanwhile(self):
+        conversation = self.send(self.bob, self.alice, 'One', self.item).conversation
+        update = QuerySet.update
+
+        def update_then_receive(queryset, **kwargs):
+            changed = update(queryset, **kwargs)
+            if queryset.model is Message and kwargs == {'is_read': True}:
+                self.send(self.bob, self.alice, 'Two', self.item)
+            return changed
+
+        with mock.patch.object(QuerySet, 'update', update_then_receive):
+            self.assertEqual(conversations.mark_read(conversation, self.alice), 1)
+        self.assertEqual((self.unread(conversation, self.alice), self.badge(self.alice)), (1, 1))
+
+    def test_deleting_the_last_message(self):
+        first = self.send(self.bob, self.alice, 'One', self.item)
+        second = self.send(self.alice, self.bob, 'Two', self.item)
+        second.delete()
+        conversation = Conversation.objects.get(pk=first.conversation_id)
+        self.assertEqual((conversation.last_message_id, conversation.last_message_preview), (first.pk, 'One'))
+        first.delete()
+        self.assertFalse(Conversation.objects.exists())
+
+    def test_backfill_matches_maintained_threads(self):
+        for body in ('One', 'Two'):
+            self.send(self.bob, self.alice, body, self.item)
+        self.send(self.alice, self.bob, 'Three', self.item).delete()
+        self.send(self.alice, self.bob, 'Other thread')
+        # A set-based read, with the counter moved by hand as conversations.mark_read does
+        Message.objects.filter(body='Two').update(is_read=True)
+        field = 'unread_a' if Conversation.objects.get(item=self.item).user_a_id == self.alice.pk else 'unread_b'
+        Conversation.objects.filter(item=self.item).update(**{field: F(field) - 1})
+        columns = ('user_a', 'user_b', 'item', 'last_message', 'last_message_preview', 'last_sender', 'last_message_at', 'unread_a', 'unread_b')
+        maintained = sorted(Conversation.objects.values_list(*columns), key=str)
+
+        # The state the 0017 migration starts from
+        Message.objects.update(conversation=None)
+        Conversation.objects.all().delete()
+        self.assertEqual(conversations.backfill(Conversation, Message), 2)
+        self.assertEqual(sorted(Conversation.objects.values_list(*columns), key=str), maintained)
+        self.assertFalse(Message.objects.filter(conversation__isnull=True).exists())
+
+
+@override_settings(SIMILAR_ITEMS_EXECUTOR='sync')
+class SimilarityTests(TestCase):
+
+    def setUp(self):
+        similarity._index = None
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        for name, category, description in [
+            ('Cordless drill', 'Tools', 'Drill with two batteries'),
+            ('Hammer drill', 'Tools', 'Corded drill for masonry'),
+            ('Camping tent', 'Outdoors', 'Tent for four people'),
+            ('Sleeping bag', 'Outdoors', 'Warm bag for camping'),
+        ]:
+            self.add(name, category, description)
+
+    def add(self, name, category, description, status='APPROVED'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Item.objects.create(
+                owner=self.alice, name=name, category=category, description=description,
+                ownership_type='SHARE', status=status,
+            )
+
+    def neighbours(self, item):
+        return list(SimilarItem.objects.filter(item=item).order_by('rank').values_list('similar_id', flat=True))
+
+    def test_index_scores_match_full_vectorization(self):
+        ids, rows = similarity.corpus()
+        matrix = similarity.vectorize(rows)
+        index = similarity.CatalogIndex(rows)
+        for row in range(len(ids)):
+            expected = (matrix @ matrix[row].T).toarray().ravel()
+            self.assertTrue(np.allclose(index.scores(row), expected, atol=1e-5))
+
+    def test_add_item_vectorizes_only_the_new_item(self):
+        drill = Item.objects.get(name='Cordless drill')
+        similarity.catalog_index()
+        with mock.patch.object(similarity, 'term_counts', wraps=similarity.term_counts) as counted:
+            new = self.add('Drill bits', 'Tools', 'Bits for any drill')
+        self.assertEqual(counted.call_count, 1)
+        drills = set(Item.objects.filter(name__endswith='drill').values_list('id', flat=True))
+        self.assertEqual(set(self.neighbours(new)[:2]), drills)
+        self.assertIn(new.pk, self.neighbours(drill))
+        self.assertNotIn(Item.objects.get(name='Camping tent').pk, self.neighbours(new))
+
+    def test_hidden_items_leave_results(self):
+        drill = Item.objects.get(name='Cordless drill')
+        hammer = Item.objects.get(name='Hammer drill')
+        similarity.catalog_index()
+        Item.objects.filter(pk=hammer.pk).update(status='REJECTED')
+        new = self.add('Drill bits', 'Tools', 'Bits for any drill')
+        self.assertEqual(self.neighbours(new), [drill.pk])
+
+    def test_similar_endpoint_404s_for_unknown_and_hidden_items(self):
+        drill = Item.objects.get(name='Cordless drill')
+        response = self.client.get(f'/api/items/{drill.pk}/similar/')
+        self.assertEqual([row['name'] for row in response.json()], ['Hammer drill'])
+        self.assertEqual(self.client.get('/api/items/999/similar/').status_code, 404)
+        pending = self.add('Impact drill', 'Tools', 'Drill', status='PENDING_VERIFICATION')
+        self.assertEqual(self.client.get(f'/api/items/{pending.pk}/similar/').status_code, 404)
+
+
+@override_settings(SIMILAR_ITEMS_EXECUTOR='thread')
+class SimilarityThreadTests(TransactionTestCase):
+    """The default executor: add_item runs on a worker thread after the approval commits"""
+
+    def test_approval_updates_lists_in_the_background(self):
+        similarity._index = None
+        alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        drill = Item.objects.create(
+            owner=alice, name='Cordless drill', category='Tools', description='Drill', ownership_type='SHARE', status='APPROVED',
+        )
+        similarity.shutdown()
+        bits = Item.objects.create(
+            owner=alice, name='Drill bits', category='Tools', description='Bits for any drill', ownership_type='SHARE',
+        )
+        bits.status = 'APPROVED'
+        threads = []
+
+        def add_item(item_id):
+            threads.append(threading.current_thread().name)
+            return add(item_id)
+
+        add = similarity.add_item
+        with mock.patch.object(similarity, 'add_item', add_item):
+            bits.save()
+            similarity.shutdown()
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('similar-items'))
+        self.assertEqual(list(SimilarItem.objects.filter(item=bits).values_list('similar_id', flat=True)), [drill.pk])
+        self.assertEqual(list(SimilarItem.objects.filter(item=drill).values_list('similar_id', flat=True)), [bits.pk])
+
+
+class CounterTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        self.items = [
+            Item.objects.create(
+                owner=self.alice, name=f'Drill {i}', category='Tools', description='Cordless',
+                ownership_type='SHARE', status='APPROVED',
+            )
+            for i in range(2)
+        ]
+        self.api = APIClient()
+        self.api.force_authenticate(self.alice)
+        for user in (self.alice, self.bob, self.carol):
+            counters.reconcile(user.pk)
+
+    def assertCounts(self, user, unread, pending):
+        row = UserCounter.objects.get(user=user)
+        self.assertEqual((row.unread_messages, row.pending_requests), (unread, pending))
+        self.assertEqual(counters.counted(user.pk), {counters.UNREAD_MESSAGES: unread, counters.PENDING_REQUESTS: pending})
+
+    def request(self, borrower, item, days=(0, 2)):
+        today = timezone.localdate()
+        return BorrowRequest.objects.create(
+            item=item, borrower=borrower,
+            start_date=today + timezone.timedelta(days=days[0]), end_date=today + timezone.timedelta(days=days[1]),
+        )
+
+    def test_messages(self):
+        message = Message.objects.create(sender=self.bob, recipient=self.alice, subject='Hi', body='Free?')
+        self.assertCounts(self.alice, 1, 0)
+        self.assertCounts(self.bob, 0, 0)
+        message.is_read = True
+        message.save()
+        self.assertCounts(self.alice, 0, 0)
+        self.assertEqual(self.api.get('/api/counters/').json()['unread_messages'], 0)
+
+    def test_approve_denies_competing_requests(self):
+        first = self.request(self.bob, self.items[0])
+        self.request(self.carol, self.items[0], days=(1, 3))
+        self.request(self.carol, self.items[0], days=(5, 6))
+        self.assertCounts(self.alice, 0, 3)
+        self.assertEqual(self.api.post(f'/api/borrow-requests/{first.pk}/approve/').status_code, 200)
+        # The overlapping request was denied along with the approval; the later one is still pending
+        self.assertCounts(self.alice, 0, 1)
+
+    def test_batch_decide(self):
+        requests = [self.request(self.bob, self.items[0]), self.request(self.carol, self.items[0]), self.request(self.carol, self.items[1])]
+        response = self.api.post('/api/borrow-requests/decide/', {'decisions': [
+            {'id': requests[0].pk, 'decision': 'approve'}, {'id': requests[2].pk, 'decision': 'deny'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertCounts(self.alice, 0, 0)
+
+    def test_missing_and_drifted_rows_are_rebuilt(self):
+        self.request(self.bob, self.items[0])
+        UserCounter.objects.filter(user=self.alice).delete()
+        self.assertEqual(self.api.get('/api/counters/').json()['pending_requests'], 1)
+        # A decrement below zero means the row drifted: it is dropped and rebuilt on the next read
+        counters.add(counters.PENDING_REQUESTS, {self.alice.pk: -2})
+        self.assertFalse(UserCounter.objects.filter(user=self.alice).exists())
+        self.assertEqual(self.api.get('/api/counters/').json()['pending_requests'], 1)
+        self.assertCounts(self.alice, 0, 1)
+
+    def test_rebuilt_values_change_the_etag(self):
+        self.request(self.bob, self.items[0])
+        stale = self.api.get('/api/counters/')
+        UserCounter.objects.filter(user=self.alice).update(
+            pending_requests=5, reconciled_at=timezone.now() - timezone.timedelta(days=1),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.api.get('/api/counters/').json()['pending_requests'], 1)
+        self.assertEqual(self.api.get('/api/counters/', HTTP_IF_NONE_MATCH=stale['ETag']).status_code, 200)
+
+
+class NearbyTests(TestCase):
+    origin = (18.5204, 73.8567)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw', location='Pune')
+        self.nowhere = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        # Roughly 1, 5 and 30 km north of the origin
+        for name, km in (('Drill', 1), ('Tent', 5), ('Kayak', 30)):
+            self.add(name, self.alice, (self.origin[0] + km / geo.KM_PER_DEGREE, self.origin[1]))
+        self.add('Saw', self.alice, self.origin, status='PENDING_VERIFICATION')
+        self.add('Ladder', self.nowhere)
+
+    def add(self, name, owner, point=None, status='APPROVED'):
+        Item.objects.create(
+            owner=owner, name=name, category='Tools', description='Spare', ownership_type='SHARE', status=status,
+            **geo.coordinates_fields(point),
+        )
+
+    def nearby(self, query, client=None):
+        response = (client or self.client).get('/api/items/nearby/?' + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(row['name'], row['distance_km']) for row in response.json()['results']]
+
+    def test_radius_and_distance_order(self):
+        lat, lon = self.origin
+        rows = self.nearby(f'lat={lat}&lon={lon}&radius=10')
+        self.assertEqual([name for name, _ in rows], ['Drill', 'Tent'])
+        self.assertAlmostEqual(rows[0][1], 1, delta=0.05)
+        self.assertAlmostEqual(rows[1][1], 5, delta=0.05)
+        self.assertEqual([name for name, _ in self.nearby(f'lat={lat}&lon={lon}&radius=50')], ['Drill', 'Tent', 'Kayak'])
+        self.assertEqual(self.nearby(f'lat={lat}&lon={lon}&radius=0.5'), [])
+
+    def test_place_names_and_profile_location(self):
+        self.assertEqual([name for name, _ in self.nearby('near=Poona&radius=10')], ['Drill', 'Tent'])
+        api = APIClient()
+        api.force_authenticate(self.alice)
+        self.assertEqual([name for name, _ in self.nearby('radius=10', api)], ['Drill', 'Tent'])
+
+    def test_items_without_coordinates(self):
+        self.assertIsNone(Item.objects.get(name='Ladder').latitude)
+        # Not even a radius covering the whole range finds an item with no location
+        names = [name for name, _ in self.nearby('lat=18.5204&lon=73.8567&radius=500')]
+        self.assertNotIn('Ladder', names)
+        # and a user with no location has to say where they are
+        api = APIClient()
+        api.force_authenticate(self.nowhere)
+        self.assertEqual(api.get('/api/items/nearby/').status_code, 400)
+        self.assertEqual(self.client.get('/api/items/nearby/?near=Atlantis').status_code, 400)
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', role='STAFF')
+        today = timezone.localdate()
+        for number, (owner, borrower) in enumerate([
+            (cls.alice, cls.bob), (cls.bob, cls.alice), (cls.bob, cls.carol), (cls.carol, cls.bob), (cls.alice, cls.carol),
+        ]):
+            item = Item.objects.create(
+                owner=owner, name=f'Item, "{number}"', category='Tools', description='Spare', ownership_type='SHARE',
+            )
+            BorrowRequest.objects.create(
+                item=item, borrower=borrower, start_date=today, end_date=today + timezone.timedelta(days=number),
+            )
+            Message.objects.create(sender=borrower, recipient=owner, item=item, subject='Hi', body=f'About item {number}')
+
+    def get(self, user, url):
+        api = APIClient()
+        api.force_authenticate(user)
+        return api.get(url)
+
+    def body(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_chunks_walk_the_table_by_key(self):
+        with CaptureQueriesContext(connection) as captured:
+            sizes = [len(rows) for rows in export.chunks(Item, ('id', 'name'), chunk_size=2)]
+        self.assertEqual(sizes, [2, 2, 1])
+        # One short query per chunk plus the empty one that ends the walk, each after the last key seen
+        self.assertEqual(len(captured), 4)
+        key = f"{connection.ops.quote_name('things_item')}.{connection.ops.quote_name('id')} >"
+        self.assertTrue(all(key in query['sql'] for query in captured[1:]))
+
+    def test_csv(self):
+        response = self.get(self.staff, '/api/export/borrow-requests.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        header, *rows = list(csv.reader(io.StringIO(self.body(response))))
+        self.assertEqual(header, list(export.DATASETS['borrow-requests'][1]))
+        self.assertEqual(len(rows), 5)
+        first = dict(zip(header, rows[0]))
+        self.assertEqual((first['item__name'], first['start_date']), ('Item, "0"', timezone.localdate().isoformat()))
+
+    def test_ndjson(self):
+        response = self.get(self.staff, '/api/export/items.ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.body(response).splitlines()]
+        self.assertEqual([row['id'] for row in rows], sorted(Item.objects.values_list('id', flat=True)))
+        self.assertEqual(set(rows[0]), set(export.DATASETS['items'][1]))
+
+    def test_users_export_only_their_own_rows(self):
+        rows = [json.loads(line) for line in self.body(self.get(self.alice, '/api/export/borrow-requests.ndjson')).splitlines()]
+        self.assertEqual(
+            sorted(row['id'] for row in rows),
+            sorted(BorrowRequest.objects.filter(Q(borrower=self.alice) | Q(item__owner=self.alice)).values_list('id', flat=True)),
+        )
+        self.assertEqual(len(rows), 3)
+        header, *rows = list(csv.reader(io.StringIO(self.body(self.get(self.carol, '/api/export/messages.csv')))))
+        self.assertTrue(all(self.carol.pk in (int(row[2]), int(row[4])) for row in rows))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(self.get(self.alice, '/api/export/items.csv').status_code, 403)
+        self.assertEqual(self.get(self.alice, '/api/export/point-transactions.csv').status_code, 403)
+        self.assertEqual(len(self.body(self.get(self.staff, '/api/export/messages.ndjson')).splitlines()), 5)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'messages.ndjson')
+            call_command('export_data', 'messages', format='ndjson', user='bob', output=path, chunk_size=2, stderr=io.StringIO())
+            with open(path, encoding='utf-8') as handle:
+                rows = [json.loads(line) for line in handle]
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(all(self.bob.pk in (row['sender_id'], row['recipient_id']) for row in rows))
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'items', user='bob')
+
+
+class BulkCreateTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.owner = APIClient()
+        self.owner.force_authenticate(self.alice)
+
+    def rows(self, count, **extra):
+        return [
+            {'name': f'Book {i}', 'category': 'Books', 'description': 'Paperback', 'ownership_type': 'SHARE', **extra}
+            for i in range(count)
+        ]
+
+    def test_returns_saved_items(self):
+        response = self.owner.post('/api/items/bulk_create/', self.rows(3), format='json')
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual(
+            [(row['id'], row['name']) for row in results],
+            list(Item.objects.order_by('pk').values_list('pk', 'name')),
+        )
+
+    def test_reads_back_ids_the_backend_did_not_return(self):
+        Item.objects.create(
+            owner=self.alice, name='Book 1', category='Books', description='Hardback', ownership_type='SHARE',
+        )
+        with mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False,
+        ):
+            items = bulk.create_items(self.alice, self.rows(5), batch_size=2)
+        self.assertEqual(
+            [(item.pk, item.name) for item in items],
+            list(Item.objects.filter(description='Paperback').order_by('pk').values_list('pk', 'name')),
+        )
+
+    def test_too_many_items(self):
+        with mock.patch.object(bulk, 'MAX_REQUEST_ITEMS', 2):
+            response = self.owner.post('/api/items/bulk_create/', self.rows(3), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Item.objects.exists())
+
+    def test_status_and_image_are_ignored(self):
+        response = self.owner.post('/api/items/bulk_create/', self.rows(2, status='APPROVED'), format='json')
+        self.assertEqual(response.status_code, 201)
+        bulk.create_items(self.alice, self.rows(1, image='item_images/elsewhere.jpg'))
+        self.assertEqual(
+            set(Item.objects.values_list('status', 'image')), {('PENDING_VERIFICATION', '')},
+        )
+
+    def test_import_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'items.ndjson')
+            with open(path, 'w', encoding='utf-8') as handle:
+                for row in self.rows(3):
+                    handle.write(json.dumps(row) + '\n')
+                handle.write('{"name": \n')
+                handle.write(json.dumps({'name': 'No category'}) + '\n')
+            stdout, stderr = io.StringIO(), io.StringIO()
+            call_command('import_items', path, owner='alice', batch_size=2, stdout=stdout, stderr=stderr)
+        self.assertEqual(sorted(Item.objects.values_list('name', flat=True)), ['Book 0', 'Book 1', 'Book 2'])
+        self.assertEqual([line.split(':')[0] for line in stderr.getvalue().splitlines()], ['line 4', 'line 5'])
+        self.assertIn('5 rows read, 3 imported, 2 failed', stdout.getvalue())
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        if not search.fts_enabled():
+            self.skipTest('No full-text index on this database')
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.in_description = self.add('Toolbox', 'Storage', 'Steel box, fits a hammer and screwdrivers')
+        self.in_name = self.add('Claw hammer', 'Tools', 'Forged steel head')
+        self.in_category = self.add('Mallet', 'Hammers', 'Rubber head')
+        self.add('Camping tent', 'Outdoors', 'Sleeps four')
+
+    def add(self, name, category, description):
+        return Item.objects.create(
+            owner=self.alice, name=name, category=category, description=description,
+            ownership_type='SHARE', status='APPROVED',
+        )
+
+    def search(self, query):
+        return [row['id'] for row in self.client.get('/api/items/search/', {'q': query}).json()['results']]
+
+    def test_results_are_ranked(self):
+        self.assertEqual(self.search('hammer'), [self.in_name.pk, self.in_category.pk, self.in_description.pk])
+        self.assertEqual(self.search('ham'), self.search('hammer'))
+        self.assertEqual(self.search('"hammer" OR tent'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.in_name.name = 'Sledge'
+        self.in_name.save()
+        self.assertNotIn(self.in_name.pk, self.search('claw'))
+        self.assertIn(self.in_name.pk, self.search('sledge'))
+        # Status-only saves skip reindexing but must leave the entry in place
+        self.in_name.status = 'RESERVED'
+        self.in_name.save(update_fields=['status'])
+        self.in_name.status = 'APPROVED'
+        self.in_name.save(update_fields=['status'])
+        self.assertIn(self.in_name.pk, self.search('sledge'))
+        self.in_category.delete()
+        self.assertEqual(self.search('mallet'), [])
+        self.assertEqual(self.search('hammer'), [self.in_description.pk])
+
+
+class FacetCountTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.owner = APIClient()
+        self.owner.force_authenticate(self.alice)
+        self.drill = self.add('Drill', 'Tools', 'APPROVED')
+        self.tent = self.add('Tent', 'Outdoors', 'APPROVED')
+        self.add('Saw', 'Tools', 'PENDING_VERIFICATION')
+
+    def add(self, name, category, status):
+        return Item.objects.create(
+            owner=self.alice, name=name, category=category, description='', ownership_type='SHARE', status=status,
+        )
+
+    def assertCellsMatchItems(self):
+        cells = {
+            (row['category'], row['ownership_type'], row['status']): row['count']
+            for row in ItemFacetCount.objects.filter(count__gt=0).values()
+        }
+        counted = {
+            (row['category'], row['ownership_type'], row['status']): row['total']
+            for row in Item.objects.values('category', 'ownership_type', 'status').annotate(total=Count('id')).order_by()
+        }
+        self.assertEqual(cells, counted)
+        self.assertFalse(ItemFacetCount.objects.filter(count__lt=0).exists())
+
+    def test_save_status_change_and_delete(self):
+        self.drill.category = 'Power tools'
+        self.drill.save()
+        self.assertCellsMatchItems()
+        self.tent.status = 'REJECTED'
+        self.tent.save(update_fields=['status'])
+        self.assertCellsMatchItems()
+        # A partially loaded item still moves out of the right cell
+        deferred = Item.objects.only('id', 'status').get(pk=self.drill.pk)
+        deferred.status = 'RESERVED'
+        deferred.save(update_fields=['status'])
+        self.assertCellsMatchItems()
+        self.tent.delete()
+        self.assertCellsMatchItems()
+        self.assertEqual(self.client.get('/api/items/facets/').json()['category'], {})
+
+    def test_bulk_create(self):
+        response = self.owner.post('/api/items/bulk_create/', [
+            {'name': f'Item {i}', 'category': 'Books', 'description': 'Paperback', 'ownership_type': 'SHARE'} for i in range(3)
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertCellsMatchItems()
+
+    def test_set_based_reservations(self):
+        today = timezone.localdate()
+        now = BorrowRequest.objects.create(item=self.drill, borrower=self.bob, start_date=today, end_date=today)
+        later = BorrowRequest.objects.create(
+            item=self.tent, borrower=self.bob, start_date=today + timezone.timedelta(days=2), end_date=today + timezone.timedelta(days=3),
+        )
+        decisions.decide(self.alice, [(now.pk, decisions.APPROVE), (later.pk, decisions.APPROVE)])
+        self.assertEqual(Item.objects.get(pk=self.drill.pk).status, 'RESERVED')
+        self.assertCellsMatchItems()
+        reservations.reserve_started(today + timezone.timedelta(days=2))
+        self.assertEqual(Item.objects.get(pk=self.tent.pk).status, 'RESERVED')
+        self.assertCellsMatchItems()
+        self.assertEqual(self.client.get('/api/items/facets/').json()['total'], 0)
+
+
+class BorrowTransitionTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        self.item = Item.objects.create(
+            owner=self.alice, name='Drill', category='Tools', description='Cordless',
+            ownership_type='SHARE', status='APPROVED',
+        )
+        self.owner = APIClient()
+        self.owner.force_authenticate(self.alice)
+
+    def request(self, borrower, first_day, last_day):
+        today = timezone.localdate()
+        return BorrowRequest.objects.create(
+            item=self.item, borrower=borrower,
+            start_date=today + timezone.timedelta(days=first_day), end_date=today + timezone.timedelta(days=last_day),
+        )
+
+    def approve(self, borrow_request):
+        return self.owner.post(f'/api/borrow-requests/{borrow_request.pk}/approve/')
+
+    def statuses(self, *requests):
+        return [BorrowRequest.objects.get(pk=borrow_request.pk).status for borrow_request in requests]
+
+    def test_double_approve(self):
+        borrow_request = self.request(self.bob, 0, 2)
+        self.assertEqual(self.approve(borrow_request).status_code, 200)
+        response = self.approve(borrow_request)
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Request already processed'}))
+        self.assertEqual(self.statuses(borrow_request), ['APPROVED'])
+
+    def test_competing_requests_are_denied(self):
+        winner = self.request(self.bob, 0, 3)
+        overlapping = self.request(self.carol, 2, 5)
+        later = self.request(self.carol, 4, 6)
+        self.assertEqual(self.approve(winner).status_code, 200)
+        self.assertEqual(self.statuses(winner, overlapping, later), ['APPROVED', 'DENIED', 'PENDING'])
+        self.assertEqual(self.approve(overlapping).status_code, 400)
+        self.assertEqual(self.approve(later).status_code, 200)
+
+    def test_booked_dates_conflict(self):
+        booked = self.request(self.bob, 0, 3)
+        self.approve(booked)
+        # Created directly: the create endpoint would already refuse these dates
+        clash = self.request(self.carol, 3, 4)
+        self.assertEqual(self.approve(clash).status_code, 409)
+        self.assertEqual(self.statuses(clash), ['PENDING'])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentApprovalTests(TransactionTestCase):
+    """Two owners' tabs approving overlapping requests at once: the row locks let exactly one win"""
+
+    def test_overlapping_approvals(self):
+        alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        item = Item.objects.create(
+            owner=alice, name='Drill', category='Tools', description='Cordless', ownership_type='SHARE', status='APPROVED',
+        )
+        today = timezone.localdate()
+        requests = [
+            BorrowRequest.objects.create(
+                item=item, borrower=User.objects.create_user(name, f'{name}@example.com', 'pw'),
+                start_date=today, end_date=today + timezone.timedelta(days=2),
+            )
+            for name in ('bob', 'carol')
+        ]
+        barrier = threading.Barrier(len(requests))
+        codes = []
+
+        def approve(borrow_request):
+            client = APIClient()
+            client.force_authenticate(alice)
+            try:
+                barrier.wait()
+                codes.append(client.post(f'/api/borrow-requests/{borrow_request.pk}/approve/').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=approve, args=(borrow_request,)) for borrow_request in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(codes), [200, 400])
+        self.assertEqual(
+            sorted(BorrowRequest.objects.values_list('status', flat=True)), ['APPROVED', 'DENIED'],
+        )
+
+
+class DecisionTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        self.drill, self.tent = (
+            Item.objects.create(
+                owner=self.alice, name=name, category='Tools', description='Sturdy', ownership_type='SHARE', status='APPROVED',
+            )
+            for name in ('Drill', 'Tent')
+        )
+
+    def request(self, borrower, item, first_day, last_day, status='PENDING'):
+        today = timezone.localdate()
+        return BorrowRequest.objects.create(
+            item=item, borrower=borrower, status=status,
+            start_date=today + timezone.timedelta(days=first_day), end_date=today + timezone.timedelta(days=last_day),
+        )
+
+    def statuses(self, *requests):
+        return [BorrowRequest.objects.get(pk=borrow_request.pk).status for borrow_request in requests]
+
+    def test_mixed_batch(self):
+        lent = self.request(self.bob, self.drill, 0, 1)
+        refused = self.request(self.carol, self.tent, 0, 1)
+        later = self.request(self.carol, self.drill, 4, 5)
+        outcomes = decisions.decide(self.alice, [(lent.pk, decisions.APPROVE), (refused.pk, decisions.DENY)])
+        self.assertEqual(outcomes, [{'id': lent.pk, 'status': 'APPROVED'}, {'id': refused.pk, 'status': 'DENIED'}])
+        self.assertEqual(self.statuses(lent, refused, later), ['APPROVED', 'DENIED', 'PENDING'])
+        self.assertIsNotNone(BorrowRequest.objects.get(pk=lent.pk).due_date)
+        self.assertEqual(
+            dict(Item.objects.values_list('name', 'status')), {'Drill': 'RESERVED', 'Tent': 'APPROVED'},
+        )
+
+    def test_overlapping_approvals(self):
+        first = self.request(self.bob, self.drill, 0, 3)
+        overlapping = self.request(self.carol, self.drill, 2, 4)
+        separate = self.request(self.carol, self.drill, 4, 6)
+        outcomes = decisions.decide(self.alice, [
+            (first.pk, decisions.APPROVE), (overlapping.pk, decisions.APPROVE), (separate.pk, decisions.APPROVE),
+        ])
+        # The first approval already denied the overlapping request, as the single actions would
+        self.assertEqual(outcomes, [
+            {'id': first.pk, 'status': 'APPROVED'},
+            {'id': overlapping.pk, 'error': decisions.ALREADY_PROCESSED},
+            {'id': separate.pk, 'status': 'APPROVED'},
+        ])
+        self.assertEqual(self.statuses(first, overlapping, separate), ['APPROVED', 'DENIED', 'APPROVED'])
+
+    def test_booked_and_repeated_entries(self):
+        self.request(self.bob, self.drill, 0, 2, status='APPROVED')
+        clash = self.request(self.carol, self.drill, 2, 3)
+        repeated = self.request(self.carol, self.tent, 0, 1)
+        outcomes = decisions.decide(self.alice, [
+            (clash.pk, decisions.APPROVE), (repeated.pk, decisions.DENY), (repeated.pk, decisions.APPROVE),
+        ])
+        self.assertEqual(outcomes, [
+            {'id': clash.pk, 'error': decisions.BOOKED},
+            {'id': repeated.pk, 'status': 'DENIED'},
+            {'id': repeated.pk, 'error': decisions.ALREADY_PROCESSED},
+        ])
+        self.assertEqual(self.statuses(clash, repeated), ['PENDING', 'DENIED'])
+
+    def test_non_owner_and_unknown_ids(self):
+        own = self.request(self.bob, self.drill, 0, 1)
+        other = self.request(self.carol, self.tent, 0, 1)
+        missing = BorrowRequest.objects.order_by('-pk').values_list('pk', flat=True).first() + 1
+        outcomes = decisions.decide(self.bob, [
+            (own.pk, decisions.APPROVE), (other.pk, decisions.DENY), (missing, decisions.APPROVE),
+        ])
+        # The borrower learns they can't decide their own request; nobody learns about anyone else's
+        self.assertEqual(outcomes, [
+            {'id': own.pk, 'error': decisions.NOT_OWNER.format('approve')},
+            {'id': other.pk, 'error': decisions.NOT_FOUND},
+            {'id': missing, 'error': decisions.NOT_FOUND},
+        ])
+        self.assertEqual(self.statuses(own, other), ['PENDING', 'PENDING'])
+
+    def test_staff_decide_any_request(self):
+        staff = User.objects.create_user('staff', 'staff@example.com', 'pw', role='STAFF')
+        borrow_request = self.request(self.bob, self.drill, 0, 1)
+        api = APIClient()
+        api.force_authenticate(staff)
+        response = api.post('/api/borrow-requests/decide/', {'decisions': [
+            {'id': borrow_request.pk, 'decision': 'deny'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.statuses(borrow_request), ['DENIED'])
+
+
+class RecordingBackend:
+    """Realtime backend stand-in that keeps what would have been pushed"""
+    events = []
+
+    def __init__(self, deliver):
+        pass
+
+    def publish(self, user_ids, event):
+        self.events.append((user_ids, event))
+
+
+@override_settings(REALTIME_BACKEND='things.tests.RecordingBackend')
+class RealtimeTests(TestCase):
+
+    def setUp(self):
+        RecordingBackend.events = []
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.item = Item.objects.create(
+            owner=self.alice, name='Drill', category='Tools', description='Cordless',
+            ownership_type='SHARE', status='PENDING_VERIFICATION',
+        )
+
+    def test_events_are_sent_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Message.objects.create(sender=self.bob, recipient=self.alice, subject='Hi', body='Is it free?')
+        self.assertEqual(RecordingBackend.events, [])
+        for callback in callbacks:
+            callback()
+        [(user_ids, event)] = RecordingBackend.events
+        self.assertEqual(user_ids, sorted([self.alice.pk, self.bob.pk]))
+        self.assertEqual((event['type'], event['preview']), ('message', 'Is it free?'))
+
+    def test_status_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.status = 'APPROVED'
+            self.item.save()
+            borrow_request = BorrowRequest.objects.create(item=self.item, borrower=self.bob)
+            borrow_request.status = 'DENIED'
+            borrow_request.save(update_fields=['status'])
+        self.assertEqual(
+            [(event['type'], event['status']) for _, event in RecordingBackend.events],
+            [('item', 'APPROVED'), ('borrow_request', 'PENDING'), ('borrow_request', 'DENIED')],
+        )
+        self.assertEqual(RecordingBackend.events[-1][0], sorted([self.alice.pk, self.bob.pk]))
+
+    def test_batch_decisions(self):
+        self.item.status = 'APPROVED'
+        self.item.save()
+        today = timezone.localdate()
+        approved = BorrowRequest.objects.create(item=self.item, borrower=self.bob, start_date=today, end_date=today)
+        competing = BorrowRequest.objects.create(item=self.item, borrower=self.bob, start_date=today, end_date=today)
+        RecordingBackend.events = []
+        with self.captureOnCommitCallbacks(execute=True):
+            decisions.decide(self.alice, [(approved.pk, decisions.APPROVE)])
+        self.assertEqual(
+            sorted((event['type'], event['id'], event['status']) for _, event in RecordingBackend.events),
+            [('borrow_request', approved.pk, 'APPROVED'), ('borrow_request', competing.pk, 'DENIED'), ('item', self.item.pk, 'RESERVED')],
+        )
+
+    def test_overdue_sweep(self):
+        yesterday = timezone.localdate() - timezone.timedelta(days=1)
+        loan = BorrowRequest.objects.create(
+            item=self.item, borrower=self.bob, status='APPROVED', start_date=yesterday, end_date=yesterday,
+            due_date=reservations.due_at(yesterday),
+        )
+        RecordingBackend.events = []
+        with self.captureOnCommitCallbacks(execute=True):
+            overdue.sweep()
+        both = sorted([self.alice.pk, self.bob.pk])
+        self.assertEqual(
+            [(user_ids, event['type']) for user_ids, event in RecordingBackend.events],
+            [(both, 'message'), (both, 'borrow_request')],
+        )
+        self.assertEqual((RecordingBackend.events[1][1]['id'], RecordingBackend.events[1][1]['status']), (loan.pk, 'OVERDUE'))
+
+
+class BrokerTests(SimpleTestCase):
+
+    async def test_delivers_to_each_users_streams(self):
+        broker = realtime.Broker()
+        first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+        broker.deliver([1], {'type': 'message', 'id': 7})
+        await asyncio.sleep(0)
+        self.assertEqual([first.get_nowait(), second.get_nowait()], [{'type': 'message', 'id': 7}] * 2)
+        self.assertTrue(other.empty())
+        broker.unsubscribe(1, first)
+        broker.deliver([1, 2], {'type': 'item', 'id': 3})
+        await asyncio.sleep(0)
+        self.assertTrue(first.empty())
+        self.assertEqual([second.qsize(), other.qsize()], [1, 1])
+
+    async def test_slow_stream_is_told_to_resync(self):
+        broker = realtime.Broker()
+        queue = broker.subscribe(1)
+        for pk in range(realtime.QUEUE_SIZE + 1):
+            broker.deliver([1], {'type': 'message', 'id': pk})
+        await asyncio.sleep(0)
+        self.assertEqual(queue.get_nowait(), realtime.RESYNC)
+        self.assertTrue(queue.empty())
+
+
+class EventStreamAuthTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.api = APIClient()
+        self.api.force_authenticate(self.alice)
+
+    def test_requires_credentials(self):
+        self.assertEqual(self.client.get('/api/events/').status_code, 401)
+        self.assertEqual(self.client.get('/api/events/?ticket=made-up').status_code, 401)
+        self.assertEqual(self.client.post('/api/events/ticket/').status_code, 401)
+
+    def test_jwt_is_not_accepted_in_the_url(self):
+        token = str(RefreshToken.for_user(self.alice).access_token)
+        self.assertEqual(self.client.get(f'/api/events/?token={token}').status_code, 401)
+
+    def test_ticket_works_once(self):
+        ticket = self.api.post('/api/events/ticket/').json()['ticket']
+        self.assertEqual(realtime.redeem_ticket(ticket), self.alice)
+        self.assertIsNone(realtime.redeem_ticket(ticket))
+        self.assertEqual(self.client.get(f'/api/events/?ticket={ticket}').status_code, 401)
+
+    @override_settings(REALTIME_TICKET_TTL=0)
+    def test_ticket_expires(self):
+        ticket = realtime.issue_ticket(self.alice)
+        self.assertIsNone(realtime.redeem_ticket(ticket))
+
+    async def test_ticket_opens_the_stream(self):
+        ticket = await sync_to_async(realtime.issue_ticket)(self.alice)
+        response = await self.async_client.get(f'/api/events/?ticket={ticket}')
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'text/event-stream'))
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 5000\n\n')
+        await chunks.aclose()
@@ -0,0 +1,53 @@
+"""
+Upload size limits enforced while the request body is being parsed.
+
+SizeLimitedUploadHandler runs ahead of Django's default handlers and aborts as
+soon as the declared Content-Length, or the bytes actually received for a
+file, go over MAX_UPLOAD_SIZE, so an oversized image is never buffered in
+memory or spooled to disk in full.
+"""
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Room for the multipart boundaries and the item's other form fields
+FORM_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Uploaded file is too large.'
+    default_code = 'upload_too_large'
+
+    def __init__(self, limit=None):
+        limit = limit or getattr(settings, 'MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+        super().__init__(f'Uploaded file is too large (limit {filesizeformat(limit)}).')
+
+
+class SizeLimitedUploadHandler(FileUploadHandler):
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.limit = getattr(settings, 'MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+        self.received = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length and content_length > self.limit + FORM_OVERHEAD:
+            raise UploadTooLarge(self.limit)
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.limit:
+            raise UploadTooLarge(self.limit)
+        # Hand the chunk on to the memory/temporary file handlers
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
@@ -1,12 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ItemViewSet, InspectionReportViewSet, BorrowRequestViewSet, MessageViewSet, RegisterView, UserView, RatingViewSet, UserPointsViewSet, PointTransactionViewSet, ItemApprovalViewSet
+from . import realtime
+from .views import ItemViewSet, InspectionReportViewSet, BorrowRequestViewSet, ConversationViewSet, MessageViewSet, RegisterView, UserView, RatingViewSet, UserPointsViewSet, PointTransactionViewSet, ItemApprovalViewSet, CountersView, ExportView, StreamTicketView
 
 router = DefaultRouter()
 router.register(r'items', ItemViewSet)
 router.register(r'inspection-reports', InspectionReportViewSet)
 router.register(r'borrow-requests', BorrowRequestViewSet)
 router.register(r'messages', MessageViewSet)
+router.register(r'conversations', ConversationViewSet)
 router.register(r'ratings', RatingViewSet)
 router.register(r'user-points', UserPointsViewSet)
 router.register(r'point-transactions', PointTransactionViewSet)
@@ -16,4 +18,8 @@ urlpatterns = [
     path('', include(router.urls)),
     path('register/', RegisterView.as_view(), name='register'),
     path('user/', UserView.as_view(), name='user'),
+    path('counters/', CountersView.as_view(), name='counters'),
+    path('events/', realtime.event_stream, name='events'),
+    path('events/ticket/', StreamTicketView.as_view(), name='events-ticket'),
+    path('export/<str:dataset>.<str:file_format>', ExportView.as_view(), name='export'),
 ]
@@ -0,0 +1,70 @@
+"""
+Version counters for cached and conditional responses.
+
+A scope's version changes whenever data in that scope is written (the model
+signals call `bump`). Versions are millisecond timestamps that only move
+forward, so they double as last-modified times and a counter lost from the
+cache (eviction, restart) comes back as a newer value, never a reused one.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+CATALOG = 'catalog'
+ALL_BORROWS = 'borrows:all'
+
+
+def borrows_scope(user_id):
+    return f'borrows:{user_id}'
+
+
+def messages_scope(user_id):
+    return f'messages:{user_id}'
+
+
+def points_scope(user_id):
+    return f'points:{user_id}'
+
+
+def _cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _key(scope):
+    return f'things:version:{scope}'
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def get_version(scope):
+    cache = _cache()
+    version = cache.get(_key(scope))
+    if version is None:
+        # add() so concurrent first readers agree on the starting version
+        cache.add(_key(scope), _now_ms(), timeout=None)
+        version = cache.get(_key(scope)) or _now_ms()
+    return version
+
+
+def get_versions(scopes):
+    cache = _cache()
+    found = cache.get_many([_key(scope) for scope in scopes])
+    return [found.get(_key(scope)) or get_version(scope) for scope in scopes]
+
+
+def bump(*scopes):
+    """Move `scopes` to a new version once the current transaction commits"""
+    def do_bump():
+        cache = _cache()
+        for scope in scopes:
+            try:
+                version = cache.incr(_key(scope))
+            except ValueError:
+                version = 0
+            if version < _now_ms():
+                cache.set(_key(scope), _now_ms(), timeout=None)
+    transaction.on_commit(do_bump)
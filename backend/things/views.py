@@ -1,14 +1,28 @@
-from rest_framework import viewsets, status
+import datetime
+
+from rest_framework import serializers, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView as TokenObtainPairViewBase
 from django.utils import timezone
 from django.contrib.auth import authenticate
-from .models import User, Item, InspectionReport, BorrowRequest, Message, Rating, UserPoints, PointTransaction
-from .serializers import UserSerializer, ItemSerializer, InspectionReportSerializer, BorrowRequestSerializer, MessageSerializer, RatingSerializer, PointTransactionSerializer, UserPointsSerializer
+from django.http import Http404, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import F, Q
+from .models import User, Item, InspectionReport, BorrowRequest, Conversation, Message, Rating, UserPoints, PointTransaction
+from .serializers import UserSerializer, ItemSerializer, InspectionReportSerializer, BorrowRequestSerializer, ConversationSerializer, MessageSerializer, RatingSerializer, PointTransactionSerializer, UserPointsSerializer
+from .pagination import ConversationPagination, KeysetPagination, SearchPagination, ThreadPagination, union_all
+from .query_planning import QueryPlanningMixin, plan_queryset
+from .search import search_items
+from .facets import FACET_FIELDS, facet_counts
+from .response_cache import cached_response
+from .conditional import conditional_get
+from . import bulk, conversations, counters, decisions, export, geo, images, realtime, reservations, versioning
+from .versioning import CATALOG
 
 class IsCustomer(IsAuthenticated):
     def has_permission(self, request, view):
@@ -65,27 +79,46 @@ class CustomTokenObtainPairView(TokenObtainPairViewBase):
     """Custom token view using our custom serializer"""
     serializer_class = CustomTokenObtainPairSerializer
 
-class ItemViewSet(viewsets.ModelViewSet):
+class ItemViewSet(QueryPlanningMixin, viewsets.ModelViewSet):
     queryset = Item.objects.all()
     serializer_class = ItemSerializer
+    pagination_class = KeysetPagination
 
     def get_permissions(self):
         # Allow public access to list and retrieve (browsing)
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'public_list', 'search', 'facets', 'nearby', 'similar', 'availability']:
             return [AllowAny()]
         # Require customer role for create, update, delete
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'bulk_create', 'update', 'partial_update', 'destroy']:
             return [IsCustomer()]
         return [IsAuthenticated()]
 
+    def get_visible_branches(self):
+        """
+        Disjoint querysets whose union is everything the user may browse:
+        approved items, plus the user's own items that aren't approved. Each
+        branch is served by its own index and, being disjoint, they can be
+        combined with UNION ALL instead of an OR + DISTINCT.
+        """
+        branches = [Item.objects.filter(status='APPROVED')]
+        if self.request.user.is_authenticated:
+            branches.append(Item.objects.filter(owner=self.request.user).exclude(status='APPROVED'))
+        return branches
+
     def get_queryset(self):
         # For list/retrieve, show all approved items (public)
         # But also show own items for authenticated users (pending/rejected/approved)
-        if self.action in ['list', 'retrieve']:
+        if self.action == 'availability':
+            # Reserved and lent-out items keep their calendar
+            listed = ~Q(status__in=reservations.UNLISTED_STATUSES)
+            if self.request.user.is_authenticated:
+                listed |= Q(owner=self.request.user)
+            return Item.objects.filter(listed)
+        if self.action in ['list', 'retrieve', 'search', 'similar']:
             queryset = Item.objects.filter(status='APPROVED')
             if self.request.user.is_authenticated:
-                my_items = Item.objects.filter(owner=self.request.user)
-                queryset = (queryset | my_items).distinct()
+                # Single table, so the OR can't produce duplicates
+                queryset = Item.objects.filter(Q(status='APPROVED') | Q(owner=self.request.user))
             return queryset
             
         # For management actions, authenticated users can only manage their own items
@@ -93,17 +126,191 @@ class ItemViewSet(viewsets.ModelViewSet):
             return Item.objects.filter(owner=self.request.user)
         return Item.objects.none()
 
+    def get_version_scopes(self):
+        if self.action == 'availability':
+            return [CATALOG, versioning.ALL_BORROWS]
+        return [CATALOG]
+
+    @conditional_get
+    @cached_response(CATALOG)
+    def list(self, request, *args, **kwargs):
+        branches = [self.filter_queryset(branch) for branch in self.get_visible_branches()]
+        page = self.paginate_queryset(branches)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        items = union_all(branches).order_by('-created_at', '-id')
+        serializer = self.get_serializer(items, many=True)
+        return Response(serializer.data)
+
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
+        item = serializer.save(owner=self.request.user)
+        images.schedule_variants(item)
+
+    def perform_update(self, serializer):
+        item = serializer.save()
+        if 'image' in serializer.validated_data:
+            images.schedule_variants(item)
+
+    @conditional_get
+    @cached_response(CATALOG)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        """
+        Create up to bulk.MAX_REQUEST_ITEMS items from a JSON list in one
+        transaction. Nothing is created unless every entry is valid; errors are
+        reported per list index.
+        """
+        rows = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({'error': 'Send a non-empty list of items'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > bulk.MAX_REQUEST_ITEMS:
+            return Response(
+                {'error': f'At most {bulk.MAX_REQUEST_ITEMS} items per request'}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = self.get_serializer(data=rows, many=True)
+        if not serializer.is_valid():
+            errors = [{'index': index, 'errors': error} for index, error in enumerate(serializer.errors) if error]
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        items = bulk.create_items(request.user, serializer.validated_data)
+        return Response(
+            {'created': len(items), 'results': self.get_serializer(items, many=True).data},
+            status=status.HTTP_201_CREATED,
+        )
 
     @action(detail=False, methods=['get'], permission_classes=[AllowAny])
+    @conditional_get
+    @cached_response(CATALOG)
     def public_list(self, request):
         """Public endpoint for non-authenticated users to browse approved items"""
-        items = Item.objects.filter(status='APPROVED')
+        items = self.filter_queryset(Item.objects.filter(status='APPROVED'))
+        page = self.paginate_queryset(items)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(items, many=True)
         return Response(serializer.data)
 
-class InspectionReportViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny], pagination_class=SearchPagination)
+    def search(self, request):
+        """Relevance-ranked full-text search over name, category and description"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Query parameter q is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = self.filter_queryset(search_items(self.get_queryset(), query))
+        page = self.paginate_queryset(items)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny], pagination_class=SearchPagination)
+    @conditional_get
+    @cached_response(CATALOG)
+    def nearby(self, request):
+        """
+        Approved items within ?radius= km (default 10) of ?lat=&lon=, a
+        gazetteer place given as ?near=, or the user's own location, nearest
+        first with `distance_km` added.
+        """
+        try:
+            radius = float(request.query_params.get('radius', 10))
+        except ValueError:
+            return Response({'error': 'radius must be a number of kilometres'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius <= 500:
+            return Response({'error': 'radius must be between 0 and 500 km'}, status=status.HTTP_400_BAD_REQUEST)
+        origin, error = self.nearby_origin(request)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One (status, geohash) index range scan per covering cell, then the exact cut.
+        # The cells are disjoint; an OR of the ranges would only use the status prefix
+        candidates = union_all([
+            Item.objects.filter(status='APPROVED', **geo.prefix_range(prefix)).values_list('id', 'latitude', 'longitude')
+            for prefix in geo.covering_prefixes(*origin, radius)
+        ])
+        ranked = sorted(
+            (distance, pk)
+            for pk, latitude, longitude in candidates
+            for distance in [geo.distance_km(*origin, latitude, longitude)]
+            if distance <= radius
+        )
+
+        page = self.paginate_queryset(ranked)
+        items = {item.pk: item for item in self.filter_queryset(Item.objects.filter(pk__in=[pk for _, pk in page]))}
+        rows = [(distance, items[pk]) for distance, pk in page if pk in items]
+        data = self.get_serializer([item for _, item in rows], many=True).data
+        for row, (distance, _) in zip(data, rows):
+            row['distance_km'] = round(distance, 2)
+        return self.get_paginated_response(data)
+
+    def nearby_origin(self, request):
+        params = request.query_params
+        if 'lat' in params or 'lon' in params:
+            try:
+                latitude, longitude = float(params['lat']), float(params['lon'])
+            except (KeyError, ValueError):
+                return None, 'lat and lon must both be given as numbers'
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                return None, 'lat/lon out of range'
+            return (latitude, longitude), None
+        if params.get('near'):
+            point = geo.geocode(params['near'])
+            return (point, None) if point else (None, f"Unknown place: {params['near']}")
+        user = request.user
+        if user.is_authenticated and user.latitude is not None:
+            return (user.latitude, user.longitude), None
+        return None, 'Give lat and lon, near, or set a location on your profile'
+
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny])
+    @conditional_get
+    @cached_response(CATALOG)
+    def similar(self, request, pk=None):
+        """Approved items most like this one, read from the precomputed neighbour lists"""
+        item = self.get_object()
+        items = self.filter_queryset(
+            Item.objects.filter(similar_to__item_id=item.pk, status='APPROVED')
+            .annotate(similarity=F('similar_to__score'))
+            .order_by('similar_to__rank')
+        )
+        data = self.get_serializer(items, many=True).data
+        for row, item in zip(data, items):
+            row['similarity'] = round(item.similarity, 4)
+        return Response(data)
+
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny])
+    @conditional_get
+    def availability(self, request, pk=None):
+        """Booked ranges and free days for ?month=YYYY-MM (default: this month) or ?start=&end="""
+        item = self.get_object()
+        try:
+            if 'start' in request.query_params or 'end' in request.query_params:
+                start = datetime.date.fromisoformat(request.query_params['start'])
+                end = datetime.date.fromisoformat(request.query_params['end'])
+            else:
+                start, end = reservations.month_window(
+                    request.query_params.get('month') or timezone.localdate().strftime('%Y-%m')
+                )
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Use month=YYYY-MM, or start and end as YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if end < start or (end - start).days >= reservations.MAX_CALENDAR_DAYS:
+            return Response(
+                {'error': f'The range must be 1 to {reservations.MAX_CALENDAR_DAYS} days'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(dict(item=item.pk, **reservations.calendar(item.pk, start, end)))
+
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny])
+    def facets(self, request):
+        """Item counts per category, ownership type and status for the current filters"""
+        filters = {field: request.query_params.get(field) for field in FACET_FIELDS}
+        return Response(facet_counts(request.user, filters))
+
+class InspectionReportViewSet(QueryPlanningMixin, viewsets.ModelViewSet):
     queryset = InspectionReport.objects.all()
     serializer_class = InspectionReportSerializer
     permission_classes = [IsStaff]
@@ -158,14 +365,15 @@ class InspectionReportViewSet(viewsets.ModelViewSet):
         serializer = ItemSerializer(item)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-class BorrowRequestViewSet(viewsets.ModelViewSet):
+class BorrowRequestViewSet(QueryPlanningMixin, viewsets.ModelViewSet):
     queryset = BorrowRequest.objects.all()
     serializer_class = BorrowRequestSerializer
+    pagination_class = KeysetPagination
 
     def get_permissions(self):
         if self.action == 'create':
             return [IsCustomer()]
-        elif self.action in ['approve', 'deny', 'return_item']:
+        elif self.action in ['approve', 'deny', 'decide', 'return_item']:
             # Allow authenticated users (owner can approve/deny, borrower can return)
             return [IsAuthenticated()]
         return [IsAuthenticated()]
@@ -174,112 +382,280 @@ class BorrowRequestViewSet(viewsets.ModelViewSet):
         # Show all borrow requests for customers (both sent and received)
         # Staff can see all requests
         if self.request.user.role == 'CUSTOMER':
-            # Return requests where user is borrower OR owner of the item
-            from django.db.models import Q
+            # Return requests where user is borrower OR owner of the item.
+            # The owner side goes through an item subquery so each branch of
+            # the OR can use its own index instead of scanning the join.
+            owned_items = Item.objects.filter(owner=self.request.user).values('id')
             return BorrowRequest.objects.filter(
-                Q(borrower=self.request.user) | Q(item__owner=self.request.user)
+                Q(borrower=self.request.user) | Q(item__in=owned_items)
             )
         return BorrowRequest.objects.all()
 
+    def get_visible_branches(self, side=None):
+        """
+        Disjoint querysets for the user's requests: the ones they sent
+        (borrower index) and the ones received for items they own (an owned
+        item subquery probing the item index). `side` picks one of them.
+        """
+        user = self.request.user
+        owned_items = Item.objects.filter(owner=user).values('id')
+        branches = {
+            'sent': BorrowRequest.objects.filter(borrower=user),
+            # Excluding the user as borrower keeps the branches disjoint for UNION ALL
+            'received': BorrowRequest.objects.filter(item__in=owned_items).exclude(borrower=user),
+        }
+        if side is not None:
+            return [branches[side]]
+        return list(branches.values())
+
+    def get_version_scopes(self):
+        # Rows embed item name/status, so item changes count too
+        if self.request.user.role == 'CUSTOMER' or self.action in ['sent', 'received']:
+            return [versioning.borrows_scope(self.request.user.pk), CATALOG]
+        return [versioning.ALL_BORROWS, CATALOG]
+
+    def list_branches(self, branches):
+        branches = [self.filter_queryset(branch) for branch in branches]
+        page = self.paginate_queryset(branches)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        requests = union_all(branches).order_by('-created_at', '-id')
+        serializer = self.get_serializer(requests, many=True)
+        return Response(serializer.data)
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        if request.user.role == 'CUSTOMER':
+            return self.list_branches(self.get_visible_branches())
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    @conditional_get
+    def sent(self, request):
+        """Requests the current user made to borrow other people's items"""
+        return self.list_branches(self.get_visible_branches('sent'))
+
+    @action(detail=False, methods=['get'])
+    @conditional_get
+    def received(self, request):
+        """Requests other users made for the current user's items"""
+        return self.list_branches(self.get_visible_branches('received'))
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        # Check if user already has a pending or approved request for this item
+        # Check if user already has a pending or approved request for this item in those dates
         item = serializer.validated_data.get('item')
-        existing_request = BorrowRequest.objects.filter(
+        start, end = serializer.validated_data['start_date'], serializer.validated_data['end_date']
+        existing_request = reservations.overlapping(BorrowRequest.objects.filter(
             borrower=self.request.user,
             item=item,
-            status__in=['PENDING', 'APPROVED']
-        ).first()
+            status__in=['PENDING', 'APPROVED', 'OVERDUE']
+        ), start, end).first()
         
         if existing_request:
             raise serializers.ValidationError({
                 'error': 'You already have a pending or approved request for this item'
             })
+
+        if reservations.conflicts(item.pk, start, end).exists():
+            raise serializers.ValidationError({'error': 'The item is already booked for some of those dates'})
         
         serializer.save(borrower=self.request.user)
 
+    def lock_for_transition(self):
+        """
+        The request and its item, re-read under row locks inside the caller's
+        transaction. The item is always locked first, so concurrent transitions
+        on one item queue up behind each other instead of deadlocking.
+        """
+        visible = self.get_object()
+        item = Item.objects.select_for_update().get(pk=visible.item_id)
+        borrow_request = BorrowRequest.objects.select_for_update().get(pk=visible.pk)
+        borrow_request.item = item
+        return borrow_request, item
+
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
-        borrow_request = self.get_object()
-        
-        # Check if user is the item owner
-        if borrow_request.item.owner != request.user:
-            return Response({'error': 'Only the item owner can approve this request'}, status=status.HTTP_403_FORBIDDEN)
-        
-        if borrow_request.status != 'PENDING':
-            return Response({'error': 'Request already processed'}, status=status.HTTP_400_BAD_REQUEST)
-
-        borrow_request.status = 'APPROVED'
-        borrow_request.due_date = timezone.now() + timezone.timedelta(days=7)  # example due date
-        borrow_request.save()
-
-        borrow_request.item.status = 'RESERVED'
-        borrow_request.item.save()
+        with transaction.atomic():
+            borrow_request, item = self.lock_for_transition()
+
+            # Check if user is the item owner
+            if item.owner_id != request.user.pk:
+                return Response({'error': 'Only the item owner can approve this request'}, status=status.HTTP_403_FORBIDDEN)
+
+            if borrow_request.status != 'PENDING':
+                return Response({'error': 'Request already processed'}, status=status.HTTP_400_BAD_REQUEST)
+
+            start, end = borrow_request.start_date, borrow_request.end_date
+            if reservations.conflicts(item.pk, start, end, exclude=borrow_request.pk).exists():
+                return Response({'error': 'The item is already booked for some of those dates'}, status=status.HTTP_409_CONFLICT)
+
+            borrow_request.status = 'APPROVED'
+            borrow_request.due_date = reservations.due_at(end)
+            borrow_request.save(update_fields=['status', 'due_date'])
+
+            # Bookings that start later leave the item browsable until then
+            if start <= timezone.localdate() and item.status != 'RESERVED':
+                item.status = 'RESERVED'
+                item.save(update_fields=['status'])
+
+            # Those dates are taken, so every other pending request overlapping them is denied in one statement
+            competing = list(
+                reservations.overlapping(
+                    BorrowRequest.objects.select_for_update().filter(item=item, status='PENDING'), start, end
+                ).values_list('id', 'borrower_id')
+            )
+            if competing:
+                BorrowRequest.objects.filter(pk__in=[pk for pk, _ in competing]).update(status='DENIED')
+                counters.add(counters.PENDING_REQUESTS, {item.owner_id: -len(competing)})
+                for competing_id, borrower_id in competing:
+                    realtime.request_changed(competing_id, item.pk, borrower_id, item.owner_id, 'DENIED')
+                # update() skips the signals that invalidate cached borrow lists
+                versioning.bump(
+                    versioning.ALL_BORROWS,
+                    versioning.borrows_scope(item.owner_id),
+                    *{versioning.borrows_scope(borrower_id) for _, borrower_id in competing},
+                )
 
         serializer = self.get_serializer(borrow_request)
         return Response(serializer.data)
 
     @action(detail=True, methods=['post'])
     def deny(self, request, pk=None):
-        borrow_request = self.get_object()
-        
-        # Check if user is the item owner
-        if borrow_request.item.owner != request.user:
-            return Response({'error': 'Only the item owner can deny this request'}, status=status.HTTP_403_FORBIDDEN)
-        
-        if borrow_request.status != 'PENDING':
-            return Response({'error': 'Request already processed'}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            borrow_request, item = self.lock_for_transition()
+
+            # Check if user is the item owner
+            if item.owner_id != request.user.pk:
+                return Response({'error': 'Only the item owner can deny this request'}, status=status.HTTP_403_FORBIDDEN)
+
+            if borrow_request.status != 'PENDING':
+                return Response({'error': 'Request already processed'}, status=status.HTTP_400_BAD_REQUEST)
 
-        borrow_request.status = 'DENIED'
-        borrow_request.save()
+            borrow_request.status = 'DENIED'
+            borrow_request.save(update_fields=['status'])
 
         serializer = self.get_serializer(borrow_request)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def decide(self, request):
+        """
+        Approve or deny up to decisions.MAX_REQUEST_DECISIONS requests in one
+        transaction, e.g. {"decisions": [{"id": 4, "decision": "approve"}]}.
+        Entries are applied in order and each gets its own outcome, so one
+        refused entry doesn't hold back the rest.
+        """
+        entries = request.data.get('decisions') if isinstance(request.data, dict) else request.data
+        if not isinstance(entries, list) or not entries:
+            return Response({'error': 'Send a non-empty list of decisions'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(entries) > decisions.MAX_REQUEST_DECISIONS:
+            return Response(
+                {'error': f'At most {decisions.MAX_REQUEST_DECISIONS} decisions per request'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        pairs, errors, seen = [], [], set()
+        for index, entry in enumerate(entries):
+            pk = entry.get('id') if isinstance(entry, dict) else None
+            choice = entry.get('decision') if isinstance(entry, dict) else None
+            if not isinstance(pk, int) or isinstance(pk, bool):
+                errors.append({'index': index, 'errors': {'id': 'A request id is required'}})
+            elif choice not in (decisions.APPROVE, decisions.DENY):
+                errors.append({'index': index, 'errors': {'decision': 'Must be "approve" or "deny"'}})
+            elif pk in seen:
+                errors.append({'index': index, 'errors': {'id': 'Each request may appear only once'}})
+            else:
+                seen.add(pk)
+                pairs.append((pk, choice))
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = decisions.decide(request.user, pairs)
+        return Response({
+            'approved': sum(result.get('status') == 'APPROVED' for result in results),
+            'denied': sum(result.get('status') == 'DENIED' for result in results),
+            'results': results,
+        })
+
     @action(detail=True, methods=['post'])
     def return_item(self, request, pk=None):
-        borrow_request = self.get_object()
-        
-        # Check if user is the borrower
-        if borrow_request.borrower != request.user:
-            return Response({'error': 'Only the borrower can return this item'}, status=status.HTTP_403_FORBIDDEN)
-        
-        if borrow_request.status != 'APPROVED':
-            return Response({'error': 'Item not borrowed'}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            borrow_request, item = self.lock_for_transition()
+
+            # Check if user is the borrower
+            if borrow_request.borrower_id != request.user.pk:
+                return Response({'error': 'Only the borrower can return this item'}, status=status.HTTP_403_FORBIDDEN)
+
+            if borrow_request.status not in reservations.BOOKED_STATUSES:
+                return Response({'error': 'Item not borrowed'}, status=status.HTTP_400_BAD_REQUEST)
 
-        borrow_request.status = 'RETURNED'
-        borrow_request.return_date = timezone.now()
-        borrow_request.save()
+            if borrow_request.start_date is not None and borrow_request.start_date > timezone.localdate():
+                return Response({'error': 'This booking has not started yet'}, status=status.HTTP_400_BAD_REQUEST)
 
-        borrow_request.item.status = 'RETURNED'
-        borrow_request.item.save()
+            borrow_request.status = 'RETURNED'
+            borrow_request.return_date = timezone.now()
+            borrow_request.save(update_fields=['status', 'return_date'])
+
+            # Another borrower's booking may already hold the item
+            item_status = reservations.status_after_return(item.pk, borrow_request.pk)
+            if item.status != item_status:
+                item.status = item_status
+                item.save(update_fields=['status'])
 
         serializer = self.get_serializer(borrow_request)
         return Response(serializer.data)
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(QueryPlanningMixin, viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         # Users can see messages sent to them or sent by them
         return Message.objects.filter(recipient=self.request.user) | Message.objects.filter(sender=self.request.user)
 
+    def get_version_scopes(self):
+        return [versioning.messages_scope(self.request.user.pk), CATALOG]
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         """Send a message"""
         serializer.save(sender=self.request.user)
 
     @action(detail=False, methods=['get'])
+    @conditional_get
     def inbox(self, request):
         """Get all messages sent to the current user"""
-        messages = Message.objects.filter(recipient=request.user).order_by('-created_at')
+        messages = self.filter_queryset(Message.objects.filter(recipient=request.user).order_by('-created_at'))
+        page = self.paginate_queryset(messages)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(messages, many=True)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
+    @conditional_get
     def sent(self, request):
         """Get all messages sent by the current user"""
-        messages = Message.objects.filter(sender=request.user).order_by('-created_at')
+        messages = self.filter_queryset(Message.objects.filter(sender=request.user).order_by('-created_at'))
+        page = self.paginate_queryset(messages)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(messages, many=True)
         return Response(serializer.data)
 
@@ -295,6 +671,111 @@ class MessageViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(message)
         return Response(serializer.data)
 
+class ConversationViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The user's threads, most recently active first, one row each with the
+    last message preview and their unread count. Always paginated.
+    """
+    queryset = Conversation.objects.all()
+    serializer_class = ConversationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = ConversationPagination
+
+    def get_visible_branches(self):
+        """The user's threads as the two disjoint halves served by the user_a / user_b indexes"""
+        user = self.request.user
+        related = Conversation.objects.select_related('user_a', 'user_b', 'item')
+        return [
+            related.filter(user_a=user),
+            # Notes to self are already in the user_a half
+            related.filter(user_b=user).exclude(user_a=user),
+        ]
+
+    def get_queryset(self):
+        user = self.request.user
+        return Conversation.objects.filter(Q(user_a=user) | Q(user_b=user)).select_related('user_a', 'user_b', 'item')
+
+    def get_version_scopes(self):
+        return [versioning.messages_scope(self.request.user.pk), CATALOG]
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_visible_branches())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=True, methods=['get'])
+    @conditional_get
+    def messages(self, request, pk=None):
+        """The thread's messages, newest first, a page at a time"""
+        conversation = self.get_object()
+        messages = plan_queryset(
+            Message.objects.filter(conversation=conversation).order_by('-created_at', '-id'), MessageSerializer,
+        )
+        paginator = ThreadPagination()
+        page = paginator.paginate_queryset(messages, request, view=self)
+        serializer = MessageSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """Mark every message the user received in the thread as read"""
+        conversation = self.get_object()
+        conversations.mark_read(conversation, request.user)
+        return Response(self.get_serializer(conversation).data)
+
+class CountersView(APIView):
+    """
+    Badge counts for the current user: unread messages and pending requests
+    for their items, plus items awaiting verification for staff. Served from
+    maintained counters; polls that change nothing get a 304.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_version_scopes(self):
+        scopes = [versioning.messages_scope(self.request.user.pk), versioning.borrows_scope(self.request.user.pk)]
+        if self.request.user.role == 'STAFF':
+            scopes.append(CATALOG)
+        return scopes
+
+    @conditional_get
+    def get(self, request):
+        return Response(counters.for_user(request.user))
+
+class StreamTicketView(APIView):
+    """POST: a single-use ticket for opening the event stream (see things.realtime)"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        return Response({'ticket': realtime.issue_ticket(request.user), 'expires_in': realtime.ticket_ttl()})
+
+class ExportView(APIView):
+    """
+    Streaming dump of a table: /export/<dataset>.<csv|ndjson>. Staff get every
+    row; other users only their own borrow requests and messages.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, export.ExportRenderer]
+
+    def get(self, request, dataset, file_format):
+        if dataset not in export.DATASETS or file_format not in export.FORMATS:
+            raise Http404
+        user = None if request.user.role == 'STAFF' else request.user
+        if user is not None and dataset not in export.USER_SCOPES:
+            return Response({'error': 'Only staff can export this dataset'}, status=status.HTTP_403_FORBIDDEN)
+        response = StreamingHttpResponse(
+            export.stream(dataset, file_format, user=user), content_type=export.FORMATS[file_format],
+        )
+        stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+        response['Content-Disposition'] = f'attachment; filename="{dataset}-{stamp}.{file_format}"'
+        # Stop nginx from buffering the whole dump before passing it on
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 class RegisterView(APIView):
     permission_classes = [AllowAny]
 
@@ -344,7 +825,7 @@ class UserView(APIView):
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class RatingViewSet(viewsets.ModelViewSet):
+class RatingViewSet(QueryPlanningMixin, viewsets.ModelViewSet):
     """ViewSet for managing product ratings by staff"""
     queryset = Rating.objects.all()
     serializer_class = RatingSerializer
@@ -383,7 +864,11 @@ class UserPointsViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = UserPointsSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_version_scopes(self):
+        return [versioning.points_scope(self.request.user.pk)]
+
     @action(detail=False, methods=['get'])
+    @conditional_get
     def my_points(self, request):
         """Get current user's points"""
         points, created = UserPoints.objects.get_or_create(user=request.user)
@@ -391,22 +876,35 @@ class UserPointsViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
+    @conditional_get
     def transactions(self, request):
         """Get current user's point transactions"""
         transactions = PointTransaction.objects.filter(user=request.user)
         serializer = PointTransactionSerializer(transactions, many=True)
         return Response(serializer.data)
 
-class PointTransactionViewSet(viewsets.ReadOnlyModelViewSet):
+class PointTransactionViewSet(QueryPlanningMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for viewing point transactions"""
     queryset = PointTransaction.objects.all()
     serializer_class = PointTransactionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """Users can only see their own transactions"""
         return PointTransaction.objects.filter(user=self.request.user)
 
+    def get_version_scopes(self):
+        return [versioning.points_scope(self.request.user.pk)]
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 class ItemApprovalViewSet(viewsets.ViewSet):
     """ViewSet for staff to approve/reject items"""
     permission_classes = [IsStaff]
@@ -414,7 +912,7 @@ class ItemApprovalViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['get'])
     def pending_items(self, request):
         """Get all pending items for verification"""
-        items = Item.objects.filter(status='PENDING_VERIFICATION')
+        items = plan_queryset(Item.objects.filter(status='PENDING_VERIFICATION'), ItemSerializer)
         serializer = ItemSerializer(items, many=True)
         return Response(serializer.data)
 
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { borrowService } from '../services/borrowService.js';
+import { subscribeToEvents } from '../services/eventService.js';
 import { itemService } from '../services/itemService.js';
 import { useAuth } from '../context/AuthContext.jsx';
 import { FaClipboardList, FaPaperPlane, FaInbox, FaCheck, FaTimes, FaUndo } from 'react-icons/fa';
@@ -19,9 +20,12 @@ export default function BorrowRequests() {
     loadRequests();
   }, []);
 
-  const loadRequests = async () => {
+  // Pushed status changes replace reloading the page to see them
+  useEffect(() => subscribeToEvents(['borrow_request', 'item'], () => loadRequests(true)), [user?.id]);
+
+  const loadRequests = async (quiet = false) => {
     try {
-      setLoading(true);
+      if (!quiet) setLoading(true);
       const data = await borrowService.getBorrowRequests();
       const allRequests = Array.isArray(data) ? data : [];
       
@@ -165,6 +169,7 @@ export default function BorrowRequests() {
                        </h3>
                        <span className={`status-badge ${
                          request.status === 'APPROVED' ? 'status-badge-available' : 
+                         request.status === 'OVERDUE' ? 'status-badge-rejected' :
                          request.status === 'PENDING' ? 'status-badge-pending' : 'status-badge-borrowed'
                        }`}>
                          {request.status}
@@ -232,7 +237,7 @@ export default function BorrowRequests() {
                   )}
 
                   {/* Actions for sent requests (you are the borrower) */}
-                  {activeTab === 'sent' && request.status === 'APPROVED' && !request.return_date && (
+                  {activeTab === 'sent' && (request.status === 'APPROVED' || request.status === 'OVERDUE') && !request.return_date && (
                     <button
                       onClick={() => handleReturn(request.id)}
                       disabled={actionLoading === request.id}
@@ -249,6 +254,11 @@ export default function BorrowRequests() {
                       Awaiting owner's blessing...
                     </div>
                   )}
+                  {request.status === 'OVERDUE' && (
+                    <p className="flex items-center gap-2 text-red-600 italic text-sm">
+                      <FaUndo className="text-xs" /> {activeTab === 'sent' ? 'This item is past its due date. Please return it.' : 'The borrower has not returned this item yet.'}
+                    </p>
+                  )}
                   {request.status === 'DENIED' && (
                     <p className="flex items-center gap-2 text-red-600 italic text-sm">
                       <FaTimes className="text-xs" /> This request was not accepted.
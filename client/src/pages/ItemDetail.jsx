@@ -50,7 +50,7 @@ export default function ItemDetail() {
       const existing = requests.find(
         req => req.item === parseInt(id) && 
         req.borrower === user?.id &&
-        (req.status === 'PENDING' || req.status === 'APPROVED')
+        (req.status === 'PENDING' || req.status === 'APPROVED' || req.status === 'OVERDUE')
       );
       setExistingRequest(existing);
     } catch (err) {
@@ -229,9 +229,11 @@ export default function ItemDetail() {
                 {!isOwner && isCustomer && existingRequest && (
                   <div className="card bg-[#f8fcf5] border-[#3a5333]/20 p-6 text-center shadow-inner">
                     <p className={`text-lg font-bold mb-1 ${
-                      existingRequest.status === 'APPROVED' ? 'text-emerald-600' : 'text-amber-600'
+                      existingRequest.status === 'APPROVED' ? 'text-emerald-600' :
+                      existingRequest.status === 'OVERDUE' ? 'text-red-600' : 'text-amber-600'
                     }`}>
-                      {existingRequest.status === 'PENDING' ? '⏳ Request Pending' : '✅ Request Approved'}
+                      {existingRequest.status === 'PENDING' ? '⏳ Request Pending' :
+                       existingRequest.status === 'OVERDUE' ? '⚠️ Return Overdue' : '✅ Request Approved'}
                     </p>
                     <p className="text-xs text-[#56624e] mb-4">
                       {existingRequest.status === 'PENDING' 
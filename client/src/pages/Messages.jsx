@@ -1,8 +1,9 @@
 import React, { useState, useEffect } from 'react';
 import { useLocation } from 'react-router-dom';
 import api from '../services/api.js';
+import { subscribeToEvents } from '../services/eventService.js';
 import { useAuth } from '../context/AuthContext.jsx';
-import { FaPaperPlane, FaInbox, FaEnvelope, FaRegEnvelope, FaUser, FaClock, FaTag, FaChevronDown, FaChevronUp, FaPlus, FaTimes } from 'react-icons/fa';
+import { FaPaperPlane, FaInbox, FaEnvelope, FaUser, FaClock, FaTag, FaChevronDown, FaChevronUp, FaPlus, FaTimes } from 'react-icons/fa';
 
 const messageService = {
   sendMessage: async (recipientId, subject, body) => {
@@ -13,33 +14,32 @@ const messageService = {
     });
     return response.data;
   },
-  getInbox: async () => {
-    const response = await api.get('/messages/inbox/');
+  // Threads a page at a time; `next` is the absolute URL of the following page
+  getConversations: async (next = null) => {
+    const response = await api.get(next || '/conversations/');
     return response.data;
   },
-  getSent: async () => {
-    const response = await api.get('/messages/sent/');
+  getThread: async (conversationId, next = null) => {
+    const response = await api.get(next || `/conversations/${conversationId}/messages/`);
     return response.data;
   },
-  markAsRead: async (messageId) => {
-    const response = await api.post(`/messages/${messageId}/mark_as_read/`);
-    return response.data;
-  },
-  getMessages: async () => {
-    const response = await api.get('/messages/');
+  markThreadRead: async (conversationId) => {
+    const response = await api.post(`/conversations/${conversationId}/read/`);
     return response.data;
   }
 };
 
 export default function Messages() {
-  const [inbox, setInbox] = useState([]);
-  const [sent, setSent] = useState([]);
+  const [conversations, setConversations] = useState([]);
+  const [nextConversations, setNextConversations] = useState(null);
+  const [selected, setSelected] = useState(null);
+  const [thread, setThread] = useState([]);
+  const [nextThread, setNextThread] = useState(null);
+  const [threadLoading, setThreadLoading] = useState(false);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [success, setSuccess] = useState('');
-  const [tab, setTab] = useState('inbox');
   const [showCompose, setShowCompose] = useState(false);
-  const [selectedMessage, setSelectedMessage] = useState(null);
   const [formData, setFormData] = useState({
     recipientId: '',
     subject: '',
@@ -50,9 +50,15 @@ export default function Messages() {
   const location = useLocation();
 
   useEffect(() => {
-    loadMessages();
+    loadConversations();
   }, []);
 
+  // New messages arrive over the event stream instead of on the next page load
+  useEffect(() => subscribeToEvents(['message'], () => {
+    loadConversations(true);
+    if (selected) loadThread(selected, true);
+  }), [user?.id, selected?.id]);
+
   useEffect(() => {
     // Check if coming from browse with item contact
     if (location.state?.recipientId) {
@@ -65,21 +71,13 @@ export default function Messages() {
     }
   }, [location.state?.recipientId]);
 
-  useEffect(() => {
-    if (tab === 'inbox') {
-      markUnreadAsRead();
-    }
-  }, [tab]);
-
-  const loadMessages = async () => {
+  // Reloads the first page only; threads further down are fetched again through "Load more"
+  const loadConversations = async (quiet = false) => {
     try {
-      setLoading(true);
-      const [inboxData, sentData] = await Promise.all([
-        messageService.getInbox(),
-        messageService.getSent()
-      ]);
-      setInbox(Array.isArray(inboxData) ? inboxData : []);
-      setSent(Array.isArray(sentData) ? sentData : []);
+      if (!quiet) setLoading(true);
+      const data = await messageService.getConversations();
+      setConversations(data.results || []);
+      setNextConversations(data.next);
       setError('');
     } catch (err) {
       setError('Failed to load messages');
@@ -89,17 +87,58 @@ export default function Messages() {
     }
   };
 
-  const markUnreadAsRead = async () => {
-    const unreadMessages = inbox.filter(msg => !msg.is_read);
-    for (const msg of unreadMessages) {
-      try {
-        await messageService.markAsRead(msg.id);
-      } catch (err) {
-        console.error('Failed to mark message as read:', err);
+  const loadMoreConversations = async () => {
+    try {
+      const data = await messageService.getConversations(nextConversations);
+      setConversations(prev => [...prev, ...(data.results || [])]);
+      setNextConversations(data.next);
+    } catch (err) {
+      setError('Failed to load messages');
+      console.error(err);
+    }
+  };
+
+  const loadThread = async (conversation, quiet = false) => {
+    try {
+      if (!quiet) setThreadLoading(true);
+      const data = await messageService.getThread(conversation.id);
+      setThread(data.results || []);
+      setNextThread(data.next);
+      // A quiet reload follows a new message, which arrives unread in the open thread
+      if (quiet || conversation.unread_count > 0) {
+        const updated = await messageService.markThreadRead(conversation.id);
+        setConversations(prev => prev.map(c => (c.id === updated.id ? updated : c)));
       }
+    } catch (err) {
+      setError('Failed to load conversation');
+      console.error(err);
+    } finally {
+      setThreadLoading(false);
     }
   };
 
+  const loadOlderMessages = async () => {
+    try {
+      const data = await messageService.getThread(selected.id, nextThread);
+      setThread(prev => [...prev, ...(data.results || [])]);
+      setNextThread(data.next);
+    } catch (err) {
+      setError('Failed to load conversation');
+      console.error(err);
+    }
+  };
+
+  const toggleConversation = (conversation) => {
+    if (selected?.id === conversation.id) {
+      setSelected(null);
+      setThread([]);
+      setNextThread(null);
+      return;
+    }
+    setSelected(conversation);
+    loadThread(conversation);
+  };
+
   const handleChange = (e) => {
     setFormData({
       ...formData,
@@ -125,7 +164,7 @@ export default function Messages() {
       setSuccess('Message sent successfully!');
       setFormData({ recipientId: '', subject: '', body: '' });
       setShowCompose(false);
-      loadMessages();
+      loadConversations();
     } catch (err) {
       setError(err.message || 'Failed to send message');
     } finally {
@@ -143,11 +182,7 @@ export default function Messages() {
     });
   };
 
-  const getRecipientName = (message) => {
-    return tab === 'inbox' ? message.sender.username : message.recipient.username;
-  };
-
-  const messages = tab === 'inbox' ? inbox : sent;
+  const unreadTotal = conversations.reduce((total, c) => total + c.unread_count, 0);
 
   return (
     <div className="page-container pb-20">
@@ -230,47 +265,19 @@ export default function Messages() {
         </div>
       )}
 
-      {/* Tabs & Layout */}
+      {/* Layout */}
       <div className="grid grid-cols-1 lg:grid-cols-12 gap-10">
         {/* Navigation Sidebar */}
         <div className="lg:col-span-3 space-y-4">
-          <button
-            onClick={() => { setTab('inbox'); setSelectedMessage(null); }}
-            className={`w-full flex items-center justify-between p-4 rounded-2xl transition-all duration-300 font-bold group ${
-              tab === 'inbox' 
-                ? 'bg-[#3a5333] text-white shadow-lg' 
-                : 'bg-white text-[#56624e] hover:bg-[#fbf7ee] border border-[#f0ebe0]'
-            }`}
-          >
-            <div className="flex items-center gap-3">
-              <FaInbox className={tab === 'inbox' ? 'text-white' : 'text-[#3a5333]'} />
-              <span>Inbox</span>
-            </div>
-            <span className={`text-[10px] px-2 py-0.5 rounded-full ${
-              tab === 'inbox' ? 'bg-white text-[#3a5333]' : 'bg-[#fbf7ee] text-[#8a997d]'
-            }`}>
-              {inbox.length}
-            </span>
-          </button>
-          
-          <button
-            onClick={() => { setTab('sent'); setSelectedMessage(null); }}
-            className={`w-full flex items-center justify-between p-4 rounded-2xl transition-all duration-300 font-bold group ${
-              tab === 'sent' 
-                ? 'bg-[#3a5333] text-white shadow-lg' 
-                : 'bg-white text-[#56624e] hover:bg-[#fbf7ee] border border-[#f0ebe0]'
-            }`}
-          >
+          <div className="w-full flex items-center justify-between p-4 rounded-2xl font-bold bg-[#3a5333] text-white shadow-lg">
             <div className="flex items-center gap-3">
-              <FaPaperPlane className={tab === 'sent' ? 'text-white' : 'text-[#3a5333]'} />
-              <span>Dispatch</span>
+              <FaInbox className="text-white" />
+              <span>Conversations</span>
             </div>
-            <span className={`text-[10px] px-2 py-0.5 rounded-full ${
-              tab === 'sent' ? 'bg-white text-[#3a5333]' : 'bg-[#fbf7ee] text-[#8a997d]'
-            }`}>
-              {sent.length}
+            <span className="text-[10px] px-2 py-0.5 rounded-full bg-white text-[#3a5333]">
+              {unreadTotal} unread
             </span>
-          </button>
+          </div>
         </div>
 
         {/* Message Content Area */}
@@ -280,68 +287,98 @@ export default function Messages() {
               <div className="w-10 h-10 border-4 border-[#3a5333] border-t-transparent rounded-full animate-spin mb-4"></div>
               <p className="text-[#8a997d] font-black uppercase tracking-widest text-[10px]">Retrieving Records...</p>
             </div>
-          ) : messages.length === 0 ? (
+          ) : conversations.length === 0 ? (
             <div className="card border-dashed border-2 py-32 flex flex-col items-center justify-center text-center">
                <div className="text-6xl text-[#d9e2c6] mb-6">
-                  {tab === 'inbox' ? <FaEnvelope /> : <FaPaperPlane />}
+                  <FaEnvelope />
                </div>
-               <h3 className="text-xl font-bold text-[#2f3b2b] mb-2">No {tab} records found</h3>
+               <h3 className="text-xl font-bold text-[#2f3b2b] mb-2">No conversations found</h3>
                <p className="text-[#56624e]">Your digital archive is currently empty.</p>
             </div>
           ) : (
             <div className="space-y-4">
-              {messages.map(message => (
+              {conversations.map(conversation => (
                 <div
-                  key={message.id}
+                  key={conversation.id}
                   className={`card transition-all duration-500 overflow-hidden border border-[#f0ebe0] ${
-                    selectedMessage?.id === message.id ? 'ring-2 ring-[#3a5333]/10 shadow-2xl scale-[1.01]' : 'hover:shadow-lg'
+                    selected?.id === conversation.id ? 'ring-2 ring-[#3a5333]/10 shadow-2xl scale-[1.01]' : 'hover:shadow-lg'
                   }`}
                 >
-                  <div 
-                    onClick={() => setSelectedMessage(selectedMessage?.id === message.id ? null : message)}
+                  <div
+                    onClick={() => toggleConversation(conversation)}
                     className={`p-6 cursor-pointer flex items-center gap-6 ${
-                      !message.is_read && tab === 'inbox' ? 'bg-[#fbf7ee]/60' : ''
+                      conversation.unread_count > 0 ? 'bg-[#fbf7ee]/60' : ''
                     }`}
                   >
                     <div className="relative">
                       <div className="w-12 h-12 rounded-full bg-[#fbf7ee] flex items-center justify-center text-[#3a5333] border border-[#d9e2c6] font-display font-bold text-lg shadow-sm">
-                        {getRecipientName(message).charAt(0).toUpperCase()}
+                        {conversation.other_user.username.charAt(0).toUpperCase()}
                       </div>
-                      {!message.is_read && tab === 'inbox' && (
+                      {conversation.unread_count > 0 && (
                         <span className="absolute -top-1 -right-1 w-4 h-4 bg-[#3a5333] border-2 border-white rounded-full"></span>
                       )}
                     </div>
 
                     <div className="flex-grow min-w-0">
                       <div className="flex justify-between items-baseline mb-1">
-                        <h3 className={`font-bold truncate ${!message.is_read && tab === 'inbox' ? 'text-[#3a5333]' : 'text-[#2f3b2b]'}`}>
-                          {getRecipientName(message)}
+                        <h3 className={`font-bold truncate ${conversation.unread_count > 0 ? 'text-[#3a5333]' : 'text-[#2f3b2b]'}`}>
+                          {conversation.other_user.username}
+                          {conversation.item_name && (
+                            <span className="ml-2 text-xs font-semibold text-[#8a997d]">· {conversation.item_name}</span>
+                          )}
                         </h3>
                         <span className="text-[10px] font-black uppercase tracking-widest text-[#8a997d] flex items-center gap-1">
-                          <FaClock size={10} /> {formatDate(message.created_at)}
+                          <FaClock size={10} /> {formatDate(conversation.last_message_at)}
                         </span>
                       </div>
-                      <p className={`text-sm truncate ${!message.is_read && tab === 'inbox' ? 'text-[#56624e] font-semibold' : 'text-[#8a997d]'}`}>
-                        {message.subject}
+                      <p className={`text-sm truncate ${conversation.unread_count > 0 ? 'text-[#56624e] font-semibold' : 'text-[#8a997d]'}`}>
+                        {conversation.last_sender === user?.id && 'You: '}{conversation.last_message_preview}
                       </p>
                     </div>
 
                     <div className="text-[#d9e2c6]">
-                      {selectedMessage?.id === message.id ? <FaChevronUp size={14} /> : <FaChevronDown size={14} />}
+                      {selected?.id === conversation.id ? <FaChevronUp size={14} /> : <FaChevronDown size={14} />}
                     </div>
                   </div>
 
-                  {selectedMessage?.id === message.id && (
-                    <div className="p-8 bg-[#fbf7ee]/30 border-t border-[#f0ebe0] animate-in fade-in duration-500">
-                      <div className="max-w-none prose prose-stone">
-                         <p className="text-[#2f3b2b] leading-relaxed whitespace-pre-wrap font-medium">
-                           {message.body}
-                         </p>
-                      </div>
+                  {selected?.id === conversation.id && (
+                    <div className="p-8 bg-[#fbf7ee]/30 border-t border-[#f0ebe0] animate-in fade-in duration-500 space-y-6">
+                      {threadLoading ? (
+                        <p className="text-[#8a997d] font-black uppercase tracking-widest text-[10px]">Retrieving Records...</p>
+                      ) : (
+                        <>
+                          {nextThread && (
+                            <button onClick={loadOlderMessages} className="text-xs font-bold text-[#3a5333] hover:underline">
+                              Show earlier messages
+                            </button>
+                          )}
+                          {/* Pages arrive newest first; the thread reads oldest first */}
+                          {[...thread].reverse().map(message => (
+                            <div key={message.id} className="max-w-none prose prose-stone">
+                              <div className="flex items-center gap-2 text-[10px] font-black uppercase tracking-widest text-[#8a997d] mb-1">
+                                <FaUser size={10} />
+                                {message.sender.id === user?.id ? 'You' : message.sender.username}
+                                <span>· {formatDate(message.created_at)}</span>
+                              </div>
+                              {message.subject && <p className="font-bold text-[#2f3b2b] mb-1">{message.subject}</p>}
+                              <p className="text-[#2f3b2b] leading-relaxed whitespace-pre-wrap font-medium">
+                                {message.body}
+                              </p>
+                            </div>
+                          ))}
+                        </>
+                      )}
                     </div>
                   )}
                 </div>
               ))}
+              {nextConversations && (
+                <div className="flex justify-center">
+                  <button onClick={loadMoreConversations} className="btn btn-primary px-8 py-3 rounded-xl">
+                    Load more
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
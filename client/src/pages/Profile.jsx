@@ -673,6 +673,7 @@ export default function Profile() {
                           <span className={`status-badge ${
                             req.status === 'APPROVED' ? 'status-badge-approved' :
                             req.status === 'DENIED' ? 'status-badge-denied' :
+                            req.status === 'OVERDUE' ? 'status-badge-rejected' :
                             req.status === 'PENDING' ? 'status-badge-pending' :
                             'bg-gray-100 text-gray-800'
                           }`}>
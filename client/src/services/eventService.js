@@ -0,0 +1,83 @@
+import api, { API_BASE_URL } from './api.js';
+
+// One Server-Sent Events stream per tab, shared by every subscriber.
+// EventSource can't send the JWT, so each connection uses a fresh
+// single-use ticket from /events/ticket/.
+const EVENT_TYPES = ['message', 'borrow_request', 'item', 'resync'];
+const RECONNECT_DELAY = 5000;
+
+const listeners = new Set();
+let source = null;
+let connecting = false;
+let reconnectTimer = null;
+// Set when a stream dropped, so subscribers refetch once the next one is open
+let missedEvents = false;
+
+const dispatch = (type) => (event) => {
+  const data = event.data ? JSON.parse(event.data) : {};
+  listeners.forEach((listener) => {
+    if (listener.types.includes(type)) {
+      listener.handler(data);
+    }
+  });
+};
+
+const scheduleReconnect = () => {
+  if (reconnectTimer || listeners.size === 0) return;
+  reconnectTimer = setTimeout(() => {
+    reconnectTimer = null;
+    connect();
+  }, RECONNECT_DELAY);
+};
+
+const connect = async () => {
+  if (source || connecting || listeners.size === 0 || !localStorage.getItem('access_token')) return;
+  connecting = true;
+  let ticket;
+  try {
+    const response = await api.post('/events/ticket/');
+    ticket = response.data.ticket;
+  } catch (error) {
+    scheduleReconnect();
+    return;
+  } finally {
+    connecting = false;
+  }
+  if (source || listeners.size === 0) return;
+  source = new EventSource(`${API_BASE_URL}/events/?ticket=${encodeURIComponent(ticket)}`);
+  EVENT_TYPES.forEach((type) => source.addEventListener(type, dispatch(type)));
+  source.onopen = () => {
+    if (missedEvents) {
+      missedEvents = false;
+      dispatch('resync')({});
+    }
+  };
+  source.onerror = () => {
+    // The ticket is spent, so the browser's own retry would be refused; reconnect with a new one
+    source.close();
+    source = null;
+    missedEvents = true;
+    scheduleReconnect();
+  };
+};
+
+const disconnect = () => {
+  clearTimeout(reconnectTimer);
+  reconnectTimer = null;
+  if (source) {
+    source.close();
+    source = null;
+  }
+};
+
+// Calls handler(data) for each event of the given types (plus 'resync', after
+// which the data should be refetched). Returns an unsubscribe function.
+export const subscribeToEvents = (types, handler) => {
+  const listener = { types: [...types, 'resync'], handler };
+  listeners.add(listener);
+  connect();
+  return () => {
+    listeners.delete(listener);
+    if (listeners.size === 0) disconnect();
+  };
+};